@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MiClinica - Benchmark de Modelos
+Memoria y tiempo de construcción de los modelos con __slots__ frente a objetos con __dict__
+"""
+
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from modulos.centro import CentroMedico
+from modulos.expediente import Expediente, ExpedienteDiferido
+from modulos.usuario import Usuario
+
+
+def crear_clase_anterior(modelo):
+    """Copia del modelo como era antes: con __dict__ y calculando siempre la fecha actual"""
+    def __init__(self, *args, **kwargs):
+        datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        modelo.__init__(self, *args, **kwargs)
+    return type(f"{modelo.__name__}ConDict", (), {'__init__': __init__})
+
+
+def filas_de_prueba(modelo, cantidad: int):
+    """Genera filas como las que se leen de los archivos DAT"""
+    fecha = "2024-05-01 10:00:00"
+    if modelo is Expediente:
+        return [[str(i), str(i % 500), str(i % 40), str(i % 5), f"Diagnóstico {i}", "Tratamiento",
+                 "Observaciones", "", "", "", "", "Historia clínica", "", "", "", "True", fecha, fecha]
+                for i in range(1, cantidad + 1)]
+    if modelo is Usuario:
+        return [[str(i), f"Nombre{i}", "Apellido", f"usuario{i}@correo.com", "paciente", "clave",
+                 str(i % 5), "True", fecha] for i in range(1, cantidad + 1)]
+    return [[str(i), f"Centro {i}", "Dirección", "5555-5555", "True", fecha] for i in range(1, cantidad + 1)]
+
+
+def medir(clase, desde_lista, filas):
+    """Construye un objeto por fila y devuelve (segundos, bytes retenidos)"""
+    # El tiempo se mide sin tracemalloc, que hace más lenta cada asignación
+    gc.collect()
+    inicio = time.perf_counter()
+    objetos = [desde_lista(clase, fila) for fila in filas]
+    segundos = time.perf_counter() - inicio
+    del objetos
+
+    gc.collect()
+    tracemalloc.start()
+    objetos = [desde_lista(clase, fila) for fila in filas]
+    retenidos, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objetos
+    return segundos, retenidos
+
+
+def main(argv=None):
+    """Compara cada modelo (y el expediente diferido) con su versión anterior basada en __dict__"""
+    parser = argparse.ArgumentParser(description="Benchmark de los modelos de MiClinica")
+    parser.add_argument("--registros", type=int, default=100_000, help="Cantidad de objetos a construir")
+    argumentos = parser.parse_args(argv)
+
+    print(f"{'Modelo':<14}{'Versión':<10}{'Tiempo (s)':>12}{'Memoria (MB)':>15}{'Bytes/obj':>12}")
+    for modelo in (Expediente, Usuario, CentroMedico):
+        filas = filas_de_prueba(modelo, argumentos.registros)
+        desde_lista = modelo.from_list.__func__
+        resultados = {}
+        versiones = [("dict", crear_clase_anterior(modelo), desde_lista), ("slots", modelo, desde_lista)]
+        if modelo is Expediente:
+            versiones.append(("diferido", ExpedienteDiferido, ExpedienteDiferido.from_list.__func__))
+        for version, clase, construir in versiones:
+            segundos, retenidos = medir(clase, construir, filas)
+            resultados[version] = (segundos, retenidos)
+            print(f"{modelo.__name__:<14}{version:<10}{segundos:>12.3f}{retenidos / 1e6:>15.1f}"
+                  f"{retenidos / argumentos.registros:>12.0f}")
+        for version in resultados:
+            if version != "dict":
+                ahorro_tiempo = 1 - resultados[version][0] / resultados["dict"][0]
+                ahorro_memoria = 1 - resultados[version][1] / resultados["dict"][1]
+                print(f"{'':<14}{'ahorro':<10}{ahorro_tiempo:>12.0%}{ahorro_memoria:>15.0%}  ({version})")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,15 +9,15 @@ import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
-from typing import List, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional
 from modulos.centro import CentroMedico
-from modulos.utils import FileManager
+from modulos.almacenamiento import AlmacenamientoBase
 
 
 class CentroDAO:
     """DAO para manejo de centros médicos en archivos DAT"""
     
-    def __init__(self, file_manager: FileManager):
+    def __init__(self, file_manager: AlmacenamientoBase):
         self.file_manager = file_manager
         self.archivo = "centros"
     
@@ -25,6 +25,10 @@ class CentroDAO:
         """Crea un nuevo centro médico"""
         return self.file_manager.insertar_registro(self.archivo, centro.to_list())
     
+    def crear_centros_lote(self, centros: Iterable[CentroMedico]) -> List[int]:
+        """Crea varios centros médicos en una sola escritura y devuelve sus IDs"""
+        return self.file_manager.insertar_registros(self.archivo, (centro.to_list() for centro in centros))
+    
     def obtener_centro_por_id(self, id_centro: int) -> Optional[CentroMedico]:
         """Obtiene un centro por su ID"""
         registro = self.file_manager.obtener_registro_por_id(self.archivo, id_centro)
@@ -32,15 +36,32 @@ class CentroDAO:
             return CentroMedico.from_list(registro)
         return None
     
-    def obtener_todos_centros(self) -> List[CentroMedico]:
-        """Obtiene todos los centros activos"""
-        registros = self.file_manager.obtener_registros(self.archivo)
-        centros = []
-        for registro in registros:
+    def iter_centros(self, solo_activos: bool = True) -> Iterator[CentroMedico]:
+        """Recorre los centros uno a uno sin cargarlos todos en memoria"""
+        for registro in self.file_manager.iter_registros(self.archivo):
+            centro = CentroMedico.from_list(registro)
+            if centro and (centro.activo or not solo_activos):
+                yield centro
+    
+    def obtener_pagina_centros(self, despues_de: int = 0, limite: int = 20) -> List[CentroMedico]:
+        """Obtiene hasta limite centros activos con ID mayor que despues_de"""
+        pagina = []
+        for registro in self.file_manager.iter_registros_desde(self.archivo, despues_de):
             centro = CentroMedico.from_list(registro)
             if centro and centro.activo:
-                centros.append(centro)
-        return centros
+                pagina.append(centro)
+                if len(pagina) == limite:
+                    break
+        return pagina
+    
+    def obtener_todos_centros(self) -> List[CentroMedico]:
+        """Obtiene todos los centros activos"""
+        return list(self.iter_centros())
+    
+    def obtener_estadisticas_centro(self, id_centro: int) -> Dict[str, Any]:
+        """Obtiene los totales del centro (usuarios por tipo, expedientes por mes y por médico)
+        a partir de los contadores que mantiene el almacenamiento"""
+        return self.file_manager.obtener_estadisticas_centro(id_centro)
     
     def actualizar_centro(self, centro: CentroMedico) -> bool:
         """Actualiza un centro existente"""
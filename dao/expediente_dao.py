@@ -5,72 +5,169 @@ MiClinica - DAO Expediente
 Data Access Object para expedientes médicos usando archivos DAT
 """
 
+import functools
 import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
-from typing import List, Optional
-from modulos.expediente import Expediente
-from modulos.utils import FileManager
+from datetime import date, datetime
+from typing import Iterable, Iterator, List, Optional, Union
+from modulos.expediente import Expediente, ExpedienteDiferido
+from modulos.almacenamiento import AlmacenamientoBase
+from modulos.planificador import Consulta
+
+Fecha = Union[str, date, datetime, None]
+
+
+def _limite_fecha(valor: Fecha, fin_del_dia: bool) -> Optional[str]:
+    """Extremo de un rango como texto "AAAA-MM-DD HH:MM:SS"; un día sin hora abarca el día entero"""
+    if valor is None:
+        return None
+    if isinstance(valor, datetime):
+        return valor.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(valor, date):
+        valor = valor.strftime("%Y-%m-%d")
+    valor = valor.strip()
+    if len(valor) == 10 and fin_del_dia:
+        return valor + " 23:59:59"
+    return valor
 
 
 class ExpedienteDAO:
-    """DAO para manejo de expedientes en archivos DAT"""
+    """DAO para manejo de expedientes en archivos DAT
+
+    Los métodos que devuelven varios expedientes usan ExpedienteDiferido: los textos
+    clínicos largos sólo se leen de la fila (o del segmento de blobs) si se consultan.
+    """
+    
+    # Columna de cada campo en las filas del archivo (la 0 es el ID), como en from_list
+    COLUMNAS = {
+        'id_expediente': 0, 'id_paciente': 1, 'id_medico': 2, 'id_centro': 3, 'diagnostico': 4,
+        'tratamiento': 5, 'observaciones': 6, 'referencia': 7, 'contrarreferencia': 8,
+        'interconsulta': 9, 'enfermeria': 10, 'historia_clinica': 11, 'consentimientos': 12,
+        'hoja_identificacion': 13, 'reporte_examenes': 14, 'activo': 15,
+        'fecha_creacion': 16, 'fecha_modificacion': 17
+    }
+    # Columnas de fecha con índice de rango
+    COLUMNAS_FECHA = {'fecha_creacion': 16, 'fecha_modificacion': 17}
+    # Campos de texto libre que abarcan buscar_expedientes y el filtro texto de consultar
+    CAMPOS_TEXTO = ('diagnostico', 'tratamiento', 'observaciones', 'interconsulta',
+                    'historia_clinica', 'reporte_examenes')
     
-    def __init__(self, file_manager: FileManager):
+    def __init__(self, file_manager: AlmacenamientoBase):
         self.file_manager = file_manager
         self.archivo = "expedientes"
+        self._leer_campo = functools.partial(self.file_manager.leer_campo, self.archivo)
+        # Índices exactos sobre paciente, médico y centro
+        for columna in (1, 2, 3):
+            self.file_manager.registrar_indice(self.archivo, columna)
+        # Índices ordenados sobre las fechas de creación y modificación
+        for columna in self.COLUMNAS_FECHA.values():
+            self.file_manager.registrar_indice_rango(self.archivo, columna)
+        self.file_manager.registrar_indice_texto(
+            self.archivo, [self.COLUMNAS[campo] for campo in self.CAMPOS_TEXTO])
     
     def crear_expediente(self, expediente: Expediente) -> int:
         """Crea un nuevo expediente"""
         return self.file_manager.insertar_registro(self.archivo, expediente.to_list())
     
+    def crear_expedientes_lote(self, expedientes: Iterable[Expediente]) -> List[int]:
+        """Crea varios expedientes en una sola escritura y devuelve sus IDs"""
+        return self.file_manager.insertar_registros(self.archivo, (expediente.to_list() for expediente in expedientes))
+    
     def obtener_expediente_por_id(self, id_expediente: int) -> Optional[Expediente]:
         """Obtiene un expediente por su ID"""
         registro = self.file_manager.obtener_registro_por_id(self.archivo, id_expediente)
         if registro:
-            return Expediente.from_list(registro)
+            return Expediente.from_list(self.file_manager.resolver_registro(self.archivo, registro))
         return None
     
+    def iter_expedientes(self, solo_activos: bool = True) -> Iterator[Expediente]:
+        """Recorre los expedientes uno a uno sin cargarlos todos en memoria"""
+        for registro in self.file_manager.iter_registros(self.archivo):
+            expediente = ExpedienteDiferido.from_list(registro, self._leer_campo)
+            if expediente and (expediente.activo or not solo_activos):
+                yield expediente
+    
+    def obtener_pagina_expedientes(self, despues_de: int = 0, limite: int = 20) -> List[Expediente]:
+        """Obtiene hasta limite expedientes activos con ID mayor que despues_de"""
+        pagina = []
+        for registro in self.file_manager.iter_registros_desde(self.archivo, despues_de):
+            expediente = ExpedienteDiferido.from_list(registro, self._leer_campo)
+            if expediente and expediente.activo:
+                pagina.append(expediente)
+                if len(pagina) == limite:
+                    break
+        return pagina
+    
     def obtener_todos_expedientes(self) -> List[Expediente]:
         """Obtiene todos los expedientes activos"""
-        registros = self.file_manager.obtener_registros(self.archivo)
-        expedientes = []
-        for registro in registros:
-            expediente = Expediente.from_list(registro)
-            if expediente and expediente.activo:
-                expedientes.append(expediente)
-        return expedientes
+        return list(self.iter_expedientes())
     
     def obtener_expedientes_por_paciente(self, id_paciente: int) -> List[Expediente]:
         """Obtiene todos los expedientes de un paciente"""
-        registros = self.file_manager.buscar_registros(self.archivo, 1, str(id_paciente))
-        expedientes = []
-        for registro in registros:
-            expediente = Expediente.from_list(registro)
-            if expediente and expediente.activo and expediente.id_paciente == id_paciente:
-                expedientes.append(expediente)
-        return expedientes
+        return self.consultar(id_paciente=id_paciente)
     
     def obtener_expedientes_por_medico(self, id_medico: int) -> List[Expediente]:
         """Obtiene todos los expedientes de un médico"""
-        registros = self.file_manager.buscar_registros(self.archivo, 2, str(id_medico))
-        expedientes = []
-        for registro in registros:
-            expediente = Expediente.from_list(registro)
-            if expediente and expediente.activo and expediente.id_medico == id_medico:
-                expedientes.append(expediente)
-        return expedientes
+        return self.consultar(id_medico=id_medico)
     
     def obtener_expedientes_por_centro(self, id_centro: int) -> List[Expediente]:
         """Obtiene todos los expedientes de un centro"""
-        registros = self.file_manager.buscar_registros(self.archivo, 3, str(id_centro))
-        expedientes = []
-        for registro in registros:
-            expediente = Expediente.from_list(registro)
-            if expediente and expediente.activo and expediente.id_centro == id_centro:
-                expedientes.append(expediente)
-        return expedientes
+        return self.consultar(id_centro=id_centro)
+    
+    def obtener_expedientes_por_rango(self, desde: Fecha, hasta: Fecha, id_centro: Optional[int] = None,
+                                      id_medico: Optional[int] = None, campo: str = "fecha_creacion",
+                                      limite: Optional[int] = None) -> List[Expediente]:
+        """Obtiene los expedientes activos con la fecha (de creación o de modificación, según
+        campo) entre desde y hasta, incluidos, del más antiguo al más reciente"""
+        return self.consultar(id_centro=id_centro, id_medico=id_medico, desde=desde, hasta=hasta,
+                              campo_fecha=campo, orden=campo, limite=limite)
+    
+    def obtener_expedientes_recientes(self, id_medico: Optional[int] = None, id_centro: Optional[int] = None,
+                                      limite: int = 10) -> List[Expediente]:
+        """Obtiene los últimos expedientes activos modificados, del más reciente al más antiguo"""
+        return self.consultar(id_centro=id_centro, id_medico=id_medico, orden="-fecha_modificacion", limite=limite)
+    
+    def _armar_consulta(self, id_centro: Optional[int] = None, id_paciente: Optional[int] = None,
+                        id_medico: Optional[int] = None, activo: Optional[bool] = True,
+                        texto: Optional[str] = None, desde: Fecha = None, hasta: Fecha = None,
+                        campo_fecha: str = "fecha_creacion", orden: Optional[str] = None,
+                        limite: Optional[int] = None) -> Consulta:
+        """Arma la consulta con los filtros indicados (None = sin filtrar por ese campo)"""
+        if campo_fecha not in self.COLUMNAS_FECHA:
+            raise ValueError(f"Campo de fecha desconocido: {campo_fecha}")
+        consulta = Consulta(self.file_manager, self.archivo, self.COLUMNAS)
+        for campo, valor in (('id_centro', id_centro), ('id_paciente', id_paciente),
+                             ('id_medico', id_medico), ('activo', activo)):
+            if valor is not None:
+                consulta.donde(campo, valor)
+        if desde is not None or hasta is not None:
+            consulta.entre(campo_fecha, _limite_fecha(desde, False), _limite_fecha(hasta, True))
+        if texto is not None:
+            consulta.contiene(texto, self.CAMPOS_TEXTO)
+        if orden is not None:
+            consulta.ordenar_por(orden)
+        return consulta.limitar(limite)
+    
+    def consultar(self, id_centro: Optional[int] = None, id_paciente: Optional[int] = None,
+                  id_medico: Optional[int] = None, activo: Optional[bool] = True,
+                  texto: Optional[str] = None, desde: Fecha = None, hasta: Fecha = None,
+                  campo_fecha: str = "fecha_creacion", orden: Optional[str] = None,
+                  limite: Optional[int] = None) -> List[Expediente]:
+        """Obtiene los expedientes que cumplen todos los filtros indicados
+
+        desde y hasta acotan campo_fecha; orden es un campo del expediente ("-campo" para
+        descendente, por omisión el ID). El planificador elige el índice más selectivo y el
+        resto de los filtros se aplica a las filas antes de crear los expedientes."""
+        registros = self._armar_consulta(id_centro, id_paciente, id_medico, activo, texto,
+                                         desde, hasta, campo_fecha, orden, limite).ejecutar()
+        expedientes = (ExpedienteDiferido.from_list(registro, self._leer_campo) for registro in registros)
+        return [expediente for expediente in expedientes if expediente]
+    
+    def explicar_consulta(self, **filtros) -> str:
+        """Explica el plan que seguiría consultar() con los mismos filtros"""
+        return self._armar_consulta(**filtros).explicar()
     
     def actualizar_expediente(self, expediente: Expediente) -> bool:
         """Actualiza un expediente existente"""
@@ -113,29 +210,11 @@ class ExpedienteDAO:
         return False
 
     def buscar_expedientes(self, termino: str) -> List[Expediente]:
-        """Busca expedientes por diagnóstico, tratamiento u observaciones"""
-        expedientes_encontrados = []
-        
-        # Buscar por diagnóstico
-        registros = self.file_manager.buscar_registros(self.archivo, 4, termino)
+        """Busca expedientes que contengan todas las palabras del término en sus campos clínicos"""
+        registros = self.file_manager.buscar_texto(self.archivo, termino)
+        expedientes = []
         for registro in registros:
-            expediente = Expediente.from_list(registro)
+            expediente = ExpedienteDiferido.from_list(registro, self._leer_campo)
             if expediente and expediente.activo:
-                expedientes_encontrados.append(expediente)
-        
-        # Buscar por tratamiento
-        registros = self.file_manager.buscar_registros(self.archivo, 5, termino)
-        for registro in registros:
-            expediente = Expediente.from_list(registro)
-            if expediente and expediente.activo and expediente not in expedientes_encontrados:
-                expedientes_encontrados.append(expediente)
-        
-        # Buscar por observaciones
-        registros = self.file_manager.buscar_registros(self.archivo, 6, termino)
-        for registro in registros:
-            expediente = Expediente.from_list(registro)
-            if expediente and expediente.activo and expediente not in expedientes_encontrados:
-                expedientes_encontrados.append(expediente)
-        
-        return expedientes_encontrados
-
+                expedientes.append(expediente)
+        return expedientes
@@ -9,21 +9,48 @@ import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
-from typing import List, Optional
+from typing import Iterable, Iterator, List, Optional
 from modulos.usuario import Usuario
-from modulos.utils import FileManager
+from modulos.almacenamiento import AlmacenamientoBase, RegistroDuplicado
+from modulos.planificador import Consulta
 
 
 class UsuarioDAO:
     """DAO para manejo de usuarios en archivos DAT"""
     
-    def __init__(self, file_manager: FileManager):
+    # Columna de cada campo en las filas del archivo (la 0 es el ID), como en from_list
+    COLUMNAS = {
+        'id_usuario': 0, 'nombre': 1, 'apellido': 2, 'email': 3, 'tipo_usuario': 4,
+        'password': 5, 'id_centro': 6, 'activo': 7, 'fecha_registro': 8
+    }
+    
+    def __init__(self, file_manager: AlmacenamientoBase):
         self.file_manager = file_manager
         self.archivo = "usuarios"
+        # El email no se repite entre los usuarios activos (el motor lo comprueba al escribir)
+        self.file_manager.registrar_restriccion_unica(self.archivo, 3, 7)
+        self.file_manager.registrar_indice(self.archivo, 6)  # id_centro
+    
+    @staticmethod
+    def _email_repetido(error: RegistroDuplicado) -> ValueError:
+        """Error para el usuario a partir de la restricción del motor"""
+        return ValueError(f"Ya existe un usuario con el email {error.valor}")
     
     def crear_usuario(self, usuario: Usuario) -> int:
-        """Crea un nuevo usuario"""
-        return self.file_manager.insertar_registro(self.archivo, usuario.to_list())
+        """Crea un nuevo usuario (ValueError si el email ya es de un usuario activo)"""
+        try:
+            return self.file_manager.insertar_registro(self.archivo, usuario.to_list())
+        except RegistroDuplicado as e:
+            raise self._email_repetido(e) from None
+    
+    def crear_usuarios_lote(self, usuarios: Iterable[Usuario]) -> List[int]:
+        """Crea varios usuarios en una sola escritura y devuelve sus IDs
+        
+        Si algún email se repite (dentro del lote o con un usuario activo) no se crea ninguno."""
+        try:
+            return self.file_manager.insertar_registros(self.archivo, (usuario.to_list() for usuario in usuarios))
+        except RegistroDuplicado as e:
+            raise self._email_repetido(e) from None
     
     def obtener_usuario_por_id(self, id_usuario: int) -> Optional[Usuario]:
         """Obtiene un usuario por su ID"""
@@ -32,72 +59,108 @@ class UsuarioDAO:
             return Usuario.from_list(registro)
         return None
     
-    def obtener_todos_usuarios(self) -> List[Usuario]:
-        """Obtiene todos los usuarios"""
-        registros = self.file_manager.obtener_registros(self.archivo)
-        usuarios = []
+    def iter_usuarios(self, solo_activos: bool = True) -> Iterator[Usuario]:
+        """Recorre los usuarios uno a uno sin cargarlos todos en memoria"""
+        for registro in self.file_manager.iter_registros(self.archivo):
+            usuario = Usuario.from_list(registro)
+            if usuario and (usuario.activo or not solo_activos):
+                yield usuario
+    
+    def obtener_pagina_usuarios(self, despues_de: int = 0, limite: int = 20,
+                                id_centro: Optional[int] = None) -> List[Usuario]:
+        """Obtiene hasta limite usuarios activos con ID mayor que despues_de (opcionalmente de un centro)"""
+        if id_centro is None:
+            registros = self.file_manager.iter_registros_desde(self.archivo, despues_de)
+        else:
+            registros = self.file_manager.iter_registros_desde(self.archivo, despues_de, 6, str(id_centro))
+        pagina = []
         for registro in registros:
             usuario = Usuario.from_list(registro)
             if usuario and usuario.activo:
-                usuarios.append(usuario)
-        return usuarios
+                pagina.append(usuario)
+                if len(pagina) == limite:
+                    break
+        return pagina
+    
+    def obtener_todos_usuarios(self) -> List[Usuario]:
+        """Obtiene todos los usuarios"""
+        return list(self.iter_usuarios())
     
     def obtener_medicos(self) -> List[Usuario]:
         """Obtiene todos los médicos activos"""
-        registros = self.file_manager.buscar_registros(self.archivo, 4, "medico")
-        medicos = []
-        for registro in registros:
-            usuario = Usuario.from_list(registro)
-            if usuario and usuario.activo:
-                medicos.append(usuario)
-        return medicos
+        return self.consultar(tipo_usuario="medico")
     
     def obtener_pacientes(self) -> List[Usuario]:
         """Obtiene todos los pacientes activos"""
-        registros = self.file_manager.buscar_registros(self.archivo, 4, "paciente")
-        pacientes = []
-        for registro in registros:
-            usuario = Usuario.from_list(registro)
-            if usuario and usuario.activo:
-                pacientes.append(usuario)
-        return pacientes
+        return self.consultar(tipo_usuario="paciente")
     
     def obtener_usuarios_por_centro(self, id_centro: int) -> List[Usuario]:
         """Obtiene todos los usuarios activos de un centro específico"""
-        registros = self.file_manager.buscar_registros(self.archivo, 6, str(id_centro))
-        usuarios = []
-        for registro in registros:
-            usuario = Usuario.from_list(registro)
-            if usuario and usuario.activo:
-                usuarios.append(usuario)
-        return usuarios
+        return self.consultar(id_centro=id_centro)
     
     def obtener_medicos_por_centro(self, id_centro: int) -> List[Usuario]:
         """Obtiene todos los médicos activos de un centro específico"""
-        usuarios = self.obtener_usuarios_por_centro(id_centro)
-        return [usuario for usuario in usuarios if usuario.es_medico()]
+        return self.consultar(id_centro=id_centro, tipo_usuario="medico")
     
     def obtener_pacientes_por_centro(self, id_centro: int) -> List[Usuario]:
         """Obtiene todos los pacientes activos de un centro específico"""
-        usuarios = self.obtener_usuarios_por_centro(id_centro)
-        return [usuario for usuario in usuarios if usuario.es_paciente()]
+        return self.consultar(id_centro=id_centro, tipo_usuario="paciente")
     
     def obtener_administradores_por_centro(self, id_centro: int) -> List[Usuario]:
         """Obtiene todos los administradores activos de un centro específico"""
-        usuarios = self.obtener_usuarios_por_centro(id_centro)
-        return [usuario for usuario in usuarios if usuario.es_administrador()]
+        return self.consultar(id_centro=id_centro, tipo_usuario="administrador")
+    
+    def _armar_consulta(self, id_centro: Optional[int] = None, tipo_usuario: Optional[str] = None,
+                        email: Optional[str] = None, activo: Optional[bool] = True,
+                        orden: Optional[str] = None, limite: Optional[int] = None) -> Consulta:
+        """Arma la consulta con los filtros indicados (None = sin filtrar por ese campo)"""
+        consulta = Consulta(self.file_manager, self.archivo, self.COLUMNAS)
+        for campo, valor in (('id_centro', id_centro), ('tipo_usuario', tipo_usuario),
+                             ('email', email), ('activo', activo)):
+            if valor is not None:
+                consulta.donde(campo, valor)
+        if orden is not None:
+            consulta.ordenar_por(orden)
+        return consulta.limitar(limite)
+    
+    def consultar(self, id_centro: Optional[int] = None, tipo_usuario: Optional[str] = None,
+                  email: Optional[str] = None, activo: Optional[bool] = True,
+                  orden: Optional[str] = None, limite: Optional[int] = None) -> List[Usuario]:
+        """Obtiene los usuarios que cumplen todos los filtros indicados (orden: "campo" o "-campo")"""
+        registros = self._armar_consulta(id_centro, tipo_usuario, email, activo, orden, limite).ejecutar()
+        usuarios = (Usuario.from_list(registro) for registro in registros)
+        return [usuario for usuario in usuarios if usuario]
+    
+    def explicar_consulta(self, **filtros) -> str:
+        """Explica el plan que seguiría consultar() con los mismos filtros"""
+        return self._armar_consulta(**filtros).explicar()
+    
+    def obtener_usuario_por_email(self, email: str) -> Optional[Usuario]:
+        """Obtiene el usuario activo con el email indicado"""
+        registros = self.file_manager.buscar_registros_exactos(self.archivo, 3, email)
+        for registro in registros:
+            usuario = Usuario.from_list(registro)
+            if usuario and usuario.activo:
+                return usuario
+        return None
+    
+    def existe_email(self, email: str) -> bool:
+        """Verifica si el email ya pertenece a un usuario activo"""
+        return self.obtener_usuario_por_email(email) is not None
     
     def iniciar_sesion(self, email: str, password: str) -> Optional[Usuario]:
         """Verifica las credenciales de un usuario y devuelve el usuario si son correctas"""
-        usuarios = self.obtener_todos_usuarios()
-        for usuario in usuarios:
-            if usuario.email == email and usuario.password == password:
-                return usuario
+        usuario = self.obtener_usuario_por_email(email)
+        if usuario and usuario.password == password:
+            return usuario
         return None
     
     def actualizar_usuario(self, usuario: Usuario) -> bool:
-        """Actualiza un usuario existente"""
-        return self.file_manager.actualizar_registro(self.archivo, usuario.id_usuario, usuario.to_list())
+        """Actualiza un usuario existente (ValueError si el email ya es de otro usuario activo)"""
+        try:
+            return self.file_manager.actualizar_registro(self.archivo, usuario.id_usuario, usuario.to_list())
+        except RegistroDuplicado as e:
+            raise self._email_repetido(e) from None
     
     def eliminar_usuario(self, id_usuario: int) -> bool:
         """Elimina (desactiva) un usuario"""
@@ -7,6 +7,7 @@ Archivo principal del sistema usando archivos DAT con funciones organizadas en m
 
 import sys
 import os
+import argparse
 
 # Agregar directorios al path
 sys.path.append(os.path.join(os.path.dirname(__file__), 'modulos'))
@@ -17,6 +18,9 @@ from modulos.usuario import Usuario
 from modulos.centro import CentroMedico
 from modulos.expediente import Expediente
 from modulos.utils import FileManager, obtener_fecha_actual
+from modulos.almacenamiento import AlmacenamientoBase
+from modulos.sqlite_manager import SQLiteManager
+from modulos.analitica import InstantaneaExpedientes
 
 # Importar DAOs
 from dao.usuario_dao import UsuarioDAO
@@ -38,7 +42,8 @@ from modulos.centro_manager import (
 )
 from modulos.expediente_manager import (
     crear_expediente, editar_expediente, listar_expedientes, buscar_expediente,
-    ver_expedientes_por_paciente, ver_expedientes_por_medico, ver_mis_expedientes
+    ver_expedientes_por_paciente, ver_expedientes_por_medico, ver_mis_expedientes,
+    ver_expedientes_recientes, ver_expedientes_por_rango
 )
 from modulos.auth_manager import iniciar_sesion, mostrar_estadisticas
 
@@ -89,7 +94,7 @@ def manejar_modulo_usuarios(usuario_dao, centro_dao):
             input("Presione Enter para continuar...")
 
 
-def manejar_sesion_administrador(usuario_dao, centro_dao, expediente_dao, file_manager, usuario_logueado):
+def manejar_sesion_administrador(usuario_dao, centro_dao, expediente_dao, usuario_logueado):
     """Maneja la sesión de un administrador"""
     while True:
         limpiar_pantalla()
@@ -121,7 +126,7 @@ def manejar_sesion_administrador(usuario_dao, centro_dao, expediente_dao, file_m
             listar_pacientes(usuario_dao, usuario_logueado)
             input("Presione Enter para continuar...")
         elif sub_opcion == "8":
-            mostrar_estadisticas(file_manager, usuario_dao, expediente_dao, usuario_logueado)
+            mostrar_estadisticas(centro_dao, usuario_dao, usuario_logueado)
             input("Presione Enter para continuar...")
         else:
             print("Opción no válida.")
@@ -147,6 +152,12 @@ def manejar_sesion_medico(usuario_dao, expediente_dao, usuario_logueado):
         elif sub_opcion == "3":
             ver_expedientes_por_paciente(expediente_dao, usuario_dao, usuario_logueado)
             input("Presione Enter para continuar...")
+        elif sub_opcion == "4":
+            ver_expedientes_recientes(expediente_dao, usuario_logueado)
+            input("Presione Enter para continuar...")
+        elif sub_opcion == "5":
+            ver_expedientes_por_rango(expediente_dao, usuario_logueado)
+            input("Presione Enter para continuar...")
         else:
             print("Opción no válida.")
             input("Presione Enter para continuar...")
@@ -170,7 +181,7 @@ def manejar_sesion_paciente(expediente_dao, usuario_logueado):
             input("Presione Enter para continuar...")
 
 
-def manejar_inicio_sesion(usuario_dao, centro_dao, expediente_dao, file_manager):
+def manejar_inicio_sesion(usuario_dao, centro_dao, expediente_dao):
     """Maneja el proceso de inicio de sesión y navegación posterior"""
     limpiar_pantalla()
     usuario_logueado = iniciar_sesion(usuario_dao)
@@ -180,19 +191,97 @@ def manejar_inicio_sesion(usuario_dao, centro_dao, expediente_dao, file_manager)
     
     # Redireccionar según el tipo de usuario
     if usuario_logueado.es_administrador():
-        manejar_sesion_administrador(usuario_dao, centro_dao, expediente_dao, file_manager, usuario_logueado)
+        manejar_sesion_administrador(usuario_dao, centro_dao, expediente_dao, usuario_logueado)
     elif usuario_logueado.es_medico():
         manejar_sesion_medico(usuario_dao, expediente_dao, usuario_logueado)
     elif usuario_logueado.es_paciente():
         manejar_sesion_paciente(expediente_dao, usuario_logueado)
 
 
-def main():
+def migrar_a_sqlite(destino: SQLiteManager, forzar: bool = False):
+    """Importa los archivos DAT en la base SQLite (ValueError si la base ya tiene datos, salvo forzar)"""
+    # Los archivos sólo se leen: sin hilo de sincronización del diario
+    origen = FileManager(durabilidad="lote")
+    try:
+        totales = destino.importar_desde(origen, ["centros", "usuarios", "expedientes"], forzar)
+    finally:
+        origen.cerrar()
+    for archivo, total in totales.items():
+        print(f"Migrados {total} registros de {archivo}.dat")
+
+
+def crear_almacenamiento(backend: str, migrar: bool = False, forzar: bool = False) -> AlmacenamientoBase:
+    """Crea el motor de almacenamiento elegido al iniciar ('dat' o 'sqlite')"""
+    if backend == "sqlite":
+        almacenamiento = SQLiteManager()
+        if migrar:
+            try:
+                migrar_a_sqlite(almacenamiento, forzar)
+            except Exception:
+                almacenamiento.cerrar()
+                raise
+        return almacenamiento
+    return FileManager()
+
+
+def main(argv=None):
     """Función principal del sistema refactorizada"""
+    parser = argparse.ArgumentParser(description="Sistema de Gestión de Clínica Médica")
+    parser.add_argument("--backend", choices=["dat", "sqlite"],
+                        default=os.environ.get("MICLINICA_BACKEND", "dat"),
+                        help="Motor de almacenamiento (por defecto archivos DAT)")
+    parser.add_argument("--migrar", action="store_true",
+                        help="Con --backend sqlite, importa antes los archivos DAT existentes")
+    parser.add_argument("--forzar", action="store_true",
+                        help="Con --migrar, importa aunque la base ya tenga datos (los de igual ID se reemplazan)")
+    parser.add_argument("--verificar-estadisticas", action="store_true",
+                        help="Compara los contadores de estadísticas con los datos, los corrige y sale")
+    parser.add_argument("--compactar", action="store_true",
+                        help="Reescribe los archivos sin versiones reemplazadas ni borradas y sale")
+    parser.add_argument("--archivar-inactivos", action="store_true",
+                        help="Con --compactar, mueve además los registros dados de baja al histórico")
+    parser.add_argument("--informe", action="store_true",
+                        help="Imprime el informe gerencial (expedientes por centro, médico y mes) y sale")
+    argumentos = parser.parse_args(argv)
+    
     print("Iniciando Sistema de Gestión de Clínica Médica...")
     
-    # Inicializar gestor de archivos
-    file_manager = FileManager()
+    # Inicializar motor de almacenamiento
+    try:
+        file_manager = crear_almacenamiento(argumentos.backend, argumentos.migrar, argumentos.forzar)
+    except ValueError as e:
+        print(f"No se migraron los archivos DAT: {e}. Use --forzar para importarlos de todos modos.")
+        return
+    
+    if argumentos.verificar_estadisticas:
+        for archivo, coincide in file_manager.verificar_estadisticas().items():
+            print(f"{archivo}: {'correctos' if coincide else 'corregidos'}")
+        file_manager.cerrar()
+        return
+    
+    if argumentos.compactar:
+        resultado = file_manager.compactar(archivar_inactivos=argumentos.archivar_inactivos)
+        for archivo, resumen in resultado.items():
+            print(f"{archivo}: {resumen['lineas_antes']} -> {resumen['lineas_despues']} líneas, "
+                  f"{resumen['bytes_antes']} -> {resumen['bytes_despues']} bytes, "
+                  f"{resumen['archivados']} archivados")
+        if not resultado:
+            print("No había nada que compactar.")
+        file_manager.cerrar()
+        return
+    
+    if argumentos.informe:
+        # Instantánea columnar: los conteos no arman un objeto por expediente
+        instantanea = InstantaneaExpedientes(file_manager)
+        print(f"Expedientes en la instantánea: {instantanea.cargar()}")
+        print("\nPacientes activos por centro:")
+        for centro, total in sorted(instantanea.pacientes_activos_por_centro().items()):
+            print(f"  - Centro {centro}: {total}")
+        print("\nExpedientes activos por centro, médico y mes:")
+        for (centro, medico, mes), total in sorted(instantanea.expedientes_por_centro_medico_mes().items()):
+            print(f"  - Centro {centro} | Médico {medico} | {mes}: {total}")
+        file_manager.cerrar()
+        return
     
     # Inicializar DAOs
     usuario_dao = UsuarioDAO(file_manager)
@@ -216,7 +305,7 @@ def main():
             elif opcion == "2":
                 manejar_modulo_usuarios(usuario_dao, centro_dao)
             elif opcion == "3":
-                manejar_inicio_sesion(usuario_dao, centro_dao, expediente_dao, file_manager)
+                manejar_inicio_sesion(usuario_dao, centro_dao, expediente_dao)
             else:
                 limpiar_pantalla()
                 print("Opción no válida. Por favor, seleccione una opción del 0 al 3.")
@@ -229,6 +318,8 @@ def main():
             print(f"\nError inesperado: {e}")
             print("El sistema continuará ejecutándose...")
             input("Presione Enter para continuar...")
+    
+    file_manager.cerrar()
 
 
 if __name__ == "__main__":
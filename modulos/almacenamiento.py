@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MiClinica - Módulo de Almacenamiento
+Contrato común de los motores de almacenamiento que usan los DAOs
+"""
+
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from modulos.indices import clave_contador, tokenizar
+
+
+class RegistroDuplicado(ValueError):
+    """Una escritura repetiría el valor de una columna declarada única"""
+
+    def __init__(self, archivo: str, columna: int, valor: str):
+        super().__init__(f"Ya existe un registro en {archivo} con el valor {valor!r} en la columna {columna}")
+        self.archivo = archivo
+        self.columna = columna
+        self.valor = valor
+
+
+class AlmacenamientoBase(ABC):
+    """Interfaz que deben cumplir los motores de almacenamiento (archivos DAT, SQLite...)
+
+    Cada registro es una lista de textos cuya primera columna es el ID. Los métodos
+    no abstractos tienen una implementación genérica basada en los abstractos, que
+    cada motor puede reemplazar por una más eficiente.
+    """
+
+    # Registros activos que cuentan las estadísticas: archivo -> (columna "activo", columnas de
+    # agrupación). La primera columna de agrupación permite consultar un solo centro;
+    # (columna, n) agrupa por los n primeros caracteres del valor
+    CONTADORES: Dict[str, Tuple[int, Tuple[Any, ...]]] = {
+        'centros': (4, ()),
+        'usuarios': (7, (6, 4)),  # id_centro, tipo_usuario
+        'expedientes': (15, (3, 2, (16, 7)))  # id_centro, id_medico, mes de creación (AAAA-MM)
+    }
+
+    def __init__(self):
+        self._columnas_texto: Dict[str, List[int]] = {}
+        # archivo -> [(columna única, columna "activo" o None)]
+        self._unicos: Dict[str, List[Tuple[int, Optional[int]]]] = {}
+
+    @abstractmethod
+    def insertar_registro(self, archivo: str, datos: List[str]) -> int:
+        """Inserta un nuevo registro y devuelve su ID"""
+
+    @abstractmethod
+    def obtener_registros(self, archivo: str) -> List[List[str]]:
+        """Obtiene todos los registros de un archivo"""
+
+    @abstractmethod
+    def obtener_registro_por_id(self, archivo: str, id_registro: int) -> Optional[List[str]]:
+        """Obtiene un registro específico por ID"""
+
+    @abstractmethod
+    def actualizar_registro(self, archivo: str, id_registro: int, nuevos_datos: List[str]) -> bool:
+        """Actualiza un registro existente"""
+
+    @abstractmethod
+    def buscar_registros(self, archivo: str, columna: int, valor: str) -> List[List[str]]:
+        """Busca registros cuya columna contiene el valor (sin distinguir mayúsculas)"""
+
+    @abstractmethod
+    def eliminar_registro(self, archivo: str, id_registro: int) -> bool:
+        """Elimina físicamente un registro"""
+
+    def insertar_registros(self, archivo: str, lista_datos: Iterable[List[str]]) -> List[int]:
+        """Inserta varios registros y devuelve sus IDs"""
+        return [self.insertar_registro(archivo, datos) for datos in lista_datos]
+
+    def iter_registros(self, archivo: str) -> Iterator[List[str]]:
+        """Recorre los registros de un archivo uno a uno"""
+        return iter(self.obtener_registros(archivo))
+
+    def iter_registros_desde(self, archivo: str, despues_de: int = 0, columna: Optional[int] = None,
+                             valor: Optional[str] = None) -> Iterator[List[str]]:
+        """Recorre en orden de ID los registros con ID mayor que despues_de (paginación por cursor)
+
+        Con columna y valor sólo se incluyen los registros con ese valor exacto en la columna.
+        La implementación genérica ordena todos los registros; los motores la reemplazan
+        por una que deja de leer cuando quien recorre ya tiene la página completa."""
+        if columna is None:
+            registros = self.iter_registros(archivo)
+        else:
+            registros = self.buscar_registros_exactos(archivo, columna, valor)
+        return iter(sorted((registro for registro in registros if int(registro[0]) > despues_de),
+                           key=lambda registro: int(registro[0])))
+
+    def obtener_registros_por_ids(self, archivo: str, ids: Iterable[int]) -> List[List[str]]:
+        """Obtiene varios registros por ID"""
+        registros = (self.obtener_registro_por_id(archivo, id_registro) for id_registro in sorted(ids))
+        return [registro for registro in registros if registro is not None]
+
+    def leer_campo(self, archivo: str, registro: List[str], columna: int) -> str:
+        """Valor de una columna del registro (un motor puede guardar aparte los textos largos)"""
+        return registro[columna]
+
+    def resolver_registro(self, archivo: str, registro: List[str]) -> List[str]:
+        """Registro con todos sus valores, incluidos los textos que el motor guarde aparte"""
+        return registro
+
+    def registrar_indice(self, archivo: str, columna: int):
+        """Declara un índice de búsqueda exacta sobre una columna (opcional para el motor)"""
+
+    def registrar_indice_texto(self, archivo: str, columnas: List[int]):
+        """Declara las columnas de texto libre que abarca buscar_texto"""
+        self._columnas_texto[archivo] = columnas
+
+    def registrar_indice_rango(self, archivo: str, columna: int):
+        """Declara un índice ordenado para buscar_rango sobre una columna (opcional para el motor)"""
+
+    def registrar_restriccion_unica(self, archivo: str, columna: int, columna_activo: Optional[int] = None):
+        """Exige que dos registros no compartan el valor de la columna (con índice exacto sobre ella)
+
+        Con columna_activo sólo cuentan los registros activos en esa columna; los valores
+        vacíos no cuentan. Cada motor
+        lo comprueba dentro de su escritura (con el archivo bloqueado o en la transacción),
+        así que dos procesos no pueden escribir el mismo valor a la vez."""
+        restricciones = self._unicos.setdefault(archivo, [])
+        if (columna, columna_activo) not in restricciones:
+            restricciones.append((columna, columna_activo))
+        self.registrar_indice(archivo, columna)
+
+    def _verificar_unicos(self, archivo: str, filas: List[Tuple[Optional[int], List[str]]]):
+        """Lanza RegistroDuplicado si las filas a escribir ((ID o None, datos sin ID)) repiten
+        entre sí o con otro registro el valor de una columna única"""
+        ids = {id_registro for id_registro, _ in filas if id_registro is not None}
+        for columna, columna_activo in self._unicos.get(archivo, ()):
+            valores = set()
+            for _, datos in filas:
+                # datos no incluye el ID: la columna c está en la posición c - 1
+                if len(datos) < columna or (columna_activo is not None and (
+                        len(datos) < columna_activo or datos[columna_activo - 1].lower() != 'true')):
+                    continue
+                valor = datos[columna - 1]
+                if not valor:
+                    continue  # un valor vacío no se considera repetido
+                if valor in valores:
+                    raise RegistroDuplicado(archivo, columna, valor)
+                valores.add(valor)
+            for valor in valores:
+                for registro in self.buscar_registros_exactos(archivo, columna, valor):
+                    # Los registros que se están reemplazando no cuentan
+                    if int(registro[0]) not in ids and (columna_activo is None or (
+                            len(registro) > columna_activo and registro[columna_activo].lower() == 'true')):
+                        raise RegistroDuplicado(archivo, columna, valor)
+
+    def buscar_registros_exactos(self, archivo: str, columna: int, valor: str) -> List[List[str]]:
+        """Busca registros cuyo valor en la columna es exactamente el indicado"""
+        return [registro for registro in self.iter_registros(archivo)
+                if len(registro) > columna and registro[columna] == valor]
+
+    def buscar_rango(self, archivo: str, columna: int, desde: Optional[str] = None,
+                     hasta: Optional[str] = None, igual_a: Optional[Dict[int, str]] = None,
+                     descendente: bool = False, limite: Optional[int] = None) -> List[List[str]]:
+        """Registros con valor en la columna entre desde y hasta (incluidos), ordenados por ese valor
+
+        igual_a exige además valores exactos en otras columnas ({columna: valor}); con
+        descendente se empieza por el mayor y limite corta el resultado. La implementación
+        genérica recorre y ordena todo el archivo."""
+        condiciones = igual_a or {}
+        registros = [registro for registro in self.iter_registros(archivo)
+                     if len(registro) > columna
+                     and (desde is None or registro[columna] >= desde)
+                     and (hasta is None or registro[columna] <= hasta)
+                     and all(len(registro) > c and self.leer_campo(archivo, registro, c) == v
+                             for c, v in condiciones.items())]
+        registros.sort(key=lambda registro: (registro[columna], int(registro[0])), reverse=descendente)
+        return registros[:limite] if limite is not None else registros
+
+    def buscar_texto(self, archivo: str, consulta: str) -> List[List[str]]:
+        """Busca registros que contengan todas las palabras de la consulta (admite prefijos)"""
+        if archivo not in self._columnas_texto:
+            raise ValueError(f"El archivo {archivo} no tiene índice de texto")
+        palabras = tokenizar(consulta)
+        if not palabras:
+            return []
+
+        resultados = []
+        for registro in self.iter_registros(archivo):
+            texto = " ".join(registro[c] for c in self._columnas_texto[archivo] if c < len(registro))
+            terminos = tokenizar(texto)
+            if all(any(t.startswith(p) for t in terminos) for p in palabras):
+                resultados.append(registro)
+        return resultados
+
+    # Estimaciones para el planificador de consultas: cuántos registros devolvería una
+    # búsqueda si el motor puede saberlo sin leer el archivo (por un índice), o None
+
+    def estimar_exactos(self, archivo: str, columna: int, valor: str) -> Optional[int]:
+        """Registros con ese valor exacto en la columna, según un índice (None si no lo hay)"""
+        return None
+
+    def estimar_rango(self, archivo: str, columna: int, desde: Optional[str] = None,
+                      hasta: Optional[str] = None) -> Optional[int]:
+        """Registros con la columna en el rango, según un índice (None si no lo hay)"""
+        return None
+
+    def estimar_texto(self, archivo: str, consulta: str) -> Optional[int]:
+        """Registros que encontraría buscar_texto, según un índice (None si no lo hay)"""
+        return None
+
+    def _especificacion_contador(self, archivo: str) -> Optional[Tuple[int, Tuple[Any, ...]]]:
+        """(columna "activo", columnas de agrupación) del archivo según CONTADORES"""
+        return self.CONTADORES.get(archivo)
+
+    def contar_activos(self, archivo: str, grupo: Optional[str] = None) -> Dict[Tuple[str, ...], int]:
+        """Cuenta los registros activos del archivo agrupados según CONTADORES
+
+        Con grupo sólo se cuentan los de ese valor en la primera columna de agrupación."""
+        columna_activo, columnas = self._especificacion_contador(archivo)
+        conteos: Dict[Tuple[str, ...], int] = {}
+        for registro in self.iter_registros(archivo):
+            clave = clave_contador(registro, columna_activo, columnas)
+            if clave is not None and (grupo is None or clave[0] == grupo):
+                conteos[clave] = conteos.get(clave, 0) + 1
+        return conteos
+
+    def verificar_estadisticas(self, reparar: bool = True) -> Dict[str, bool]:
+        """Compara los contadores mantenidos con los datos y los corrige si se pide
+
+        Devuelve, por archivo, si los contadores coincidían. Un motor que cuenta
+        recorriendo los datos siempre coincide."""
+        return {archivo: True for archivo in self.CONTADORES}
+
+    def compactar(self, archivo: Optional[str] = None,
+                  archivar_inactivos: bool = False) -> Dict[str, Dict[str, int]]:
+        """Descarta las versiones reemplazadas de los registros (todos los archivos si no se indica)
+
+        Un motor que no acumula versiones no tiene nada que compactar."""
+        return {}
+
+    @staticmethod
+    def _resumen_vacio() -> Dict[str, Any]:
+        """Estructura de las estadísticas de un centro"""
+        return {
+            'usuarios': 0,
+            'usuarios_por_tipo': {},
+            'expedientes': 0,
+            'expedientes_por_mes': {},
+            'expedientes_por_medico': {}
+        }
+
+    @staticmethod
+    def _sumar_usuarios(resumen: Dict[str, Any], tipo: str, total: int):
+        """Acumula usuarios activos de un tipo en un resumen"""
+        resumen['usuarios'] += total
+        resumen['usuarios_por_tipo'][tipo] = resumen['usuarios_por_tipo'].get(tipo, 0) + total
+
+    @staticmethod
+    def _sumar_expedientes(resumen: Dict[str, Any], id_medico: str, mes: str, total: int):
+        """Acumula expedientes activos de un médico y mes en un resumen"""
+        resumen['expedientes'] += total
+        resumen['expedientes_por_mes'][mes] = resumen['expedientes_por_mes'].get(mes, 0) + total
+        medico = int(id_medico) if id_medico.isdigit() else id_medico
+        resumen['expedientes_por_medico'][medico] = resumen['expedientes_por_medico'].get(medico, 0) + total
+
+    def obtener_estadisticas_centro(self, id_centro: int) -> Dict[str, Any]:
+        """Estadísticas de un centro: usuarios por tipo y expedientes por mes y por médico"""
+        resumen = self._resumen_vacio()
+        for (_, tipo), total in self.contar_activos('usuarios', str(id_centro)).items():
+            self._sumar_usuarios(resumen, tipo, total)
+        for (_, id_medico, mes), total in self.contar_activos('expedientes', str(id_centro)).items():
+            self._sumar_expedientes(resumen, id_medico, mes, total)
+        return resumen
+
+    def obtener_estadisticas(self) -> Dict[str, Any]:
+        """Obtiene estadísticas básicas del sistema, con el desglose por tipo de usuario y por centro"""
+        stats: Dict[str, Any] = {
+            'total_centros': sum(self.contar_activos('centros').values()),
+            'total_usuarios': 0,
+            'total_medicos': 0,
+            'total_pacientes': 0,
+            'total_expedientes': 0,
+            'usuarios_por_tipo': {},
+            'por_centro': {}
+        }
+
+        def resumen_centro(id_centro: str) -> Dict[str, Any]:
+            clave = int(id_centro) if id_centro.isdigit() else id_centro
+            return stats['por_centro'].setdefault(clave, self._resumen_vacio())
+
+        # Usuarios activos por centro y tipo
+        for (id_centro, tipo), total in self.contar_activos('usuarios').items():
+            stats['total_usuarios'] += total
+            stats['usuarios_por_tipo'][tipo] = stats['usuarios_por_tipo'].get(tipo, 0) + total
+            self._sumar_usuarios(resumen_centro(id_centro), tipo, total)
+        stats['total_medicos'] = stats['usuarios_por_tipo'].get('medico', 0)
+        stats['total_pacientes'] = stats['usuarios_por_tipo'].get('paciente', 0)
+
+        # Expedientes activos por centro, médico y mes
+        for (id_centro, id_medico, mes), total in self.contar_activos('expedientes').items():
+            stats['total_expedientes'] += total
+            self._sumar_expedientes(resumen_centro(id_centro), id_medico, mes, total)
+
+        return stats
+
+    def cerrar(self):
+        """Libera los recursos del motor"""
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MiClinica - Módulo de Analítica
+Instantánea columnar de los expedientes para informes de toda la clínica
+"""
+
+import bisect
+import itertools
+from array import array
+from collections import Counter
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from modulos.almacenamiento import AlmacenamientoBase
+
+try:
+    import numpy as np
+except ImportError:  # sin NumPy los conteos se hacen con array y Counter
+    np = None
+
+
+def mes_texto(mes: int) -> str:
+    """Convierte un mes ordinal (año * 12 + mes - 1) en "AAAA-MM" ("????-??" si no hay fecha)"""
+    if mes <= 0:
+        return "????-??"
+    return f"{mes // 12:04d}-{mes % 12 + 1:02d}"
+
+
+class InstantaneaExpedientes:
+    """Copia en columnas de enteros de los campos de los expedientes que usan los informes
+
+    Cada campo es un array (tipos de C, sin un objeto por valor) ordenado por ID; con
+    NumPy los conteos agrupados trabajan sobre vistas de esos mismos arrays sin copiarlos.
+    refrescar() sólo lee los registros con ID nuevo y los modificados desde la última
+    carga (por el índice de rango de fecha_modificacion); las bajas son lógicas (activo),
+    así que también llegan como modificaciones. Tras borrados físicos o una compactación
+    con archivo de inactivos hay que volver a cargar().
+    """
+
+    # Columna de origen y tipo de cada campo ("q" entero de 64 bits, "i" de 32, "b" de 8)
+    CAMPOS = {
+        'id_paciente': (1, 'q'),
+        'id_medico': (2, 'q'),
+        'id_centro': (3, 'q'),
+        'activo': (15, 'b'),
+        'dia_creacion': (16, 'i'),  # date.toordinal()
+        'mes_creacion': (16, 'i'),  # año * 12 + mes - 1
+    }
+    COLUMNA_MODIFICACION = 17
+
+    def __init__(self, almacenamiento: AlmacenamientoBase, archivo: str = "expedientes"):
+        self.almacenamiento = almacenamiento
+        self.archivo = archivo
+        self.ids = array('q')
+        self.columnas: Dict[str, array] = {campo: array(tipo) for campo, (_, tipo) in self.CAMPOS.items()}
+        self.marca = ""  # mayor fecha_modificacion incorporada
+        self._fechas: Dict[str, Tuple[int, int]] = {}  # "AAAA-MM-DD" -> (día, mes) ordinales
+        almacenamiento.registrar_indice_rango(archivo, self.COLUMNA_MODIFICACION)
+
+    def __len__(self):
+        return len(self.ids)
+
+    # ---- Carga ----
+
+    def _fecha(self, valor: str) -> Tuple[int, int]:
+        """(día, mes) ordinales de una fecha "AAAA-MM-DD..." ((0, 0) si no es válida)"""
+        dia = valor[:10]
+        ordinales = self._fechas.get(dia)
+        if ordinales is None:
+            try:
+                fecha = date(int(dia[:4]), int(dia[5:7]), int(dia[8:10]))
+                ordinales = (fecha.toordinal(), fecha.year * 12 + fecha.month - 1)
+            except ValueError:
+                ordinales = (0, 0)
+            self._fechas[dia] = ordinales
+        return ordinales
+
+    def _valores(self, registro: List[str]) -> Optional[Tuple[int, ...]]:
+        """Valores de los campos en el orden de CAMPOS (None si la fila está incompleta o dañada)"""
+        if len(registro) <= self.COLUMNA_MODIFICACION:
+            return None
+        try:
+            dia, mes = self._fecha(registro[16])
+            return (int(registro[1]), int(registro[2]), int(registro[3]),
+                    1 if registro[15].lower() == 'true' else 0, dia, mes)
+        except ValueError:
+            return None
+
+    def cargar(self) -> int:
+        """Arma la instantánea desde cero y devuelve cuántos expedientes tiene"""
+        ids = array('q')
+        columnas = [array(tipo) for _, tipo in self.CAMPOS.values()]
+        agregadores = [columna.append for columna in columnas]
+        marca = ""
+        for registro in self.almacenamiento.iter_registros(self.archivo):
+            valores = self._valores(registro)
+            if valores is None:
+                continue
+            ids.append(int(registro[0]))
+            for agregar, valor in zip(agregadores, valores):
+                agregar(valor)
+            if registro[self.COLUMNA_MODIFICACION] > marca:
+                marca = registro[self.COLUMNA_MODIFICACION]
+
+        if any(ids[i] > ids[i + 1] for i in range(len(ids) - 1)):
+            # Un archivo en modo log no siempre está en orden de ID
+            orden = sorted(range(len(ids)), key=ids.__getitem__)
+            ids = array('q', (ids[i] for i in orden))
+            columnas = [array(columna.typecode, (columna[i] for i in orden)) for columna in columnas]
+
+        self.ids = ids
+        self.columnas = dict(zip(self.CAMPOS, columnas))
+        self.marca = marca
+        return len(ids)
+
+    def _poner(self, id_registro: int, valores: Optional[Tuple[int, ...]]):
+        """Agrega o reemplaza los valores de un ID manteniendo el orden (None lo quita)"""
+        posicion = bisect.bisect_left(self.ids, id_registro)
+        existe = posicion < len(self.ids) and self.ids[posicion] == id_registro
+        if valores is None:
+            if existe:
+                del self.ids[posicion]
+                for columna in self.columnas.values():
+                    del columna[posicion]
+            return
+        if existe:
+            for columna, valor in zip(self.columnas.values(), valores):
+                columna[posicion] = valor
+            return
+        self.ids.insert(posicion, id_registro)
+        for columna, valor in zip(self.columnas.values(), valores):
+            columna.insert(posicion, valor)
+
+    def refrescar(self) -> int:
+        """Incorpora los expedientes nuevos y los modificados desde la última carga
+
+        Devuelve cuántos registros se leyeron. La primera vez equivale a cargar()."""
+        if not self.ids:
+            return self.cargar()
+        cambios = {}
+        for registro in self.almacenamiento.iter_registros_desde(self.archivo, self.ids[-1]):
+            cambios[int(registro[0])] = registro
+        # La marca se incluye: pudo haber más escrituras en el mismo segundo
+        for registro in self.almacenamiento.buscar_rango(self.archivo, self.COLUMNA_MODIFICACION, self.marca):
+            cambios[int(registro[0])] = registro
+
+        for id_registro in sorted(cambios):
+            registro = cambios[id_registro]
+            self._poner(id_registro, self._valores(registro))
+            if len(registro) > self.COLUMNA_MODIFICACION and registro[self.COLUMNA_MODIFICACION] > self.marca:
+                self.marca = registro[self.COLUMNA_MODIFICACION]
+        return len(cambios)
+
+    # ---- Conteos ----
+
+    def _validar(self, campos: Iterable[str]):
+        """Verifica que los campos existan en la instantánea"""
+        for campo in campos:
+            if campo not in self.columnas:
+                raise ValueError(f"Campo desconocido en la instantánea: {campo}")
+
+    def _mascara(self, solo_activos: bool, filtros: Dict[str, int]):
+        """Vector booleano de NumPy con las filas que cumplen los filtros (None = todas)"""
+        mascara = None
+        condiciones = list(filtros.items())
+        if solo_activos:
+            condiciones.append(('activo', 1))
+        for campo, valor in condiciones:
+            coincide = np.frombuffer(self.columnas[campo], dtype=self.columnas[campo].typecode) == valor
+            mascara = coincide if mascara is None else mascara & coincide
+        return mascara
+
+    def _selectores(self, solo_activos: bool, filtros: Dict[str, int]):
+        """Selectores 0/1 por fila para itertools.compress (None = todas)"""
+        condiciones = list(filtros.items())
+        if solo_activos and not condiciones:
+            return self.columnas['activo']
+        if solo_activos:
+            condiciones.append(('activo', 1))
+        if not condiciones:
+            return None
+        columnas = [self.columnas[campo] for campo, _ in condiciones]
+        valores = tuple(valor for _, valor in condiciones)
+        return (fila == valores for fila in zip(*columnas))
+
+    def _columnas_filtradas(self, campos: Tuple[str, ...], solo_activos: bool, filtros: Dict[str, int]):
+        """Vectores de NumPy de los campos, sólo con las filas que cumplen los filtros"""
+        mascara = self._mascara(solo_activos, filtros)
+        columnas = []
+        for campo in campos:
+            vector = np.frombuffer(self.columnas[campo], dtype=self.columnas[campo].typecode)
+            columnas.append(vector if mascara is None else vector[mascara])
+        return columnas
+
+    @staticmethod
+    def _codificar(columnas) -> Tuple[object, List[Tuple[object, int, int]], int]:
+        """Codifica cada fila de los vectores en un solo entero (base mixta)
+
+        Devuelve (claves, bases, combinaciones posibles); cada base es (valores, mínimo,
+        tamaño): un campo de valores dispersos se numera con unique y valores los traduce."""
+        claves = np.zeros(len(columnas[0]), dtype=np.int64)
+        bases = []
+        combinaciones = 1
+        for columna in columnas:
+            valores, minimo = None, int(columna.min())
+            tamano = int(columna.max()) - minimo + 1
+            if tamano > 4 * len(columna):
+                valores, codigos = np.unique(columna, return_inverse=True)
+                minimo, tamano = 0, len(valores)
+                columna = codigos.reshape(-1)
+            combinaciones *= tamano
+            if combinaciones >= 2 ** 62:
+                raise OverflowError("Demasiadas combinaciones para codificarlas en un entero")
+            claves = claves * tamano + (columna.astype(np.int64) - minimo)
+            bases.append((valores, minimo, tamano))
+        return claves, bases, combinaciones
+
+    @staticmethod
+    def _decodificar(claves, bases) -> List[list]:
+        """Valores de cada campo (listas de Python) a partir de las claves codificadas"""
+        columnas = []
+        for valores, minimo, tamano in reversed(bases):
+            claves, resto = np.divmod(claves, tamano)
+            columnas.append((valores[resto] if valores is not None else resto + minimo).tolist())
+        return columnas[::-1]
+
+    @staticmethod
+    def _contar_claves(claves, combinaciones: int):
+        """(claves distintas, veces que aparece cada una), con bincount si el espacio es chico"""
+        if combinaciones <= 8 * len(claves) + 1024:
+            conteos = np.bincount(claves, minlength=combinaciones)
+            distintas = np.flatnonzero(conteos)
+            return distintas, conteos[distintas]
+        return np.unique(claves, return_counts=True)
+
+    def contar_por(self, *campos: str, solo_activos: bool = True, **filtros: int) -> Dict[Tuple[int, ...], int]:
+        """Cantidad de expedientes por cada combinación de valores de los campos
+
+        filtros restringe a un valor exacto de otros campos (por ejemplo id_centro=2)."""
+        self._validar(campos + tuple(filtros))
+        if np is None:
+            filas = zip(*(self.columnas[campo] for campo in campos)) if campos else ((),) * len(self.ids)
+            selectores = self._selectores(solo_activos, filtros)
+            return dict(Counter(filas if selectores is None else itertools.compress(filas, selectores)))
+        if not campos:
+            mascara = self._mascara(solo_activos, filtros)
+            return {(): int(len(self.ids) if mascara is None else mascara.sum())}
+
+        columnas = self._columnas_filtradas(campos, solo_activos, filtros)
+        if not len(columnas[0]):
+            return {}
+        claves, bases, combinaciones = self._codificar(columnas)
+        distintas, totales = self._contar_claves(claves, combinaciones)
+        return dict(zip(zip(*self._decodificar(distintas, bases)), totales.tolist()))
+
+    def contar_distintos(self, campo: str, *por: str, solo_activos: bool = True,
+                         **filtros: int) -> Dict[Tuple[int, ...], int]:
+        """Cantidad de valores distintos del campo por cada combinación de los campos de por"""
+        self._validar((campo,) + por + tuple(filtros))
+        if np is None:
+            filas = zip(*(self.columnas[c] for c in por + (campo,)))
+            selectores = self._selectores(solo_activos, filtros)
+            distintos = set(filas if selectores is None else itertools.compress(filas, selectores))
+            return dict(Counter(fila[:-1] for fila in distintos))
+
+        columnas = self._columnas_filtradas(por + (campo,), solo_activos, filtros)
+        if not len(columnas[0]):
+            return {}
+        claves, bases, combinaciones = self._codificar(columnas)
+        distintas, _ = self._contar_claves(claves, combinaciones)
+        if not por:
+            return {(): int(len(distintas))}
+        # Sin el último campo, cada clave distinta suma uno a su grupo
+        tamano_campo = bases[-1][2]
+        grupos, totales = self._contar_claves(distintas // tamano_campo, combinaciones // tamano_campo)
+        return dict(zip(zip(*self._decodificar(grupos, bases[:-1])), totales.tolist()))
+
+    # ---- Informes ----
+
+    def expedientes_por_centro_medico_mes(self, solo_activos: bool = True) -> Dict[Tuple[int, int, str], int]:
+        """Expedientes por (centro, médico, mes de creación "AAAA-MM")"""
+        conteos = self.contar_por('id_centro', 'id_medico', 'mes_creacion', solo_activos=solo_activos)
+        meses = {mes: mes_texto(mes) for mes in {clave[2] for clave in conteos}}
+        return {(centro, medico, meses[mes]): total for (centro, medico, mes), total in conteos.items()}
+
+    def pacientes_activos_por_centro(self) -> Dict[int, int]:
+        """Pacientes distintos con algún expediente activo, por centro"""
+        return {centro: total for (centro,), total in self.contar_distintos('id_paciente', 'id_centro').items()}
@@ -12,14 +12,8 @@ def iniciar_sesion(usuario_dao):
     email = input("Email: ")
     password = input("Contraseña: ")
     
-    # Buscar usuario por email
-    usuarios = usuario_dao.obtener_todos_usuarios()
-    usuario_encontrado = None
-    
-    for usuario in usuarios:
-        if usuario.email == email and usuario.password == password:
-            usuario_encontrado = usuario
-            break
+    # Buscar usuario por email (índice único)
+    usuario_encontrado = usuario_dao.iniciar_sesion(email, password)
     
     if not usuario_encontrado:
         print("Credenciales incorrectas.")
@@ -29,29 +23,32 @@ def iniciar_sesion(usuario_dao):
     return usuario_encontrado
 
 
-def mostrar_estadisticas(file_manager, usuario_dao, expediente_dao, usuario_logueado):
+def mostrar_estadisticas(centro_dao, usuario_dao, usuario_logueado):
     """Muestra estadísticas del centro del usuario logueado"""
     print("\n" + "="*40)
     print(f"    ESTADÍSTICAS DEL CENTRO {usuario_logueado.id_centro}")
     print("="*40)
     
-    # Estadísticas específicas del centro
-    usuarios_centro = usuario_dao.obtener_usuarios_por_centro(usuario_logueado.id_centro)
-    medicos_centro = [u for u in usuarios_centro if u.es_medico()]
-    pacientes_centro = [u for u in usuarios_centro if u.es_paciente()]
-    administradores_centro = [u for u in usuarios_centro if u.es_administrador()]
+    # Contadores mantenidos por el almacenamiento: no se recorren usuarios ni expedientes
+    centro = centro_dao.obtener_estadisticas_centro(usuario_logueado.id_centro)
+    por_tipo = centro['usuarios_por_tipo']
+    
+    print(f"Total de Usuarios: {centro['usuarios']}")
+    print(f"  - Médicos: {por_tipo.get('medico', 0)}")
+    print(f"  - Pacientes: {por_tipo.get('paciente', 0)}")
+    print(f"  - Administradores: {por_tipo.get('administrador', 0)}")
+    print(f"Total de Expedientes: {centro['expedientes']}")
     
-    # Contar expedientes del centro
-    expedientes_centro = 0
-    todos_expedientes = expediente_dao.obtener_todos_expedientes()
-    for expediente in todos_expedientes:
-        if expediente.id_centro == usuario_logueado.id_centro:
-            expedientes_centro += 1
+    if centro['expedientes_por_mes']:
+        print("\nExpedientes por mes:")
+        for mes, total in sorted(centro['expedientes_por_mes'].items()):
+            print(f"  - {mes}: {total}")
     
-    print(f"Total de Usuarios: {len(usuarios_centro)}")
-    print(f"  - Médicos: {len(medicos_centro)}")
-    print(f"  - Pacientes: {len(pacientes_centro)}")
-    print(f"  - Administradores: {len(administradores_centro)}")
-    print(f"Total de Expedientes: {expedientes_centro}")
+    if centro['expedientes_por_medico']:
+        print("\nExpedientes por médico:")
+        for id_medico, total in sorted(centro['expedientes_por_medico'].items(),
+                                       key=lambda item: item[1], reverse=True):
+            medico = usuario_dao.obtener_usuario_por_id(id_medico)
+            nombre = f"Dr. {medico.nombre} {medico.apellido}" if medico else f"Médico #{id_medico}"
+            print(f"  - {nombre}: {total}")
     print("="*40)
-
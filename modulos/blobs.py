@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MiClinica - Módulo de Blobs
+Segmento aparte para los textos largos de los archivos DAT, comprimidos con zlib
+"""
+
+import os
+import re
+import zlib
+from typing import List
+
+# Referencia que queda en la fila en lugar del texto: posición, largo en bytes y codificación
+PATRON_REFERENCIA = re.compile(r"@blob:(\d+):(\d+):(zlib|txt)")
+
+
+def es_referencia(valor: str) -> bool:
+    """Indica si el valor de una columna apunta a un texto del segmento de blobs"""
+    return valor.startswith("@blob:") and PATRON_REFERENCIA.fullmatch(valor) is not None
+
+
+def escapar(valor: str) -> str:
+    """Valor que queda en la fila en lugar de ir al segmento: una @ inicial se duplica para
+    que un texto escrito por el usuario nunca pase por una referencia"""
+    return "@" + valor if valor.startswith("@") else valor
+
+
+def desescapar(valor: str) -> str:
+    """Valor original de un texto que quedó en la fila (inverso de escapar)"""
+    return valor[1:] if valor.startswith("@@") else valor
+
+
+class SegmentoBlobs:
+    """Archivo de sólo anexado con los textos largos de un archivo DAT
+
+    Las filas guardan una referencia corta (@blob:offset:largo:codificación), así que
+    recorrer o reescribir el archivo principal no arrastra los textos. Cada texto se
+    comprime si así ocupa menos.
+    """
+
+    def __init__(self, ruta_segmento: str, comprimir: bool = True):
+        self.ruta = ruta_segmento
+        self.comprimir = comprimir
+
+    def _codificar(self, texto: str):
+        """Devuelve (bytes, codificación) del texto a guardar"""
+        datos = texto.encode('utf-8')
+        if self.comprimir:
+            comprimido = zlib.compress(datos)
+            if len(comprimido) < len(datos):
+                return comprimido, "zlib"
+        return datos, "txt"
+
+    def guardar(self, textos: List[str]) -> List[str]:
+        """Añade los textos al final del segmento en una sola escritura y devuelve sus referencias"""
+        bloques = []
+        referencias = []
+        with open(self.ruta, 'ab') as f:
+            offset = f.tell()
+            for texto in textos:
+                datos, codificacion = self._codificar(texto)
+                referencias.append(f"@blob:{offset}:{len(datos)}:{codificacion}")
+                bloques.append(datos)
+                offset += len(datos)
+            f.write(b"".join(bloques))
+        return referencias
+
+    def leer(self, referencia: str) -> str:
+        """Lee el texto al que apunta la referencia"""
+        coincidencia = PATRON_REFERENCIA.fullmatch(referencia)
+        if coincidencia is None:
+            return referencia
+        offset, longitud, codificacion = int(coincidencia.group(1)), int(coincidencia.group(2)), coincidencia.group(3)
+        with open(self.ruta, 'rb') as f:
+            f.seek(offset)
+            datos = f.read(longitud)
+        if len(datos) != longitud:
+            raise ValueError(f"Referencia fuera del segmento {self.ruta}: {referencia}")
+        if codificacion == "zlib":
+            datos = zlib.decompress(datos)
+        return datos.decode('utf-8')
+
+    def sincronizar(self):
+        """Fuerza a disco lo escrito en el segmento (fsync)"""
+        try:
+            with open(self.ruta, 'rb') as f:
+                os.fsync(f.fileno())
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MiClinica - Módulo de Bloqueos
+Bloqueos compartidos/exclusivos entre procesos sobre los archivos DAT
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueos entre procesos
+    fcntl = None
+
+
+class TiempoBloqueoAgotado(TimeoutError):
+    """No se pudo obtener el bloqueo dentro del tiempo máximo de espera"""
+
+
+class BloqueoArchivo:
+    """Bloqueo de lectores/escritor sobre un archivo auxiliar .lock
+
+    Los lectores (compartido) pueden trabajar en paralelo y los escritores
+    (exclusivo) se serializan, tanto entre procesos (flock) como entre los hilos
+    del proceso. Es reentrante dentro de cada hilo: un bloqueo pedido mientras ya
+    se tiene uno exclusivo no vuelve a esperar.
+    """
+
+    def __init__(self, ruta_bloqueo: str, espera_maxima: float = 10.0):
+        self.ruta = ruta_bloqueo
+        self.espera_maxima = espera_maxima
+        self._archivo = None
+        self._condicion = threading.Condition()
+        self._lectores = 0  # hilos con el bloqueo compartido
+        self._escritor: Optional[int] = None  # hilo con el bloqueo exclusivo
+        self._escritores_esperando = 0
+        self._hilo = threading.local()  # nivel y modo del bloqueo de cada hilo
+        self.metricas: Dict[str, float] = {
+            'compartidos': 0,
+            'exclusivos': 0,
+            'con_espera': 0,
+            'tiempo_espera_total': 0.0,
+            'tiempo_espera_maximo': 0.0,
+            'agotados': 0
+        }
+
+    def _agotado(self, modo: str):
+        """Registra y lanza el error de tiempo de espera agotado"""
+        self.metricas['agotados'] += 1
+        raise TiempoBloqueoAgotado(
+            f"No se obtuvo el bloqueo {modo} de {os.path.basename(self.ruta)} "
+            f"tras {self.espera_maxima} s")
+
+    def _esperar_hilos(self, limite: float, modo: str):
+        """Espera a que otro hilo suelte el bloqueo, como mucho hasta el límite"""
+        restante = limite - time.monotonic()
+        if restante <= 0:
+            self._agotado(modo)
+        self._condicion.wait(restante)
+
+    def _bloquear_archivo(self, modo: str, limite: float):
+        """Toma el flock sin bloquear, reintentando hasta el límite"""
+        if fcntl is None:
+            return
+        if self._archivo is None:
+            self._archivo = open(self.ruta, 'a+')
+
+        operacion = fcntl.LOCK_SH if modo == 'compartido' else fcntl.LOCK_EX
+        pausa = 0.001
+        while True:
+            try:
+                fcntl.flock(self._archivo.fileno(), operacion | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                if time.monotonic() >= limite:
+                    self._agotado(modo)
+                time.sleep(pausa)
+                pausa = min(pausa * 2, 0.05)
+
+    def _liberar_archivo(self):
+        """Suelta el flock"""
+        if fcntl is not None and self._archivo is not None:
+            fcntl.flock(self._archivo.fileno(), fcntl.LOCK_UN)
+
+    def _adquirir(self, modo: str):
+        """Espera a los demás hilos y procesos y toma el bloqueo en el modo indicado"""
+        inicio = time.monotonic()
+        limite = inicio + self.espera_maxima
+        with self._condicion:
+            self.metricas['compartidos' if modo == 'compartido' else 'exclusivos'] += 1
+            if modo == 'compartido':
+                # Los escritores en espera tienen prioridad para no quedar postergados
+                while self._escritor is not None or self._escritores_esperando:
+                    self._esperar_hilos(limite, modo)
+                if self._lectores == 0:
+                    self._bloquear_archivo(modo, limite)
+                self._lectores += 1
+            else:
+                self._escritores_esperando += 1
+                try:
+                    while self._escritor is not None or self._lectores:
+                        self._esperar_hilos(limite, modo)
+                    self._bloquear_archivo(modo, limite)
+                finally:
+                    self._escritores_esperando -= 1
+                    self._condicion.notify_all()
+                self._escritor = threading.get_ident()
+
+            esperado = time.monotonic() - inicio
+            if esperado > 0.001:
+                self.metricas['con_espera'] += 1
+                self.metricas['tiempo_espera_total'] += esperado
+                self.metricas['tiempo_espera_maximo'] = max(self.metricas['tiempo_espera_maximo'], esperado)
+
+    def _liberar(self, modo: str):
+        """Suelta el bloqueo y despierta a los hilos en espera"""
+        with self._condicion:
+            if modo == 'compartido':
+                self._lectores -= 1
+                if self._lectores == 0:
+                    self._liberar_archivo()
+            else:
+                self._escritor = None
+                self._liberar_archivo()
+            self._condicion.notify_all()
+
+    @contextmanager
+    def _bloquear(self, modo: str):
+        """Toma el bloqueo en el modo indicado (reentrante en el mismo hilo)"""
+        nivel = getattr(self._hilo, 'nivel', 0)
+        if nivel == 0:
+            self._adquirir(modo)
+            self._hilo.modo = modo
+        elif modo == 'exclusivo' and self._hilo.modo == 'compartido':
+            raise RuntimeError("No se puede pedir un bloqueo exclusivo mientras se tiene uno compartido")
+
+        self._hilo.nivel = nivel + 1
+        try:
+            yield
+        finally:
+            self._hilo.nivel -= 1
+            if self._hilo.nivel == 0:
+                self._liberar(self._hilo.modo)
+                self._hilo.modo = None
+
+    def compartido(self):
+        """Bloqueo para lectores"""
+        return self._bloquear('compartido')
+
+    def exclusivo(self):
+        """Bloqueo para escritores"""
+        return self._bloquear('exclusivo')
+
+    def esta_tomado(self) -> bool:
+        """Indica si el hilo actual tiene el bloqueo"""
+        return getattr(self._hilo, 'nivel', 0) > 0
+
+    def cerrar(self):
+        """Cierra el archivo de bloqueo"""
+        if self._archivo is not None:
+            self._archivo.close()
+            self._archivo = None
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MiClinica - Módulo de Caché
+Caché en memoria de registros leídos, con presupuesto de memoria y desalojo LRU
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Set, Tuple
+
+from modulos.indices import Firma
+
+
+def estimar_tamano(registro: List[str]) -> int:
+    """Estimación aproximada (en bytes) de lo que ocupa un registro en memoria"""
+    return 64 + sum(49 + len(columna) for columna in registro)
+
+
+class CacheRegistros:
+    """Caché LRU de tablas y registros, invalidada por la firma (tamaño, mtime, inodo) de cada archivo
+
+    Cada operación es atómica, de modo que varios hilos lectores pueden compartirla.
+    """
+
+    def __init__(self, limite_bytes: int):
+        self._mutex = threading.RLock()
+        self.limite_bytes = limite_bytes
+        self.uso_bytes = 0
+        self._entradas: "OrderedDict[Hashable, Tuple[str, Any, int]]" = OrderedDict()
+        self._claves_por_archivo: Dict[str, Set[Hashable]] = {}
+        self._firmas: Dict[str, Firma] = {}
+        self.aciertos = 0
+        self.fallos = 0
+        self.desalojos = 0
+
+    def validar(self, archivo: str, firma: Firma):
+        """Descarta todo lo guardado del archivo si éste cambió desde la última lectura"""
+        with self._mutex:
+            if self._firmas.get(archivo) != firma:
+                self.invalidar(archivo)
+                self._firmas[archivo] = firma
+
+    def renovar_firma(self, archivo: str, firma_anterior: Firma,
+                      firma: Firma) -> bool:
+        """Registra una escritura propia. Devuelve False si la caché no estaba al día"""
+        with self._mutex:
+            if self._firmas.get(archivo) != firma_anterior:
+                self.invalidar(archivo)
+                return False
+            self._firmas[archivo] = firma
+            return True
+
+    def invalidar(self, archivo: str):
+        """Descarta todas las entradas de un archivo"""
+        with self._mutex:
+            for clave in self._claves_por_archivo.pop(archivo, set()):
+                _, _, tamano = self._entradas.pop(clave)
+                self.uso_bytes -= tamano
+            self._firmas.pop(archivo, None)
+
+    def obtener(self, clave: Hashable) -> Optional[Any]:
+        """Devuelve el valor guardado (y lo marca como usado recientemente) o None"""
+        with self._mutex:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                self.fallos += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return entrada[1]
+
+    def guardar(self, archivo: str, clave: Hashable, valor: Any, tamano: int):
+        """Guarda un valor desalojando los menos usados si se supera el presupuesto"""
+        with self._mutex:
+            self.descartar(clave)
+            if tamano > self.limite_bytes:
+                return
+            self._entradas[clave] = (archivo, valor, tamano)
+            self._claves_por_archivo.setdefault(archivo, set()).add(clave)
+            self.uso_bytes += tamano
+            self._desalojar()
+
+    def ajustar(self, clave: Hashable, diferencia: int):
+        """Corrige el tamaño de una entrada modificada en el lugar"""
+        with self._mutex:
+            archivo, valor, tamano = self._entradas[clave]
+            self._entradas[clave] = (archivo, valor, tamano + diferencia)
+            self.uso_bytes += diferencia
+            self._desalojar()
+
+    def descartar(self, clave: Hashable):
+        """Elimina una entrada si existe"""
+        with self._mutex:
+            entrada = self._entradas.pop(clave, None)
+            if entrada is not None:
+                self._claves_por_archivo[entrada[0]].discard(clave)
+                self.uso_bytes -= entrada[2]
+
+    def ver(self, clave: Hashable) -> Optional[Any]:
+        """Devuelve el valor guardado sin contarlo como uso ni como acierto"""
+        with self._mutex:
+            entrada = self._entradas.get(clave)
+            return entrada[1] if entrada is not None else None
+
+    def _desalojar(self):
+        """Elimina las entradas menos usadas hasta volver al presupuesto"""
+        while self.uso_bytes > self.limite_bytes and self._entradas:
+            clave, (archivo, _, tamano) = self._entradas.popitem(last=False)
+            self._claves_por_archivo[archivo].discard(clave)
+            self.uso_bytes -= tamano
+            self.desalojos += 1
+
+    def limpiar(self):
+        """Vacía la caché"""
+        with self._mutex:
+            self._entradas.clear()
+            self._claves_por_archivo.clear()
+            self._firmas.clear()
+            self.uso_bytes = 0
@@ -12,6 +12,9 @@ from typing import List
 class CentroMedico:
     """Clase que representa un centro médico"""
     
+    # Sin __dict__ por instancia: los listados crean muchos centros
+    __slots__ = ('id_centro', 'nombre', 'direccion', 'telefono', 'activo', 'fecha_creacion')
+    
     def __init__(self, id_centro: int = 0, nombre: str = "", 
                  direccion: str = "", telefono: str = "", 
                  activo: bool = True, fecha_creacion: str = ""):
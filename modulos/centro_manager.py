@@ -6,6 +6,7 @@ Centraliza todas las operaciones CRUD de centros médicos
 """
 
 from modulos.centro import CentroMedico
+from modulos.menu_manager import paginar
 
 
 def registrar_centro(centro_dao):
@@ -33,15 +34,14 @@ def registrar_centro(centro_dao):
 
 def listar_centros(centro_dao):
     """Lista todos los centros médicos"""
-    centros = centro_dao.obtener_todos_centros()
+    hay_centros = paginar(
+        centro_dao.obtener_pagina_centros,
+        lambda centro: print(f"ID: {centro.id_centro} | {centro.nombre} | {centro.direccion} | {centro.telefono}"),
+        lambda centro: centro.id_centro,
+        "LISTA DE CENTROS MÉDICOS")
     
-    if not centros:
+    if not hay_centros:
         print("No hay centros registrados.")
-        return
-    
-    print("\n--- LISTA DE CENTROS MÉDICOS ---")
-    for centro in centros:
-        print(f"ID: {centro.id_centro} | {centro.nombre} | {centro.direccion} | {centro.telefono}")
 
 
 def buscar_centro(centro_dao):
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MiClinica - Módulo de Escritura Agrupada
+Cola de escrituras con un único hilo escritor que las aplica en lotes (group commit)
+"""
+
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Dict, List, Tuple
+
+from modulos.almacenamiento import RegistroDuplicado
+
+# (operación, archivo, argumentos, argumentos con nombre, futuro)
+Escritura = Tuple[str, str, tuple, dict, Future]
+
+
+class EscrituraNoSincronizada(Exception):
+    """La escritura se aplicó (y otros ya pueden leerla) pero falló el fsync de su lote
+
+    No hay que repetirla: resultado tiene lo que habría devuelto (ID, bool o lista de IDs)."""
+
+    def __init__(self, resultado: Any, causa: Exception):
+        super().__init__(f"La escritura se aplicó pero no se pudo sincronizar en disco: {causa}")
+        self.resultado = resultado
+        self.causa = causa
+
+
+class EscritorAgrupado:
+    """Hilo único que aplica en lotes las escrituras encoladas por los demás hilos
+
+    Cada escritura devuelve un Future que se resuelve cuando su lote quedó aplicado
+    y sincronizado en disco: un solo fsync por archivo y por lote, en lugar de uno
+    por registro. Las inserciones consecutivas en un mismo archivo se unen en una
+    sola llamada a insertar_registros.
+    """
+
+    OPERACIONES = ('insertar_registro', 'insertar_registros', 'actualizar_registro', 'eliminar_registro')
+
+    def __init__(self, almacenamiento, tamano_lote: int = 256):
+        self.almacenamiento = almacenamiento
+        self.tamano_lote = tamano_lote
+        self._cola: "queue.Queue" = queue.Queue()
+        self._cerrado = False
+        self.metricas: Dict[str, int] = {
+            'lotes': 0,
+            'escrituras': 0,
+            'sincronizaciones': 0,
+            'lote_maximo': 0
+        }
+        self._hilo = threading.Thread(target=self._trabajar, name="miclinica-escritor", daemon=True)
+        self._hilo.start()
+
+    def enviar(self, operacion: str, archivo: str, *args, **kwargs) -> Future:
+        """Encola una escritura y devuelve el Future con su resultado"""
+        if operacion not in self.OPERACIONES:
+            raise ValueError(f"Operación de escritura desconocida: {operacion}")
+        if self._cerrado:
+            raise RuntimeError("El escritor agrupado ya está cerrado")
+        if operacion == 'insertar_registros' and args:
+            # Las filas se recorren al elegir qué bloquear y otra vez al escribirlas
+            args = (list(args[0]),) + args[1:]
+        futuro: Future = Future()
+        self._cola.put((operacion, archivo, args, kwargs, futuro))
+        return futuro
+
+    def es_hilo_escritor(self) -> bool:
+        """Indica si el código se está ejecutando en el hilo escritor"""
+        return threading.current_thread() is self._hilo
+
+    def cerrar(self):
+        """Aplica lo que quede en la cola y detiene el hilo escritor"""
+        if self._cerrado:
+            return
+        self._cerrado = True
+        self._cola.put(None)
+        self._hilo.join()
+
+    def _trabajar(self):
+        """Bucle del hilo escritor: toma todo lo encolado (hasta el tamaño de lote) y lo aplica"""
+        terminar = False
+        while not terminar:
+            escritura = self._cola.get()
+            if escritura is None:
+                break
+            lote = [escritura]
+            while len(lote) < self.tamano_lote:
+                try:
+                    escritura = self._cola.get_nowait()
+                except queue.Empty:
+                    break
+                if escritura is None:
+                    terminar = True
+                    break
+                lote.append(escritura)
+            self._aplicar_lote(lote)
+
+    @staticmethod
+    def _agrupar(lote: List[Escritura]) -> List[List[Escritura]]:
+        """Junta las inserciones simples consecutivas sobre el mismo archivo"""
+        grupos: List[List[Escritura]] = []
+        for escritura in lote:
+            operacion, archivo, _, kwargs, _ = escritura
+            if operacion == 'insertar_registro' and not kwargs and grupos:
+                anterior = grupos[-1][0]
+                if anterior[0] == 'insertar_registro' and anterior[1] == archivo and not anterior[3]:
+                    grupos[-1].append(escritura)
+                    continue
+            grupos.append([escritura])
+        return grupos
+
+    def _ejecutar(self, grupo: List[Escritura]) -> List[Tuple[bool, Any]]:
+        """Ejecuta un grupo de escrituras y devuelve (éxito, resultado o excepción) de cada una"""
+        operacion, archivo, args, kwargs, _ = grupo[0]
+        try:
+            if len(grupo) > 1:
+                try:
+                    ids = self.almacenamiento.insertar_registros(archivo, [e[2][0] for e in grupo])
+                except RegistroDuplicado:
+                    # Se comprueba antes de escribir nada: se insertan de a una para que la
+                    # fila repetida no haga fallar a las demás del grupo
+                    return [resultado for escritura in grupo for resultado in self._ejecutar([escritura])]
+                return [(True, id_registro) for id_registro in ids]
+            return [(True, getattr(self.almacenamiento, operacion)(archivo, *args, **kwargs))]
+        except Exception as e:
+            return [(False, e)] * len(grupo)
+
+    def _aplicar_lote(self, lote: List[Escritura]):
+        """Aplica el lote con los archivos bloqueados, sincroniza y resuelve los futuros"""
+        resultados: List[Tuple[bool, Any]] = []
+        try:
+            # Se bloquean los archivos que toca cada escritura (las particiones, en una tabla
+            # particionada): cada archivo que lee un lector refleja el lote entero o nada
+            archivos = sorted({bloqueado for operacion, archivo, args, _, _ in lote
+                               for bloqueado in self.almacenamiento.archivos_de_escritura(operacion, archivo, *args)})
+            with self.almacenamiento.bloquear_escritura(archivos):
+                for grupo in self._agrupar(lote):
+                    resultados.extend(self._ejecutar(grupo))
+                try:
+                    for archivo in archivos:
+                        self.almacenamiento.sincronizar(archivo)
+                        self.metricas['sincronizaciones'] += 1
+                except Exception as e:
+                    # Lo aplicado ya está en los archivos: no se informa como fallido (se
+                    # repetiría), sino como aplicado sin la durabilidad prometida
+                    resultados = [(False, EscrituraNoSincronizada(resultado, e)) if exito else (exito, resultado)
+                                  for exito, resultado in resultados]
+        except Exception as e:
+            if not resultados:
+                # Sin los archivos bloqueados no se aplicó ninguna escritura del lote
+                resultados = [(False, e)] * len(lote)
+
+        self.metricas['lotes'] += 1
+        self.metricas['escrituras'] += len(lote)
+        self.metricas['lote_maximo'] = max(self.metricas['lote_maximo'], len(lote))
+        for escritura, (exito, resultado) in zip(lote, resultados):
+            if exito:
+                escritura[4].set_result(resultado)
+            else:
+                escritura[4].set_exception(resultado)
@@ -6,12 +6,18 @@ Clase para gestionar expedientes médicos
 """
 
 from datetime import datetime
-from typing import List
+from typing import Callable, List, Optional
 
 
 class Expediente:
     """Clase que representa un expediente médico"""
     
+    # Sin __dict__ por instancia: los listados crean miles de expedientes
+    __slots__ = ('id_expediente', 'id_paciente', 'id_medico', 'id_centro', 'diagnostico',
+                 'tratamiento', 'observaciones', 'referencia', 'contrarreferencia', 'interconsulta',
+                 'enfermeria', 'historia_clinica', 'consentimientos', 'hoja_identificacion',
+                 'reporte_examenes', 'activo', 'fecha_creacion', 'fecha_modificacion')
+    
     def __init__(self, id_expediente: int = 0,
                  id_paciente: int = 0,
                  id_medico: int = 0,
@@ -46,9 +52,13 @@ class Expediente:
         self.hoja_identificacion = hoja_identificacion
         self.reporte_examenes = reporte_examenes
         self.activo = activo
-        fecha_actual = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        self.fecha_creacion = fecha_creacion if fecha_creacion else fecha_actual
-        self.fecha_modificacion = fecha_modificacion if fecha_modificacion else fecha_actual
+        # La fecha actual sólo se calcula si falta alguna (no al leer desde el archivo)
+        if not (fecha_creacion and fecha_modificacion):
+            fecha_actual = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            fecha_creacion = fecha_creacion or fecha_actual
+            fecha_modificacion = fecha_modificacion or fecha_actual
+        self.fecha_creacion = fecha_creacion
+        self.fecha_modificacion = fecha_modificacion
     
     def __str__(self):
         return f"Expediente #{self.id_expediente} - {self.diagnostico[:30]}..."
@@ -105,3 +115,54 @@ class Expediente:
         """Actualiza la fecha de modificación al momento actual"""
         self.fecha_modificacion = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
+
+
+class ExpedienteDiferido(Expediente):
+    """Expediente para listados: al crearlo sólo lee las columnas de cabecera
+    (IDs, diagnóstico, activo y fechas); los textos clínicos largos se toman de la
+    fila original la primera vez que se usan (con leer_campo si el almacenamiento
+    los guarda aparte)"""
+    
+    __slots__ = ('_fila', '_leer_campo')
+    
+    # Atributo diferido -> posición en la fila del archivo DAT
+    COLUMNAS_DIFERIDAS = {
+        'tratamiento': 5,
+        'observaciones': 6,
+        'referencia': 7,
+        'contrarreferencia': 8,
+        'interconsulta': 9,
+        'enfermeria': 10,
+        'historia_clinica': 11,
+        'consentimientos': 12,
+        'hoja_identificacion': 13,
+        'reporte_examenes': 14
+    }
+    
+    def __init__(self, datos: List[str], leer_campo: Optional[Callable[[List[str], int], str]] = None):
+        self._fila = datos
+        self._leer_campo = leer_campo
+        self.id_expediente = int(datos[0])
+        self.id_paciente = int(datos[1])
+        self.id_medico = int(datos[2])
+        self.id_centro = int(datos[3])
+        self.diagnostico = datos[4]
+        self.activo = datos[15].lower() == 'true'
+        self.fecha_creacion = datos[16]
+        self.fecha_modificacion = datos[17]
+    
+    def __getattr__(self, nombre: str):
+        # Sólo se llama para atributos que todavía no tienen valor
+        posicion = ExpedienteDiferido.COLUMNAS_DIFERIDAS.get(nombre)
+        if posicion is None:
+            raise AttributeError(f"'{type(self).__name__}' no tiene el atributo '{nombre}'")
+        valor = self._leer_campo(self._fila, posicion) if self._leer_campo else self._fila[posicion]
+        setattr(self, nombre, valor)
+        return valor
+    
+    @classmethod
+    def from_list(cls, datos: List[str], leer_campo: Optional[Callable[[List[str], int], str]] = None):
+        """Crea el expediente diferido desde una lista de datos del archivo DAT"""
+        if len(datos) >= 18:  # ID + 17 campos
+            return cls(datos, leer_campo)
+        return None
@@ -6,7 +6,9 @@ Centraliza todas las operaciones CRUD de expedientes médicos
 """
 
 import os
+from datetime import datetime
 from modulos.expediente import Expediente
+from modulos.menu_manager import paginar
 
 
 def crear_expediente(expediente_dao, usuario_dao, medico_logueado):
@@ -132,22 +134,26 @@ def _editar_campo_expediente(expediente, campo, titulo):
         setattr(expediente, campo, nuevo_valor)
 
 
+def _mostrar_resumen_expediente(expediente):
+    """Muestra un expediente dentro del listado"""
+    print(f"ID: {expediente.id_expediente} | Paciente: {expediente.id_paciente} | Médico: {expediente.id_medico}")
+    print(f"   Diagnóstico: {expediente.diagnostico}")
+    print(f"   Tratamiento: {expediente.tratamiento}")
+    print(f"   Observaciones: {expediente.observaciones}")
+    print(f"   Fecha: {expediente.fecha_creacion}")
+    print("-" * 50)
+
+
 def listar_expedientes(expediente_dao):
-    """Lista todos los expedientes"""
-    expedientes = expediente_dao.obtener_todos_expedientes()
+    """Lista todos los expedientes, por páginas"""
+    hay_expedientes = paginar(
+        expediente_dao.obtener_pagina_expedientes,
+        _mostrar_resumen_expediente,
+        lambda expediente: expediente.id_expediente,
+        "LISTA DE EXPEDIENTES")
     
-    if not expedientes:
+    if not hay_expedientes:
         print("No hay expedientes registrados.")
-        return
-    
-    print("\n--- LISTA DE EXPEDIENTES ---")
-    for expediente in expedientes:
-        print(f"ID: {expediente.id_expediente} | Paciente: {expediente.id_paciente} | Médico: {expediente.id_medico}")
-        print(f"   Diagnóstico: {expediente.diagnostico}")
-        print(f"   Tratamiento: {expediente.tratamiento}")
-        print(f"   Observaciones: {expediente.observaciones}")
-        print(f"   Fecha: {expediente.fecha_creacion}")
-        print("-" * 50)
 
 
 def buscar_expediente(expediente_dao):
@@ -240,7 +246,8 @@ def ver_expedientes_por_medico(expediente_dao, usuario_dao, usuario_logueado):
             return
         
         medico_seleccionado = medicos[seleccion - 1]
-        expedientes = expediente_dao.obtener_expedientes_por_medico(medico_seleccionado.id_usuario)
+        expedientes = expediente_dao.consultar(id_centro=usuario_logueado.id_centro,
+                                               id_medico=medico_seleccionado.id_usuario)
         if expedientes:
             print(f"\n--- EXPEDIENTES DEL DR. {medico_seleccionado.nombre} {medico_seleccionado.apellido} ---")
             for expediente in expedientes:
@@ -251,6 +258,59 @@ def ver_expedientes_por_medico(expediente_dao, usuario_dao, usuario_logueado):
         print("Selección inválida.")
 
 
+def _elegir_expediente(expedientes):
+    """Lista los expedientes y muestra el detalle del que se elija"""
+    for i, expediente in enumerate(expedientes, 1):
+        print(f"{i}. ID: {expediente.id_expediente} | Paciente: {expediente.id_paciente} | Diagnóstico: {expediente.diagnostico[:50]}...")
+        print(f"   Creado: {expediente.fecha_creacion} | Modificado: {expediente.fecha_modificacion}")
+    
+    try:
+        seleccion = int(input("\nSeleccione el número del expediente para ver detalles (0 para volver): "))
+        if seleccion == 0:
+            return
+        if seleccion < 1 or seleccion > len(expedientes):
+            print("Selección inválida.")
+            return
+        
+        ver_expediente_detallado(expedientes[seleccion - 1])
+    except ValueError:
+        print("Selección inválida.")
+
+
+def ver_expedientes_recientes(expediente_dao, medico_logueado, limite=10):
+    """Muestra los últimos expedientes modificados por el médico"""
+    expedientes = expediente_dao.obtener_expedientes_recientes(
+        id_medico=medico_logueado.id_usuario, id_centro=medico_logueado.id_centro, limite=limite)
+    if expedientes:
+        print(f"\n--- MIS {len(expedientes)} EXPEDIENTES MÁS RECIENTES ---")
+        _elegir_expediente(expedientes)
+    else:
+        print("No tiene expedientes registrados.")
+
+
+def ver_expedientes_por_rango(expediente_dao, medico_logueado):
+    """Muestra los expedientes del centro creados entre dos fechas"""
+    try:
+        desde = datetime.strptime(input("Desde (AAAA-MM-DD): ").strip(), "%Y-%m-%d").date()
+        hasta = datetime.strptime(input("Hasta (AAAA-MM-DD): ").strip(), "%Y-%m-%d").date()
+    except ValueError:
+        print("Fecha inválida.")
+        return
+    if desde > hasta:
+        print("La fecha inicial es posterior a la final.")
+        return
+    
+    solo_mios = input("¿Sólo sus expedientes? (s/n): ").strip().lower() == "s"
+    expedientes = expediente_dao.obtener_expedientes_por_rango(
+        desde, hasta, id_centro=medico_logueado.id_centro,
+        id_medico=medico_logueado.id_usuario if solo_mios else None)
+    if expedientes:
+        print(f"\n--- EXPEDIENTES CREADOS DEL {desde} AL {hasta} ---")
+        _elegir_expediente(expedientes)
+    else:
+        print("No hay expedientes creados en ese rango.")
+
+
 def ver_mis_expedientes(expediente_dao, paciente_logueado):
     """Muestra expedientes del paciente logueado"""
     expedientes = expediente_dao.obtener_expedientes_por_paciente(paciente_logueado.id_usuario)
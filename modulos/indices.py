@@ -0,0 +1,484 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MiClinica - Módulo de Índices
+Índices auxiliares para acelerar el acceso a los archivos DAT
+"""
+
+import bisect
+import os
+import re
+import unicodedata
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+
+# Firma de un archivo de datos: (tamaño, fecha de modificación en ns, inodo). El inodo
+# distingue un archivo reemplazado con os.replace aunque conserve tamaño y fecha
+Firma = Tuple[int, int, int]
+SIN_FIRMA: Firma = (-1, -1, -1)
+
+
+def normalizar_texto(texto: str) -> str:
+    """Pasa el texto a minúsculas y le quita los acentos"""
+    descompuesto = unicodedata.normalize('NFKD', texto.lower())
+    return "".join(c for c in descompuesto if not unicodedata.combining(c))
+
+
+def tokenizar(texto: str) -> Set[str]:
+    """Divide el texto normalizado en palabras"""
+    return set(re.findall(r"\w+", normalizar_texto(texto)))
+
+
+class IndiceOffsets:
+    """Índice persistente ID -> posición (en bytes) de cada registro de un archivo DAT"""
+
+    # La cabecera tiene ancho fijo para poder reescribirla sin mover las entradas
+    FORMATO_CABECERA = "{:020d}|{:020d}|{:020d}\n"
+
+    def __init__(self, ruta_indice: str):
+        self.ruta = ruta_indice
+        self.offsets: Dict[int, int] = {}
+        self.firma: Firma = SIN_FIRMA  # firma del archivo indexado
+        self.max_id = 0
+        self._ids_ordenados: Optional[List[int]] = None  # se arma al paginar por primera vez
+
+    def cargar(self) -> bool:
+        """Carga el índice desde disco. Devuelve False si no existe o está dañado"""
+        try:
+            with open(self.ruta, 'r', encoding='utf-8') as f:
+                tamano, mtime, inodo = f.readline().strip().split("|")
+                offsets = {}
+                for linea in f:
+                    if linea.strip():
+                        id_registro, offset = linea.split("|")
+                        offsets[int(id_registro)] = int(offset)
+        except (FileNotFoundError, ValueError):
+            return False
+
+        self.offsets = offsets
+        self.firma = (int(tamano), int(mtime), int(inodo))
+        self.max_id = max(offsets, default=0)
+        self._ids_ordenados = None
+        return True
+
+    def guardar(self):
+        """Escribe el índice completo reemplazando el anterior de forma atómica"""
+        temporal = f"{self.ruta}.{os.getpid()}.tmp"
+        with open(temporal, 'w', encoding='utf-8') as f:
+            f.write(self.FORMATO_CABECERA.format(*self.firma))
+            for id_registro, offset in self.offsets.items():
+                f.write(f"{id_registro}|{offset}\n")
+        os.replace(temporal, self.ruta)
+
+    def agregar(self, entradas: Iterable[Tuple[int, int]], firma: Firma):
+        """Añade entradas al final del índice y actualiza la firma de la cabecera"""
+        entradas = list(entradas)
+        for id_registro, offset in entradas:
+            if self._ids_ordenados is not None and id_registro not in self.offsets:
+                # Los IDs nuevos suelen ser los mayores: casi siempre basta con añadirlos al final
+                if id_registro > self.max_id:
+                    self._ids_ordenados.append(id_registro)
+                else:
+                    bisect.insort(self._ids_ordenados, id_registro)
+            self.offsets[id_registro] = offset
+            self.max_id = max(self.max_id, id_registro)
+        self.firma = firma
+
+        if not os.path.exists(self.ruta):
+            self.guardar()
+            return
+
+        with open(self.ruta, 'r+b') as f:
+            f.seek(0, os.SEEK_END)
+            f.write("".join(f"{i}|{o}\n" for i, o in entradas).encode('utf-8'))
+            f.seek(0)
+            f.write(self.FORMATO_CABECERA.format(*firma).encode('utf-8'))
+
+    def reiniciar(self, offsets: Dict[int, int], firma: Firma):
+        """Reemplaza todas las entradas del índice"""
+        self.offsets = offsets
+        self.firma = firma
+        self.max_id = max(offsets, default=0)
+        self._ids_ordenados = None
+
+    def ids_ordenados(self) -> List[int]:
+        """IDs indexados en orden ascendente (incluye los que sólo tienen marca de borrado)"""
+        if self._ids_ordenados is None:
+            self._ids_ordenados = sorted(self.offsets)
+        return self._ids_ordenados
+
+
+class SecuenciaIds:
+    """Secuencia persistente con el siguiente ID disponible de un archivo DAT"""
+
+    def __init__(self, ruta_secuencia: str):
+        self.ruta = ruta_secuencia
+        self.siguiente = 0  # 0 = desconocida, se recupera desde el índice
+
+    def cargar(self):
+        """Lee la secuencia desde disco; si no existe o está dañada queda en 0"""
+        try:
+            with open(self.ruta, 'r', encoding='utf-8') as f:
+                self.siguiente = int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            self.siguiente = 0
+
+    def guardar(self, siguiente: int):
+        """Guarda el siguiente ID reemplazando el archivo de forma atómica"""
+        self.siguiente = siguiente
+        temporal = f"{self.ruta}.{os.getpid()}.tmp"
+        with open(temporal, 'w', encoding='utf-8') as f:
+            f.write(f"{siguiente}\n")
+        os.replace(temporal, self.ruta)
+
+
+class IndiceSecundario:
+    """Índice hash en memoria valor -> IDs para búsquedas exactas sobre una columna"""
+
+    def __init__(self, columna: int):
+        self.columna = columna
+        self.valores: Dict[str, Set[int]] = {}
+        self.por_id: Dict[int, str] = {}
+        self.firma: Firma = SIN_FIRMA  # firma del archivo cuando se actualizó
+
+    def actualizar(self, id_registro: int, registro: Optional[List[str]]):
+        """Refleja la nueva versión de un registro (None si fue borrado)"""
+        anterior = self.por_id.pop(id_registro, None)
+        if anterior is not None:
+            ids = self.valores[anterior]
+            ids.discard(id_registro)
+            if not ids:
+                del self.valores[anterior]
+
+        if registro is not None and len(registro) > self.columna:
+            valor = registro[self.columna]
+            self.por_id[id_registro] = valor
+            self.valores.setdefault(valor, set()).add(id_registro)
+
+    def aplicar(self, cambios: List[Tuple[int, Optional[List[str]]]], firma: Firma):
+        """Aplica una serie de cambios escritos en el archivo"""
+        for id_registro, registro in cambios:
+            self.actualizar(id_registro, registro)
+        self.firma = firma
+
+    def reconstruir(self, registros: Iterable[List[str]], firma: Firma):
+        """Reconstruye el índice a partir de todos los registros del archivo"""
+        self.limpiar()
+        for registro in registros:
+            self.actualizar(int(registro[0]), registro)
+        self.firma = firma
+
+    def buscar(self, valor: str) -> Set[int]:
+        """Devuelve los IDs cuyo valor en la columna es exactamente el indicado"""
+        return self.valores.get(valor, set())
+
+    def limpiar(self):
+        """Vacía el índice"""
+        self.valores = {}
+        self.por_id = {}
+        self.firma = SIN_FIRMA
+
+
+class IndiceRango:
+    """Índice ordenado en memoria (valor, ID) para consultas por rango sobre una columna
+
+    Pensado para fechas "AAAA-MM-DD HH:MM:SS", cuyo orden de texto es el cronológico.
+    Las consultas ubican los extremos con bisect; las altas se insertan en su lugar.
+    """
+
+    def __init__(self, columna: int):
+        self.columna = columna
+        self.claves: List[Tuple[str, int]] = []  # ordenadas por valor y luego por ID
+        self.por_id: Dict[int, str] = {}
+        self.firma: Firma = SIN_FIRMA  # firma del archivo cuando se actualizó
+
+    def actualizar(self, id_registro: int, registro: Optional[List[str]]):
+        """Refleja la nueva versión de un registro (None si fue borrado)"""
+        anterior = self.por_id.pop(id_registro, None)
+        if anterior is not None:
+            del self.claves[bisect.bisect_left(self.claves, (anterior, id_registro))]
+
+        if registro is not None and len(registro) > self.columna:
+            valor = registro[self.columna]
+            self.por_id[id_registro] = valor
+            bisect.insort(self.claves, (valor, id_registro))
+
+    def aplicar(self, cambios: List[Tuple[int, Optional[List[str]]]], firma: Firma):
+        """Aplica una serie de cambios escritos en el archivo"""
+        for id_registro, registro in cambios:
+            self.actualizar(id_registro, registro)
+        self.firma = firma
+
+    def reconstruir(self, registros: Iterable[List[str]], firma: Firma):
+        """Reconstruye el índice a partir de todos los registros del archivo"""
+        self.por_id = {int(registro[0]): registro[self.columna]
+                       for registro in registros if len(registro) > self.columna}
+        self.claves = sorted((valor, id_registro) for id_registro, valor in self.por_id.items())
+        self.firma = firma
+
+    def _posiciones(self, desde: Optional[str], hasta: Optional[str]) -> Tuple[int, int]:
+        """Posiciones [inicio, fin) de las claves entre desde y hasta (ambos incluidos)"""
+        inicio = 0 if desde is None else bisect.bisect_left(self.claves, (desde,))
+        fin = len(self.claves) if hasta is None else bisect.bisect_right(self.claves, (hasta, float('inf')))
+        return inicio, max(inicio, fin)
+
+    def buscar(self, desde: Optional[str] = None, hasta: Optional[str] = None) -> List[int]:
+        """IDs con valor entre desde y hasta (ambos incluidos, None = sin límite), en orden de valor"""
+        inicio, fin = self._posiciones(desde, hasta)
+        return [id_registro for _, id_registro in self.claves[inicio:fin]]
+
+    def contar(self, desde: Optional[str] = None, hasta: Optional[str] = None) -> int:
+        """Cantidad de IDs en el rango, sin armar la lista"""
+        inicio, fin = self._posiciones(desde, hasta)
+        return fin - inicio
+
+    def limpiar(self):
+        """Vacía el índice"""
+        self.claves = []
+        self.por_id = {}
+        self.firma = SIN_FIRMA
+
+
+class IndiceTexto:
+    """Índice invertido persistente palabra -> IDs sobre columnas de texto libre"""
+
+    FORMATO_CABECERA = IndiceOffsets.FORMATO_CABECERA
+
+    def __init__(self, ruta_indice: str, columnas: List[int]):
+        self.ruta = ruta_indice
+        self.columnas = columnas
+        self.terminos: Dict[str, Set[int]] = {}
+        self.por_id: Dict[int, Set[str]] = {}
+        # Palabras en orden, para ubicar con bisect las que empiezan con un prefijo
+        # (None mientras se carga o reconstruye: se ordena una vez al final)
+        self.vocabulario: Optional[List[str]] = []
+        self.firma: Firma = SIN_FIRMA
+
+    def _terminos_de(self, registro: Optional[List[str]]) -> Set[str]:
+        """Obtiene las palabras de las columnas indexadas de un registro"""
+        if registro is None:
+            return set()
+        texto = " ".join(registro[c] for c in self.columnas if c < len(registro))
+        return tokenizar(texto)
+
+    def _asignar(self, id_registro: int, terminos: Set[str]):
+        """Reemplaza las palabras asociadas a un ID"""
+        for termino in self.por_id.pop(id_registro, set()):
+            ids = self.terminos[termino]
+            ids.discard(id_registro)
+            if not ids:
+                del self.terminos[termino]
+                if self.vocabulario is not None:
+                    del self.vocabulario[bisect.bisect_left(self.vocabulario, termino)]
+
+        if terminos:
+            self.por_id[id_registro] = terminos
+            for termino in terminos:
+                ids = self.terminos.get(termino)
+                if ids is None:
+                    ids = self.terminos[termino] = set()
+                    if self.vocabulario is not None:
+                        bisect.insort(self.vocabulario, termino)
+                ids.add(id_registro)
+
+    def cargar(self) -> bool:
+        """Carga el índice desde disco. Devuelve False si no existe o está dañado"""
+        self.terminos = {}
+        self.por_id = {}
+        self.vocabulario = None
+        try:
+            with open(self.ruta, 'r', encoding='utf-8') as f:
+                tamano, mtime, inodo = f.readline().strip().split("|")
+                for linea in f:
+                    if linea.strip():
+                        id_registro, terminos = linea.rstrip("\n").split("|")
+                        self._asignar(int(id_registro), set(terminos.split()))
+        except (FileNotFoundError, ValueError):
+            self.terminos = {}
+            self.por_id = {}
+            self.vocabulario = []
+            return False
+
+        self.vocabulario = sorted(self.terminos)
+        self.firma = (int(tamano), int(mtime), int(inodo))
+        return True
+
+    def guardar(self):
+        """Escribe el índice completo reemplazando el anterior de forma atómica"""
+        temporal = f"{self.ruta}.{os.getpid()}.tmp"
+        with open(temporal, 'w', encoding='utf-8') as f:
+            f.write(self.FORMATO_CABECERA.format(*self.firma))
+            for id_registro, terminos in self.por_id.items():
+                f.write(f"{id_registro}|{' '.join(sorted(terminos))}\n")
+        os.replace(temporal, self.ruta)
+
+    def aplicar(self, cambios: List[Tuple[int, Optional[List[str]]]], firma: Firma,
+                reescribir: bool = False):
+        """Aplica los cambios en memoria y los añade al final del archivo del índice
+
+        Con reescribir el archivo del índice se escribe completo, sin las versiones
+        anteriores que se fueron añadiendo (se usa cuando se reescribe el archivo de datos)."""
+        lineas = []
+        for id_registro, registro in cambios:
+            terminos = self._terminos_de(registro)
+            self._asignar(id_registro, terminos)
+            lineas.append(f"{id_registro}|{' '.join(sorted(terminos))}\n")
+        self.firma = firma
+
+        if reescribir or not os.path.exists(self.ruta):
+            self.guardar()
+            return
+
+        with open(self.ruta, 'r+b') as f:
+            f.seek(0, os.SEEK_END)
+            f.write("".join(lineas).encode('utf-8'))
+            f.seek(0)
+            f.write(self.FORMATO_CABECERA.format(*firma).encode('utf-8'))
+
+    def reconstruir(self, registros: Iterable[List[str]], firma: Firma):
+        """Reconstruye el índice a partir de todos los registros y lo guarda"""
+        self.terminos = {}
+        self.por_id = {}
+        self.vocabulario = None
+        for registro in registros:
+            self._asignar(int(registro[0]), self._terminos_de(registro))
+        self.vocabulario = sorted(self.terminos)
+        self.firma = firma
+        self.guardar()
+
+    def buscar(self, consulta: str) -> Set[int]:
+        """Devuelve los IDs que contienen todas las palabras de la consulta (admite prefijos)"""
+        resultado: Optional[Set[int]] = None
+        for palabra in tokenizar(consulta):
+            # Las palabras que empiezan con el prefijo están juntas en el vocabulario ordenado
+            ids: Set[int] = set()
+            posicion = bisect.bisect_left(self.vocabulario, palabra)
+            while posicion < len(self.vocabulario) and self.vocabulario[posicion].startswith(palabra):
+                ids |= self.terminos[self.vocabulario[posicion]]
+                posicion += 1
+            resultado = ids if resultado is None else resultado & ids
+            if not resultado:
+                return set()
+        return resultado or set()
+
+
+def clave_contador(registro: Optional[List[str]], columna_activo: int,
+                   columnas: Tuple[Any, ...]) -> Optional[Tuple[str, ...]]:
+    """Grupo en el que cuenta un registro, o None si no existe o no está activo
+
+    Cada columna de agrupación es un número de columna o (columna, caracteres) para
+    agrupar por el comienzo del valor (p. ej. el mes de una fecha)."""
+    if registro is None or len(registro) <= columna_activo or registro[columna_activo].lower() != 'true':
+        return None
+    clave = []
+    for columna in columnas:
+        columna, caracteres = columna if isinstance(columna, tuple) else (columna, None)
+        valor = registro[columna] if columna < len(registro) else ""
+        clave.append(valor[:caracteres] if caracteres is not None else valor)
+    return tuple(clave)
+
+
+class ContadorRegistros:
+    """Contadores persistentes de registros activos, agrupados por los valores de unas columnas
+
+    Los grupos se guardan además repartidos por el valor de la primera columna de
+    agrupación, para consultar los de un solo valor (p. ej. un centro) sin recorrer el resto.
+    """
+
+    FORMATO_CABECERA = IndiceOffsets.FORMATO_CABECERA
+
+    def __init__(self, ruta_contador: str, columna_activo: int, columnas: Tuple[Any, ...]):
+        self.ruta = ruta_contador
+        self.columna_activo = columna_activo
+        self.columnas = columnas
+        self.por_grupo: Dict[str, Dict[Tuple[str, ...], int]] = {}
+        self.firma: Firma = SIN_FIRMA
+        self.pendiente = False  # hay cambios en memoria que no se guardaron
+
+    @property
+    def conteos(self) -> Dict[Tuple[str, ...], int]:
+        """Todos los grupos con su cantidad"""
+        return {clave: total for grupo in self.por_grupo.values() for clave, total in grupo.items()}
+
+    def contar(self, grupo: str) -> Dict[Tuple[str, ...], int]:
+        """Grupos cuyo primer valor es el indicado"""
+        return dict(self.por_grupo.get(grupo, {}))
+
+    def _sumar(self, por_grupo: Dict[str, Dict[Tuple[str, ...], int]],
+               clave: Optional[Tuple[str, ...]], cantidad: int):
+        """Suma la cantidad al grupo indicado (None = registro que no cuenta)"""
+        if clave is None:
+            return
+        primero = clave[0] if clave else ""
+        grupo = por_grupo.setdefault(primero, {})
+        total = grupo.get(clave, 0) + cantidad
+        if total:
+            grupo[clave] = total
+        else:
+            del grupo[clave]
+            if not grupo:
+                del por_grupo[primero]
+
+    def _clave(self, registro: Optional[List[str]]) -> Optional[Tuple[str, ...]]:
+        """Grupo del registro según las columnas de este contador"""
+        return clave_contador(registro, self.columna_activo, self.columnas)
+
+    def cargar(self) -> bool:
+        """Carga los contadores desde disco. Devuelve False si no existen, están dañados
+        o se guardaron con otras columnas de agrupación"""
+        por_grupo: Dict[str, Dict[Tuple[str, ...], int]] = {}
+        try:
+            with open(self.ruta, 'r', encoding='utf-8') as f:
+                tamano, mtime, inodo = f.readline().strip().split("|")
+                for linea in f:
+                    if linea.strip():
+                        partes = linea.rstrip("\n").split("|")
+                        clave = tuple(partes[1:])
+                        if len(clave) != len(self.columnas):
+                            raise ValueError("columnas de agrupación distintas")
+                        por_grupo.setdefault(clave[0] if clave else "", {})[clave] = int(partes[0])
+        except (FileNotFoundError, ValueError):
+            self.por_grupo = {}
+            self.firma = SIN_FIRMA
+            return False
+
+        self.por_grupo = por_grupo
+        self.firma = (int(tamano), int(mtime), int(inodo))
+        self.pendiente = False
+        return True
+
+    def guardar(self):
+        """Escribe los contadores reemplazando el archivo anterior de forma atómica"""
+        temporal = f"{self.ruta}.{os.getpid()}.tmp"
+        with open(temporal, 'w', encoding='utf-8') as f:
+            f.write(self.FORMATO_CABECERA.format(*self.firma))
+            for clave, total in self.conteos.items():
+                f.write("|".join((str(total),) + clave) + "\n")
+        os.replace(temporal, self.ruta)
+        self.pendiente = False
+
+    def persistir(self):
+        """Guarda los contadores si cambiaron desde la última vez que se guardaron"""
+        if self.pendiente:
+            self.guardar()
+
+    def aplicar(self, cambios: List[Tuple[int, Optional[List[str]]]],
+                anteriores: Dict[int, List[str]], firma: Firma):
+        """Descuenta la versión anterior de cada registro cambiado y suma la nueva (sólo en memoria)
+
+        Se guardan en disco con persistir(); si para entonces el archivo ya no coincide con
+        la firma guardada, quien los cargue vuelve a contar."""
+        for id_registro, registro in cambios:
+            self._sumar(self.por_grupo, self._clave(anteriores.get(id_registro)), -1)
+            self._sumar(self.por_grupo, self._clave(registro), 1)
+        self.firma = firma
+        self.pendiente = True
+
+    def reconstruir(self, registros: Iterable[List[str]], firma: Firma):
+        """Vuelve a contar todos los registros del archivo y guarda el resultado"""
+        por_grupo: Dict[str, Dict[Tuple[str, ...], int]] = {}
+        for registro in registros:
+            self._sumar(por_grupo, self._clave(registro), 1)
+        self.por_grupo = por_grupo
+        self.firma = firma
+        self.guardar()
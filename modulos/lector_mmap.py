@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MiClinica - Módulo de Lectura Mapeada
+Lectura de archivos DAT mapeados en memoria, trabajando directamente sobre bytes
+"""
+
+import mmap
+import re
+from typing import Iterator, Optional, Tuple
+
+from modulos.indices import Firma, SIN_FIRMA
+
+
+def patron_sin_mayusculas(valor: str) -> "re.Pattern":
+    """Construye un patrón en bytes que encuentra el valor sin distinguir mayúsculas"""
+    partes = []
+    for caracter in valor:
+        variantes = {caracter, caracter.lower(), caracter.upper()}
+        opciones = [re.escape(v.encode('utf-8')) for v in sorted(variantes) if len(v) == 1]
+        partes.append(b"(?:" + b"|".join(opciones) + b")")
+    return re.compile(b"".join(partes))
+
+
+class LectorMapeado:
+    """Lector de sólo lectura sobre un archivo DAT mapeado en memoria"""
+
+    TAMANO_BLOQUE = 1 << 20
+
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        self.mapa: Optional[mmap.mmap] = None
+        self.firma: Firma = SIN_FIRMA
+
+    def abrir(self, firma: Firma) -> bool:
+        """Mapea el archivo si cambió desde el último mapeo. Devuelve False si está vacío"""
+        if self.mapa is not None and self.firma == firma:
+            return True
+
+        # El mapeo anterior no se cierra aquí: un recorrido en curso puede seguir usándolo
+        self.mapa = None
+        self.firma = SIN_FIRMA
+        if firma[0] == 0:
+            return False
+        try:
+            with open(self.ruta, 'rb') as f:
+                self.mapa = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return False
+        self.firma = firma
+        return True
+
+    def cerrar(self):
+        """Libera el mapeo (necesario antes de reescribir el archivo en Windows)"""
+        if self.mapa is not None:
+            self.mapa.close()
+        self.mapa = None
+        self.firma = SIN_FIRMA
+
+    def lineas(self, desde: int = 0) -> Iterator[Tuple[int, int]]:
+        """Recorre (inicio, fin) de cada línea no vacía sin copiar su contenido"""
+        # El mapeo se toma ahora: si luego se vuelve a mapear, el recorrido sigue con éste
+        return self._lineas(self.mapa, desde)
+
+    @staticmethod
+    def _lineas(mapa: mmap.mmap, desde: int) -> Iterator[Tuple[int, int]]:
+        """Recorre las líneas de un mapeo concreto"""
+        tamano = len(mapa)
+        inicio = desde
+        while inicio < tamano:
+            fin = mapa.find(b"\n", inicio)
+            if fin == -1:
+                fin = tamano
+            if fin - inicio > 1 or (fin - inicio == 1 and mapa[inicio] not in b"\r \t"):
+                yield inicio, fin
+            inicio = fin + 1
+
+    def linea(self, inicio: int) -> bytes:
+        """Devuelve la línea que empieza en la posición indicada (sin el salto de línea)"""
+        fin = self.mapa.find(b"\n", inicio)
+        return self.mapa[inicio:fin if fin != -1 else len(self.mapa)]
+
+    def entero_en(self, inicio: int, separador: bytes) -> Optional[int]:
+        """Lee el entero de la primera columna de la línea sin copiarla completa"""
+        fin = self.mapa.find(separador, inicio, inicio + 24)
+        if fin == -1:
+            return None
+        try:
+            return int(self.mapa[inicio:fin])
+        except ValueError:
+            return None
+
+    def buscar(self, valor: str) -> Iterator[int]:
+        """Devuelve el inicio de cada línea donde podría aparecer el valor (sin distinguir mayúsculas)
+
+        Es un filtro previo: la coincidencia exacta la verifica quien llama."""
+        fragmento = max(re.findall(r"[\x00-\x7f]+", valor.lower()), key=len, default="")
+        if not fragmento:
+            yield from self._buscar_patron(patron_sin_mayusculas(valor))
+            return
+
+        # Se compara por bloques pasados a minúsculas, mucho más rápido que un patrón con IGNORECASE
+        aguja = fragmento.encode('ascii')
+        mapa = self.mapa
+        tamano = len(mapa)
+        ultimo = -1
+        for base in range(0, tamano, self.TAMANO_BLOQUE):
+            bloque = mapa[base:base + self.TAMANO_BLOQUE + len(aguja) - 1].lower()
+            posicion = bloque.find(aguja)
+            while posicion != -1 and posicion < self.TAMANO_BLOQUE:
+                inicio = mapa.rfind(b"\n", 0, base + posicion) + 1
+                if inicio != ultimo:
+                    ultimo = inicio
+                    yield inicio
+                posicion = bloque.find(aguja, posicion + 1)
+
+    def _buscar_patron(self, patron: "re.Pattern") -> Iterator[int]:
+        """Devuelve el inicio de cada línea donde aparece el patrón (una vez por línea)"""
+        ultimo = -1
+        for coincidencia in patron.finditer(self.mapa):
+            inicio = self.mapa.rfind(b"\n", 0, coincidencia.start()) + 1
+            if inicio != ultimo:
+                ultimo = inicio
+                yield inicio
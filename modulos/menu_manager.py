@@ -7,6 +7,9 @@ Centraliza todas las funciones de mostrar menús del sistema
 
 import os
 
+# Elementos por página en los listados
+TAMANO_PAGINA = 20
+
 
 def mostrar_menu_principal():
     """Muestra el menú principal del sistema"""
@@ -86,6 +89,8 @@ def mostrar_menu_medico():
     print("1. Crear expediente")
     print("2. Buscar expediente")
     print("3. Ver expedientes por paciente")
+    print("4. Ver expedientes recientes")
+    print("5. Ver expedientes por rango de fechas")
     print("0. Cerrar sesión")
     print("-"*40)
 
@@ -100,6 +105,42 @@ def mostrar_menu_paciente():
     print("-"*40)
 
 
+def paginar(obtener_pagina, mostrar_elemento, obtener_cursor, titulo, tamano_pagina=TAMANO_PAGINA):
+    """Muestra un listado por páginas con navegación siguiente/anterior
+
+    obtener_pagina(despues_de, limite) devuelve los elementos siguientes al cursor y
+    obtener_cursor(elemento) el cursor (ID) de un elemento. Devuelve False si no hay elementos.
+    """
+    inicios = [0]  # cursor de inicio de cada página visitada
+    while True:
+        # Se pide uno más para saber si hay página siguiente
+        elementos = obtener_pagina(inicios[-1], tamano_pagina + 1)
+        if not elementos and len(inicios) == 1:
+            return False
+        hay_siguiente = len(elementos) > tamano_pagina
+        elementos = elementos[:tamano_pagina]
+        
+        print(f"\n--- {titulo} (página {len(inicios)}) ---")
+        for elemento in elementos:
+            mostrar_elemento(elemento)
+        
+        opciones = []
+        if hay_siguiente:
+            opciones.append("S = siguiente")
+        if len(inicios) > 1:
+            opciones.append("A = anterior")
+        if not opciones:
+            return True
+        
+        opcion = input(f"\n{' | '.join(opciones)} | Enter = terminar: ").strip().upper()
+        if opcion == "S" and hay_siguiente:
+            inicios.append(obtener_cursor(elementos[-1]))
+        elif opcion == "A" and len(inicios) > 1:
+            inicios.pop()
+        else:
+            return True
+
+
 def limpiar_pantalla():
     """Limpia la pantalla según el sistema operativo"""
     os.system("cls" if os.name == "nt" else "clear")
@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MiClinica - Módulo de Particiones
+Reparto de una tabla de archivos DAT en un archivo por valor de una columna
+"""
+
+import heapq
+import itertools
+import os
+import re
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from modulos.indices import Firma
+
+
+def _id_de(registro: List[str]) -> int:
+    """Clave de orden de los registros: su ID"""
+    return int(registro[0])
+
+
+class TablaParticionada:
+    """Tabla repartida en archivos tabla/prefijo_valor según el valor de una columna
+
+    Cada partición es un archivo DAT común del FileManager, con su propio bloqueo,
+    índices, contadores y caché: escribir en un centro no bloquea las lecturas de los
+    demás. Los IDs salen de una secuencia global de la tabla, así que son únicos entre
+    particiones. Las consultas por la columna de partición leen un solo archivo; el
+    resto recorre todas las particiones y une los resultados en orden de ID.
+    """
+
+    # Un listado del directorio hecho hasta este tiempo después de su última modificación no
+    # se reutiliza: otro archivo creado en el mismo tic del reloj no cambiaría la fecha
+    MARGEN_LISTADO_NS = 1_000_000_000
+
+    def __init__(self, almacenamiento, tabla: str, columna: int, prefijo: str):
+        self.almacenamiento = almacenamiento
+        self.tabla = tabla
+        self.columna = columna
+        self.prefijo = prefijo
+        self.directorio = os.path.join(almacenamiento.data_dir, tabla)
+        self._indices: List[int] = []
+        self._indices_rango: List[int] = []
+        self._columnas_texto: Optional[List[int]] = None
+        self._preparadas: set = set()
+        # Nombres de las particiones y fecha de modificación del directorio cuando se listó
+        self._listado: List[str] = []
+        self._fecha_listado: Optional[int] = None
+        # ID -> partición con su versión vigente, y la firma de cada partición al armarlo
+        self._ubicaciones: Dict[int, str] = {}
+        self._firmas_ubicaciones: Optional[Dict[str, Firma]] = None
+        # Siguiente ID que este proceso dejó en la secuencia (None = aún no se comprobó)
+        self._siguiente_reservado: Optional[int] = None
+        os.makedirs(self.directorio, exist_ok=True)
+
+    def nombre_particion(self, valor: str) -> str:
+        """Nombre (para el FileManager) del archivo que guarda los registros con ese valor"""
+        if not re.fullmatch(r"[\w-]+", valor):
+            raise ValueError(f"Valor no válido para particionar {self.tabla}: {valor!r}")
+        return f"{self.tabla}/{self.prefijo}_{valor}"
+
+    def _preparar(self, particion: str) -> str:
+        """Declara sobre la partición los índices de la tabla (una vez por partición)"""
+        if particion not in self._preparadas:
+            with self.almacenamiento._mutex:
+                if particion not in self._preparadas:
+                    for columna in self._indices:
+                        self.almacenamiento.registrar_indice(particion, columna)
+                    for columna in self._indices_rango:
+                        self.almacenamiento.registrar_indice_rango(particion, columna)
+                    if self._columnas_texto is not None:
+                        self.almacenamiento.registrar_indice_texto(particion, self._columnas_texto)
+                    self._preparadas.add(particion)
+        return particion
+
+    def particiones(self) -> List[str]:
+        """Particiones existentes en disco (también las que creó otro proceso)
+
+        El listado se reutiliza mientras no cambie la fecha de modificación del directorio."""
+        fecha = os.stat(self.directorio).st_mtime_ns
+        if fecha != self._fecha_listado:
+            inicio = f"{self.prefijo}_"
+            nombres = sorted(nombre[:-4] for nombre in os.listdir(self.directorio)
+                             if nombre.startswith(inicio) and nombre.endswith(".dat"))
+            self._listado = [f"{self.tabla}/{nombre}" for nombre in nombres]
+            reciente = time.time_ns() - fecha < self.MARGEN_LISTADO_NS
+            self._fecha_listado = None if reciente else fecha
+        return [self._preparar(particion) for particion in self._listado]
+
+    def _particion_existente(self, valor: str) -> Optional[str]:
+        """Partición del valor, o None si todavía no tiene registros"""
+        particion = self.nombre_particion(valor)
+        if not os.path.exists(self.almacenamiento._obtener_ruta_archivo(particion)):
+            return None
+        return self._preparar(particion)
+
+    def particion_de_registro(self, registro: List[str]) -> str:
+        """Partición donde está guardado un registro completo (con ID)"""
+        return self._preparar(self.nombre_particion(registro[self.columna]))
+
+    def _particion_de_datos(self, datos: List[str]) -> str:
+        """Partición donde va una fila sin ID (datos a insertar o actualizar)"""
+        return self._preparar(self.nombre_particion(datos[self.columna - 1]))
+
+    def _ubicar(self, id_registro: int) -> Optional[str]:
+        """Partición que tiene la versión vigente del registro, según el mapa de ubicaciones"""
+        return self._leer_ubicado(id_registro)[0]
+
+    def _leer_ubicado(self, id_registro: int) -> Tuple[Optional[str], Optional[List[str]]]:
+        """(partición, registro) del ID; (None, None) si no está en ninguna
+
+        Un registro vigente está en una sola partición, así que si está en la que indica el
+        mapa no hace falta mirar las demás. Si no está, el mapa se rehace sólo si alguna
+        partición cambió desde que se armó (escrituras de otro proceso)."""
+        particion = self._ubicaciones.get(id_registro)
+        if particion is not None:
+            registro = self.almacenamiento.obtener_registro_por_id(particion, id_registro)
+            if registro is not None:
+                return particion, registro
+        particiones = self.particiones()
+        firmas = {particion: self.almacenamiento._obtener_firma(particion) for particion in particiones}
+        if firmas == self._firmas_ubicaciones:
+            return None, None
+        self._reconstruir_ubicaciones(particiones, firmas)
+        particion = self._ubicaciones.get(id_registro)
+        if particion is not None:
+            registro = self.almacenamiento.obtener_registro_por_id(particion, id_registro)
+            if registro is not None:
+                return particion, registro
+        return None, None
+
+    def _reconstruir_ubicaciones(self, particiones: List[str], firmas: Dict[str, Firma]):
+        """Arma el mapa ID -> partición con los índices de offsets de las particiones"""
+        ubicaciones: Dict[int, str] = {}
+        repetidos = set()
+        for particion in particiones:
+            with self.almacenamiento._bloqueo_lectura(particion):
+                ids = list(self.almacenamiento._obtener_indice(particion).offsets)
+            for id_registro in ids:
+                if ubicaciones.setdefault(id_registro, particion) != particion:
+                    repetidos.add(id_registro)
+        # Un registro movido de centro en modo log deja en el origen una marca de borrado
+        for id_registro in repetidos:
+            for particion in particiones:
+                if self.almacenamiento.obtener_registro_por_id(particion, id_registro) is not None:
+                    ubicaciones[id_registro] = particion
+                    break
+        with self.almacenamiento._mutex:
+            self._ubicaciones = ubicaciones
+            self._firmas_ubicaciones = firmas
+
+    def particiones_de_escritura(self, operacion: str, *args) -> List[str]:
+        """Particiones que tocaría una escritura del FileManager (para bloquearlas de antemano)"""
+        if operacion == 'insertar_registro':
+            return [self._particion_de_datos(args[0])]
+        if operacion == 'insertar_registros':
+            return sorted({self._particion_de_datos(datos) for datos in args[0]})
+        origen = self._ubicar(args[0])
+        particiones = [origen] if origen is not None else []
+        if operacion == 'actualizar_registro':
+            particiones.append(self._particion_de_datos(args[1]))
+        return particiones
+
+    def _mayor_id(self) -> int:
+        """Mayor ID usado en cualquier partición"""
+        mayor = 0
+        for particion in self.particiones():
+            with self.almacenamiento._bloqueo_lectura(particion):
+                mayor = max(mayor, self.almacenamiento._obtener_indice(particion).max_id)
+        return mayor
+
+    def _reservar_ids(self, cantidad: int) -> int:
+        """Reserva un bloque contiguo de IDs en la secuencia global y devuelve el primero
+
+        Sólo la reserva pasa por el bloqueo de la tabla; la escritura usa el de la partición.
+        La secuencia se guarda sin fsync y un corte puede dejarla atrás: se contrasta con el
+        mayor ID de las particiones en la primera reserva y cada vez que retrocede respecto
+        de lo que guardó este proceso (no en todas, para no esperar a las demás particiones)."""
+        with self.almacenamiento._obtener_bloqueo(self.tabla).exclusivo():
+            secuencia = self.almacenamiento._obtener_secuencia(self.tabla)
+            secuencia.cargar()
+            primero = secuencia.siguiente
+            if self._siguiente_reservado is None or primero < self._siguiente_reservado:
+                primero = max(primero, self._mayor_id() + 1)
+            secuencia.guardar(primero + cantidad)
+            self._siguiente_reservado = primero + cantidad
+        return primero
+
+    def _anexar(self, filas: List[Tuple[int, List[str]]]):
+        """Escribe filas con ID ya asignado, agrupadas por partición"""
+        por_particion: Dict[str, List[Tuple[int, List[str]]]] = {}
+        for id_registro, datos in filas:
+            por_particion.setdefault(self._particion_de_datos(datos), []).append((id_registro, datos))
+        for particion, filas_particion in por_particion.items():
+            with self.almacenamiento.bloquear_escritura([particion]):
+                self.almacenamiento._anexar_lineas(particion, filas_particion)
+            for id_registro, _ in filas_particion:
+                self._ubicaciones[id_registro] = particion
+
+    def migrar(self) -> int:
+        """Reparte en particiones el archivo sin particionar de la tabla, si existe
+
+        Se hace una sola vez: el archivo original (y su segmento de blobs) queda como
+        .migrado y sus índices se borran. Devuelve la cantidad de registros repartidos."""
+        almacenamiento = self.almacenamiento
+        ruta = almacenamiento._obtener_ruta_archivo(self.tabla)
+        with almacenamiento._obtener_bloqueo(self.tabla).exclusivo():
+            if not os.path.exists(ruta):
+                return 0
+            ya_repartidos = set()
+            for particion in self.particiones():
+                with almacenamiento._bloqueo_lectura(particion):
+                    ya_repartidos.update(almacenamiento._obtener_indice(particion).offsets)
+            # Si una migración anterior se cortó, no se repiten los registros ya copiados
+            filas = [(int(registro[0]), almacenamiento.resolver_registro(self.tabla, registro)[1:])
+                     for registro in almacenamiento.iter_registros(self.tabla)
+                     if int(registro[0]) not in ya_repartidos]
+            self._anexar(filas)
+
+            secuencia = almacenamiento._obtener_secuencia(self.tabla)
+            siguiente = almacenamiento._obtener_siguiente_id(self.tabla)
+            secuencia.guardar(max(siguiente, self._mayor_id() + 1))
+            # Los textos guardados aparte acompañan a la copia: sus filas los referencian
+            for original in (ruta, almacenamiento._obtener_ruta_blobs(self.tabla)):
+                if os.path.exists(original):
+                    os.replace(original, f"{original}.migrado")
+            for derivado in (almacenamiento._obtener_ruta_indice(self.tabla),
+                             almacenamiento._obtener_ruta_indice_texto(self.tabla),
+                             almacenamiento._obtener_ruta_contador(self.tabla)):
+                if os.path.exists(derivado):
+                    os.remove(derivado)
+            almacenamiento._indices.pop(self.tabla, None)
+            almacenamiento._contadores.pop(self.tabla, None)
+        return len(filas)
+
+    def registrar_indice(self, columna: int):
+        """Declara el índice en todas las particiones (en la de partición no hace falta)"""
+        if columna != self.columna and columna not in self._indices:
+            self._indices.append(columna)
+            self._preparadas.clear()
+
+    def registrar_indice_rango(self, columna: int):
+        """Declara el índice de rango en todas las particiones"""
+        if columna not in self._indices_rango:
+            self._indices_rango.append(columna)
+            self._preparadas.clear()
+
+    def registrar_indice_texto(self, columnas: List[int]):
+        """Declara el índice de texto en todas las particiones"""
+        if self._columnas_texto is None:
+            self._columnas_texto = list(columnas)
+            self._preparadas.clear()
+
+    def sincronizar(self):
+        """Fuerza a disco todas las particiones"""
+        for particion in self.particiones():
+            self.almacenamiento.sincronizar(particion)
+
+    def insertar_registro(self, datos: List[str]) -> int:
+        """Inserta el registro en su partición con un ID de la secuencia global"""
+        nuevo_id = self._reservar_ids(1)
+        self._anexar([(nuevo_id, datos)])
+        return nuevo_id
+
+    def insertar_registros(self, lista_datos: Iterable[List[str]]) -> List[int]:
+        """Inserta varios registros con IDs contiguos, una escritura por partición"""
+        lista_datos = list(lista_datos)
+        if not lista_datos:
+            return []
+        primer_id = self._reservar_ids(len(lista_datos))
+        ids = list(range(primer_id, primer_id + len(lista_datos)))
+        self._anexar(list(zip(ids, lista_datos)))
+        return ids
+
+    def obtener_registros(self) -> List[List[str]]:
+        """Registros de todas las particiones, en orden de ID"""
+        registros = []
+        for particion in self.particiones():
+            registros.extend(self.almacenamiento.obtener_registros(particion))
+        registros.sort(key=_id_de)
+        return registros
+
+    def iter_registros(self) -> Iterator[List[str]]:
+        """Recorre todas las particiones a la vez, intercalando por ID
+
+        Cada partición se recorre en orden de ID con su cursor (los IDs salen del índice de
+        offsets): en orden de archivo una versión nueva o un registro movido de centro
+        quedan al final, y la intercalación saldría desordenada."""
+        return heapq.merge(*(self.almacenamiento.iter_registros_desde(particion)
+                             for particion in self.particiones()), key=_id_de)
+
+    def obtener_registro_por_id(self, id_registro: int) -> Optional[List[str]]:
+        """Lee el registro en la partición que indica el mapa de ubicaciones"""
+        return self._leer_ubicado(id_registro)[1]
+
+    def actualizar_registro(self, id_registro: int, nuevos_datos: List[str]) -> bool:
+        """Actualiza el registro; si cambió el valor de partición lo mueve conservando el ID"""
+        origen = self._ubicar(id_registro)
+        if origen is None:
+            return False
+        destino = self._particion_de_datos(nuevos_datos)
+        if destino == origen:
+            return self.almacenamiento.actualizar_registro(origen, id_registro, nuevos_datos)
+
+        # nuevos_datos trae los textos (no referencias): el destino los guarda en su segmento
+        with self.almacenamiento.bloquear_escritura([origen, destino]):
+            if not self.almacenamiento.eliminar_registro(origen, id_registro):
+                return False
+            self._anexar([(id_registro, nuevos_datos)])
+        return True
+
+    def eliminar_registro(self, id_registro: int) -> bool:
+        """Elimina el registro de la partición donde esté"""
+        particion = self._ubicar(id_registro)
+        if particion is None or not self.almacenamiento.eliminar_registro(particion, id_registro):
+            return False
+        self._ubicaciones.pop(id_registro, None)
+        return True
+
+    def _unir(self, consulta, *args) -> List[List[str]]:
+        """Ejecuta la consulta en cada partición y une los resultados en orden de ID"""
+        registros = []
+        for particion in self.particiones():
+            registros.extend(getattr(self.almacenamiento, consulta)(particion, *args))
+        registros.sort(key=_id_de)
+        return registros
+
+    def buscar_registros(self, columna: int, valor: str) -> List[List[str]]:
+        """Búsqueda por contenido en todas las particiones"""
+        return self._unir('buscar_registros', columna, valor)
+
+    def buscar_registros_exactos(self, columna: int, valor: str) -> List[List[str]]:
+        """Por la columna de partición se lee una sola partición; si no, todas"""
+        if columna == self.columna:
+            particion = self._particion_existente(valor)
+            return self.almacenamiento.obtener_registros(particion) if particion is not None else []
+        return self._unir('buscar_registros_exactos', columna, valor)
+
+    def buscar_texto(self, consulta: str) -> List[List[str]]:
+        """Búsqueda de texto en el índice de cada partición"""
+        return self._unir('buscar_texto', consulta)
+
+    def buscar_rango(self, columna: int, desde: Optional[str] = None, hasta: Optional[str] = None,
+                     igual_a: Optional[Dict[int, str]] = None, descendente: bool = False,
+                     limite: Optional[int] = None) -> List[List[str]]:
+        """Rango en una sola partición si igual_a fija su columna; si no, se intercalan por
+        valor los resultados de todas (cada una corta en el límite)"""
+        condiciones = dict(igual_a or {})
+        if self.columna in condiciones:
+            particion = self._particion_existente(condiciones.pop(self.columna))
+            if particion is None:
+                return []
+            return self.almacenamiento.buscar_rango(particion, columna, desde, hasta, condiciones,
+                                                    descendente, limite)
+
+        def clave(registro: List[str]) -> Tuple[str, int]:
+            return registro[columna], _id_de(registro)
+
+        resultados = heapq.merge(*(self.almacenamiento.buscar_rango(particion, columna, desde, hasta, condiciones,
+                                                                    descendente, limite)
+                                   for particion in self.particiones()), key=clave, reverse=descendente)
+        return list(itertools.islice(resultados, limite))
+
+    def _sumar(self, estimacion, *args) -> Optional[int]:
+        """Suma la estimación de cada partición (None si alguna no puede estimar)"""
+        total = 0
+        for particion in self.particiones():
+            parcial = getattr(self.almacenamiento, estimacion)(particion, *args)
+            if parcial is None:
+                return None
+            total += parcial
+        return total
+
+    def estimar_exactos(self, columna: int, valor: str) -> Optional[int]:
+        """Por la columna de partición, los registros de esa partición; si no, la suma"""
+        if columna == self.columna:
+            particion = self._particion_existente(valor)
+            if particion is None:
+                return 0
+            with self.almacenamiento._bloqueo_lectura(particion):
+                return len(self.almacenamiento._obtener_indice(particion).offsets)
+        if columna not in self._indices:
+            return None
+        return self._sumar('estimar_exactos', columna, valor)
+
+    def estimar_rango(self, columna: int, desde: Optional[str] = None,
+                      hasta: Optional[str] = None) -> Optional[int]:
+        """Suma de los rangos de cada partición"""
+        if columna not in self._indices_rango:
+            return None
+        return self._sumar('estimar_rango', columna, desde, hasta)
+
+    def estimar_texto(self, consulta: str) -> Optional[int]:
+        """Suma de los índices de texto de cada partición"""
+        if self._columnas_texto is None:
+            return None
+        return self._sumar('estimar_texto', consulta)
+
+    def obtener_registros_por_ids(self, ids: Iterable[int]) -> List[List[str]]:
+        """Cada partición devuelve los IDs que tiene"""
+        return self._unir('obtener_registros_por_ids', list(ids))
+
+    def iter_registros_desde(self, despues_de: int = 0, columna: Optional[int] = None,
+                             valor: Optional[str] = None) -> Iterator[List[str]]:
+        """Paginación por cursor: una sola partición si se filtra por su columna, si no
+        se intercalan los cursores de todas (cada uno sólo lee lo que se consume)"""
+        if columna == self.columna:
+            particion = self._particion_existente(valor)
+            if particion is None:
+                return iter(())
+            return self.almacenamiento.iter_registros_desde(particion, despues_de)
+        return heapq.merge(*(self.almacenamiento.iter_registros_desde(particion, despues_de, columna, valor)
+                             for particion in self.particiones()), key=_id_de)
+
+    def contar_activos(self, grupo: Optional[str] = None) -> Dict[Tuple[str, ...], int]:
+        """Suma los contadores de las particiones (sólo los de una si el grupo es su valor)"""
+        _, columnas = self.almacenamiento._especificacion_contador(self.tabla)
+        if grupo is not None and columnas and columnas[0] == self.columna:
+            particion = self._particion_existente(grupo)
+            return self.almacenamiento.contar_activos(particion, grupo) if particion is not None else {}
+
+        conteos: Dict[Tuple[str, ...], int] = {}
+        for particion in self.particiones():
+            for clave, total in self.almacenamiento.contar_activos(particion, grupo).items():
+                conteos[clave] = conteos.get(clave, 0) + total
+        return conteos
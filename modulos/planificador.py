@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MiClinica - Módulo Planificador
+Consultas componibles sobre el almacenamiento que eligen el índice más selectivo
+"""
+
+from typing import Dict, Iterable, List, Mapping, Optional, Set, Tuple
+
+from modulos.almacenamiento import AlmacenamientoBase
+from modulos.indices import tokenizar
+
+# Orden de preferencia entre caminos de acceso con el mismo costo estimado
+PREFERENCIA = {"exacto": 0, "rango": 1, "texto": 2, "recorrido": 3}
+
+
+def _valor(valor) -> str:
+    """Valor de una condición tal como se guarda en las filas (un bool, en minúsculas)"""
+    if isinstance(valor, bool):
+        return str(valor).lower()
+    return valor if isinstance(valor, str) else str(valor)
+
+
+class Plan:
+    """Camino de acceso elegido para una consulta y lo que queda por hacer sobre las filas
+
+    acceso es ("exacto", columna), ("rango", columna), ("texto", None) o ("recorrido", None).
+    """
+
+    __slots__ = ('acceso', 'estimacion', 'costo', 'descartados', 'filtros', 'ordenado', 'limite_en_lectura',
+                 '_texto')
+
+    def __init__(self, acceso: Tuple[str, Optional[int]], estimacion: Optional[int], costo: Optional[float],
+                 descartados: List[Tuple[str, Optional[int], Optional[float]]], filtros: List[str],
+                 ordenado: bool, limite_en_lectura: bool):
+        self.acceso = acceso
+        self.estimacion = estimacion  # filas que cumplen la condición del acceso
+        self.costo = costo  # filas que se espera leer (menos si el acceso corta en el límite)
+        self.descartados = descartados  # (descripción, estimación, costo) de los otros caminos
+        self.filtros = filtros  # condiciones que se comprueban sobre cada fila leída
+        self.ordenado = ordenado  # el acceso ya entrega las filas en el orden pedido
+        self.limite_en_lectura = limite_en_lectura  # el acceso deja de leer al llegar al límite
+        self._texto = ""
+
+    def explicar(self) -> str:
+        """Descripción legible del plan"""
+        return self._texto
+
+    def __str__(self):
+        return self._texto
+
+
+class Consulta:
+    """Consulta componible sobre un archivo: condiciones exactas, un rango, texto, orden y límite
+
+    Los campos se nombran como en el modelo; columnas da la columna de cada uno en las
+    filas (la 0 es el ID). Un campo booleano se compara sin distinguir mayúsculas, como
+    al leer las filas ("True", "true"...). Al ejecutar se estima con los índices del motor cuántas filas leería cada camino de
+    acceso y se usa el más barato; el resto de las condiciones se comprueba sobre las
+    filas en bruto, antes de que el DAO arme objetos.
+    """
+
+    def __init__(self, almacenamiento: AlmacenamientoBase, archivo: str, columnas: Mapping[str, int]):
+        self.almacenamiento = almacenamiento
+        self.archivo = archivo
+        self.columnas = dict(columnas)
+        self.campos = {columna: campo for campo, columna in self.columnas.items()}
+        self._igual: Dict[int, str] = {}
+        self._sin_mayusculas: Set[int] = set()  # columnas de _igual que se comparan en minúsculas
+        self._rango: Optional[Tuple[int, Optional[str], Optional[str]]] = None
+        self._texto: Optional[Tuple[str, List[int]]] = None
+        self._orden: Optional[Tuple[int, bool]] = None
+        self._limite: Optional[int] = None
+
+    def _columna(self, campo: str) -> int:
+        """Columna del campo en las filas"""
+        try:
+            return self.columnas[campo]
+        except KeyError:
+            raise ValueError(f"Campo desconocido en {self.archivo}: {campo}") from None
+
+    def donde(self, campo: str, valor) -> 'Consulta':
+        """Exige un valor exacto en el campo (sin distinguir mayúsculas si es un bool)"""
+        columna = self._columna(campo)
+        self._igual[columna] = _valor(valor)
+        if isinstance(valor, bool):
+            self._sin_mayusculas.add(columna)
+        else:
+            self._sin_mayusculas.discard(columna)
+        return self
+
+    def entre(self, campo: str, desde: Optional[str] = None, hasta: Optional[str] = None) -> 'Consulta':
+        """Exige el campo entre desde y hasta, incluidos (sólo se admite un rango por consulta)"""
+        if self._rango is not None:
+            raise ValueError("La consulta ya tiene un rango")
+        self._rango = (self._columna(campo), desde, hasta)
+        return self
+
+    def contiene(self, texto: str, campos: Iterable[str]) -> 'Consulta':
+        """Exige todas las palabras del texto (admite prefijos) entre los campos indicados"""
+        self._texto = (texto, [self._columna(campo) for campo in campos])
+        return self
+
+    def ordenar_por(self, campo: str) -> 'Consulta':
+        """Ordena por el campo; con "-" delante, de mayor a menor"""
+        descendente = campo.startswith("-")
+        self._orden = (self._columna(campo.lstrip("-")), descendente)
+        return self
+
+    def limitar(self, limite: Optional[int]) -> 'Consulta':
+        """Devuelve como mucho limite filas"""
+        self._limite = limite
+        return self
+
+    # ---- Planificación ----
+
+    def _describir(self, acceso: Tuple[str, Optional[int]]) -> str:
+        """Descripción de un camino de acceso"""
+        tipo, columna = acceso
+        if tipo == "exacto":
+            return f"índice exacto {self.campos[columna]} = {self._igual[columna]!r}"
+        if tipo == "rango":
+            if self._rango is not None and self._rango[0] == columna:
+                _, desde, hasta = self._rango
+                return f"índice de rango {self.campos[columna]} entre {desde!r} y {hasta!r}"
+            return f"índice de rango {self.campos[columna]} (recorrido en orden)"
+        if tipo == "texto":
+            return f"índice de texto {self._texto[0]!r}"
+        return "recorrido completo del archivo"
+
+    def _candidatos(self) -> List[Tuple[Tuple[str, Optional[int]], Optional[int], Optional[float]]]:
+        """Caminos de acceso con índice: (acceso, filas estimadas, filas que se leerían)"""
+        motor, archivo = self.almacenamiento, self.archivo
+        exactos = {}
+        for columna, valor in self._igual.items():
+            if columna in self._sin_mayusculas:
+                continue  # los índices distinguen mayúsculas
+            estimacion = motor.estimar_exactos(archivo, columna, valor)
+            if estimacion is not None:
+                exactos[columna] = estimacion
+
+        candidatos = [(("exacto", columna), estimacion, float(estimacion))
+                      for columna, estimacion in exactos.items()]
+        if self._texto is not None:
+            estimacion = motor.estimar_texto(archivo, self._texto[0])
+            if estimacion is not None:
+                candidatos.append((("texto", None), estimacion, float(estimacion)))
+
+        # Un índice de rango sirve por su condición o, con límite, para leer ya ordenado
+        columnas_rango = []
+        if self._rango is not None:
+            columnas_rango.append(self._rango[0])
+        if self._orden is not None and self._orden[0] != 0 and self._limite is not None:
+            columnas_rango.append(self._orden[0])
+        for columna in dict.fromkeys(columnas_rango):
+            desde, hasta = (None, None)
+            if self._rango is not None and self._rango[0] == columna:
+                _, desde, hasta = self._rango
+            estimacion = motor.estimar_rango(archivo, columna, desde, hasta)
+            if estimacion is None:
+                continue
+            costo = float(estimacion)
+            if (self._orden is not None and self._orden[0] == columna and self._limite is not None
+                    and not self._texto and (self._rango is None or self._rango[0] == columna)):
+                # Corta al llegar al límite: lee más filas cuanto menos selectivo sea el resto
+                total = motor.estimar_rango(archivo, columna) or 1
+                selectividad = min(exactos.values(), default=total) / total
+                costo = min(costo, self._limite / max(selectividad, 1 / total))
+            candidatos.append((("rango", columna), estimacion, costo))
+        return candidatos
+
+    def planificar(self) -> Plan:
+        """Elige el camino de acceso de menor costo estimado y arma el plan"""
+        candidatos = self._candidatos()
+        if candidatos:
+            elegido = min(candidatos, key=lambda c: (c[2], PREFERENCIA[c[0][0]]))
+        else:
+            elegido = (("recorrido", None), None, None)
+        acceso, estimacion, costo = elegido
+        tipo, columna = acceso
+
+        filtros = []
+        for c, valor in self._igual.items():
+            if tipo == "exacto" and c == columna:
+                continue
+            donde = " (dentro del acceso)" if tipo == "rango" and c not in self._sin_mayusculas else ""
+            filtros.append(f"{self.campos[c]} = {valor!r}{donde}")
+        if self._rango is not None and not (tipo == "rango" and columna == self._rango[0]):
+            filtros.append(f"{self.campos[self._rango[0]]} entre {self._rango[1]!r} y {self._rango[2]!r}")
+        if self._texto is not None and tipo != "texto":
+            filtros.append(f"texto {self._texto[0]!r} en {', '.join(self.campos[c] for c in self._texto[1])}")
+
+        # Sin índice, el recorrido por cursor sale en orden de ID y permite cortar en el límite
+        ordenado = (tipo == "recorrido" and self._limite is not None
+                    and (self._orden is None or self._orden == (0, False)))
+        if tipo == "rango" and self._orden is not None and self._orden[0] == columna:
+            ordenado = True
+        # buscar_rango aplica el límite tras las condiciones exactas: no puede quedar otra por comprobar
+        resto_en_filas = (self._texto is not None or (self._rango is not None and self._rango[0] != columna)
+                          or any(c in self._sin_mayusculas for c in self._igual))
+        limite_en_lectura = self._limite is not None and ordenado and (tipo == "recorrido" or not resto_en_filas)
+
+        plan = Plan(acceso, estimacion, costo,
+                    [(self._describir(c[0]), c[1], c[2]) for c in candidatos if c is not elegido],
+                    filtros, ordenado, limite_en_lectura)
+        plan._texto = self._explicacion(plan)
+        return plan
+
+    def _explicacion(self, plan: Plan) -> str:
+        """Texto de explicar() para el plan"""
+        def filas(estimacion, costo):
+            if estimacion is None:
+                return ""
+            if costo is not None and costo < estimacion:
+                return f" (~{estimacion} filas, se leerían ~{max(1, round(costo))})"
+            return f" (~{estimacion} filas)"
+
+        lineas = [f"Consulta sobre {self.archivo}",
+                  f"  Acceso: {self._describir(plan.acceso)}{filas(plan.estimacion, plan.costo)}"]
+        for descripcion, estimacion, costo in plan.descartados:
+            lineas.append(f"  Descartado: {descripcion}{filas(estimacion, costo)}")
+        if plan.filtros:
+            lineas.append(f"  Filtro sobre las filas: {'; '.join(plan.filtros)}")
+        if self._orden is not None:
+            columna, descendente = self._orden
+            sentido = "descendente" if descendente else "ascendente"
+            lineas.append(f"  Orden: {self.campos[columna]} {sentido} "
+                          f"({'lo da el acceso' if plan.ordenado else 'en memoria'})")
+        if self._limite is not None:
+            lineas.append(f"  Límite: {self._limite} "
+                          f"({'corta la lectura' if plan.limite_en_lectura else 'tras filtrar y ordenar'})")
+        return "\n".join(lineas)
+
+    def explicar(self) -> str:
+        """Explica qué camino de acceso usaría la consulta y por qué"""
+        return self.planificar().explicar()
+
+    # ---- Ejecución ----
+
+    def _cumple(self, registro: List[str], igual: Dict[int, str], rango, texto) -> bool:
+        """Comprueba las condiciones restantes sobre una fila en bruto"""
+        leer = self.almacenamiento.leer_campo
+        for columna, valor in igual.items():
+            if len(registro) <= columna:
+                return False
+            actual = leer(self.archivo, registro, columna)
+            if (actual.lower() if columna in self._sin_mayusculas else actual) != valor:
+                return False
+        if rango is not None:
+            columna, desde, hasta = rango
+            if len(registro) <= columna:
+                return False
+            valor = registro[columna]
+            if (desde is not None and valor < desde) or (hasta is not None and valor > hasta):
+                return False
+        if texto is not None:
+            palabras, columnas = texto
+            terminos = tokenizar(" ".join(leer(self.archivo, registro, c) for c in columnas if c < len(registro)))
+            if not all(any(t.startswith(p) for t in terminos) for p in palabras):
+                return False
+        return True
+
+    def ejecutar(self, plan: Optional[Plan] = None) -> List[List[str]]:
+        """Ejecuta la consulta y devuelve las filas en bruto"""
+        plan = plan or self.planificar()
+        motor, archivo = self.almacenamiento, self.archivo
+        tipo, columna = plan.acceso
+        igual = dict(self._igual)
+        rango = self._rango
+        texto = (tokenizar(self._texto[0]), self._texto[1]) if self._texto is not None else None
+
+        if tipo == "exacto":
+            filas = motor.buscar_registros_exactos(archivo, columna, igual.pop(columna))
+        elif tipo == "texto":
+            filas = motor.buscar_texto(archivo, self._texto[0])
+            texto = None
+        elif tipo == "rango":
+            desde, hasta = (rango[1], rango[2]) if rango is not None and rango[0] == columna else (None, None)
+            if rango is not None and rango[0] == columna:
+                rango = None
+            descendente = plan.ordenado and self._orden[1]
+            # El motor compara los valores tal cual: los que no distinguen mayúsculas quedan en las filas
+            en_acceso = {c: valor for c, valor in igual.items() if c not in self._sin_mayusculas}
+            filas = motor.buscar_rango(archivo, columna, desde, hasta, en_acceso, descendente,
+                                       self._limite if plan.limite_en_lectura else None)
+            igual = {c: valor for c, valor in igual.items() if c in self._sin_mayusculas}
+        else:
+            filas = motor.iter_registros_desde(archivo) if plan.limite_en_lectura else motor.iter_registros(archivo)
+
+        resultados = []
+        for registro in filas:
+            if self._cumple(registro, igual, rango, texto):
+                resultados.append(registro)
+                if plan.limite_en_lectura and len(resultados) >= self._limite:
+                    break
+
+        if not plan.ordenado:
+            if self._orden is None or self._orden[0] == 0:
+                resultados.sort(key=lambda registro: int(registro[0]),
+                                reverse=self._orden is not None and self._orden[1])
+            else:
+                columna_orden, descendente = self._orden
+                resultados.sort(key=lambda registro: (registro[columna_orden] if len(registro) > columna_orden
+                                                      else "", int(registro[0])), reverse=descendente)
+        return resultados[:self._limite] if self._limite is not None else resultados
@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MiClinica - Módulo de Almacenamiento SQLite
+Motor de almacenamiento alternativo a los archivos DAT usando sqlite3 (biblioteca estándar)
+"""
+
+import itertools
+import os
+import re
+import sqlite3
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from modulos.almacenamiento import AlmacenamientoBase
+from modulos.indices import tokenizar
+
+
+class SQLiteManager(AlmacenamientoBase):
+    """Motor de almacenamiento sobre SQLite con índices reales, sentencias preparadas y modo WAL
+
+    Cada archivo DAT se guarda como una tabla (id, c1, c2, ...) donde la columna cN
+    corresponde a la posición N del registro, igual que en los archivos DAT.
+    """
+
+    # Registro de las importaciones hechas con importar_desde (no es un archivo de datos)
+    TABLA_MIGRACIONES = "_migraciones"
+    # Tablas internas que SQLite crea junto a cada tabla FTS5 (<tabla>_data, ...)
+    SUFIJOS_FTS = ("_data", "_idx", "_content", "_docsize", "_config")
+    # Filas por executemany al importar: el origen se recorre sin cargarlo entero
+    TAMANO_LOTE_IMPORTACION = 1000
+
+    def __init__(self, ruta_db: str = os.path.join("data", "miclinica.db")):
+        super().__init__()
+        directorio = os.path.dirname(ruta_db)
+        if directorio and not os.path.exists(directorio):
+            os.makedirs(directorio)
+
+        self.ruta_db = ruta_db
+        self.conexion = sqlite3.connect(ruta_db)
+        self.conexion.execute("PRAGMA journal_mode=WAL")
+        self.conexion.execute("PRAGMA synchronous=NORMAL")
+        self.conexion.create_function("minusculas", 1, lambda texto: texto.lower() if texto else texto,
+                                      deterministic=True)
+        self._columnas: Dict[str, int] = {}
+        self._indices: Dict[str, Set[int]] = {}
+        self._fts_disponible = self._probar_fts5()
+        self._cargar_tablas()
+
+    def _probar_fts5(self) -> bool:
+        """Verifica si el SQLite instalado incluye búsqueda de texto completo (FTS5)"""
+        try:
+            self.conexion.execute("CREATE VIRTUAL TABLE temp.prueba_fts USING fts5(texto)")
+            self.conexion.execute("DROP TABLE temp.prueba_fts")
+            return True
+        except sqlite3.OperationalError:
+            return False
+
+    def _cargar_tablas(self):
+        """Lee la cantidad de columnas de las tablas ya existentes (sin las del índice de texto)"""
+        tablas = self.conexion.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'").fetchall()
+        virtuales = {nombre for nombre, sql in tablas if (sql or "").upper().startswith("CREATE VIRTUAL TABLE")}
+        internas = virtuales | {virtual + sufijo for virtual in virtuales for sufijo in self.SUFIJOS_FTS}
+        for nombre, _ in tablas:
+            if nombre in internas:
+                continue
+            columnas = [fila[1] for fila in self.conexion.execute(f'PRAGMA table_info("{nombre}")')]
+            if columnas and columnas[0] == "id":
+                self._columnas[nombre] = len(columnas) - 1
+
+    def _validar_nombre(self, archivo: str) -> str:
+        """Evita nombres de tabla que no sean identificadores simples"""
+        if not re.fullmatch(r"[A-Za-z_]\w*", archivo):
+            raise ValueError(f"Nombre de archivo no válido: {archivo}")
+        return archivo
+
+    def _asegurar_tabla(self, archivo: str, cantidad_columnas: int):
+        """Crea la tabla o le añade columnas si hace falta"""
+        self._validar_nombre(archivo)
+        actuales = self._columnas.get(archivo)
+        if actuales is None:
+            definicion = ", ".join(f"c{i} TEXT" for i in range(1, cantidad_columnas + 1))
+            self.conexion.execute(
+                f'CREATE TABLE IF NOT EXISTS "{archivo}" (id INTEGER PRIMARY KEY AUTOINCREMENT, {definicion})')
+            self._columnas[archivo] = cantidad_columnas
+        elif actuales < cantidad_columnas:
+            for i in range(actuales + 1, cantidad_columnas + 1):
+                self.conexion.execute(f'ALTER TABLE "{archivo}" ADD COLUMN c{i} TEXT')
+            self._columnas[archivo] = cantidad_columnas
+        self._crear_indices(archivo)
+
+    def _crear_indices(self, archivo: str):
+        """Crea los índices declarados sobre columnas que ya existen en la tabla"""
+        for columna in self._indices.get(archivo, set()):
+            if columna <= self._columnas.get(archivo, 0):
+                self.conexion.execute(
+                    f'CREATE INDEX IF NOT EXISTS "idx_{archivo}_c{columna}" ON "{archivo}" (c{columna})')
+
+    def _a_registro(self, fila: tuple) -> List[str]:
+        """Convierte una fila de SQLite en un registro como los de los archivos DAT"""
+        valores = list(fila[1:])
+        while valores and valores[-1] is None:
+            valores.pop()
+        return [str(fila[0])] + ["" if valor is None else valor for valor in valores]
+
+    def _columnas_sql(self, cantidad: int) -> str:
+        """Lista 'c1, c2, ...' para las sentencias"""
+        return ", ".join(f"c{i}" for i in range(1, cantidad + 1))
+
+    # ---- Índice de texto completo ----
+
+    def _tabla_texto(self, archivo: str) -> Optional[str]:
+        """Nombre de la tabla FTS del archivo, si tiene índice de texto"""
+        if self._fts_disponible and archivo in self._columnas_texto:
+            return f"{archivo}_texto"
+        return None
+
+    def _texto_de(self, archivo: str, registro: List[str]) -> str:
+        """Texto indexable de un registro (columnas de texto libre normalizadas)"""
+        return " ".join(sorted(tokenizar(" ".join(
+            registro[c] for c in self._columnas_texto[archivo] if c < len(registro)))))
+
+    def _indexar_texto(self, archivo: str, registros: Iterable[List[str]]):
+        """Agrega o reemplaza registros en el índice de texto"""
+        tabla = self._tabla_texto(archivo)
+        if tabla is not None:
+            self.conexion.executemany(
+                f'INSERT OR REPLACE INTO "{tabla}" (rowid, texto) VALUES (?, ?)',
+                ((int(registro[0]), self._texto_de(archivo, registro)) for registro in registros))
+
+    def registrar_indice(self, archivo: str, columna: int):
+        """Declara (y crea si la tabla existe) un índice SQLite sobre la columna"""
+        self._indices.setdefault(self._validar_nombre(archivo), set()).add(columna)
+        with self.conexion:
+            self._crear_indices(archivo)
+
+    def registrar_indice_rango(self, archivo: str, columna: int):
+        """El índice SQLite (árbol B) sirve también para los rangos"""
+        self.registrar_indice(archivo, columna)
+
+    def registrar_indice_texto(self, archivo: str, columnas: List[int]):
+        """Declara las columnas de texto libre y crea su tabla FTS5 si está disponible"""
+        super().registrar_indice_texto(self._validar_nombre(archivo), columnas)
+        tabla = self._tabla_texto(archivo)
+        if tabla is None:
+            return
+
+        existe = self.conexion.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = ?", (tabla,)).fetchone()
+        if not existe:
+            with self.conexion:
+                self.conexion.execute(
+                    f'CREATE VIRTUAL TABLE "{tabla}" USING fts5(texto, tokenize="unicode61 remove_diacritics 2")')
+                self._indexar_texto(archivo, self.iter_registros(archivo))
+
+    def _comprobar_unicos(self, archivo: str, filas: List[Tuple[Optional[int], List[str]]]):
+        """Comprueba las columnas únicas dentro de la transacción de la escritura
+
+        La transacción se abre con BEGIN IMMEDIATE, que toma el bloqueo de escritura de la
+        base: ningún otro proceso puede escribir entre la comprobación y la escritura."""
+        if not self._unicos.get(archivo):
+            return
+        if not self.conexion.in_transaction:
+            self.conexion.execute("BEGIN IMMEDIATE")
+        self._verificar_unicos(archivo, filas)
+
+    # ---- Contrato de AlmacenamientoBase ----
+
+    def insertar_registro(self, archivo: str, datos: List[str]) -> int:
+        """Inserta un nuevo registro"""
+        with self.conexion:
+            self._asegurar_tabla(archivo, len(datos))
+            self._comprobar_unicos(archivo, [(None, datos)])
+            cursor = self.conexion.execute(
+                f'INSERT INTO "{archivo}" ({self._columnas_sql(len(datos))}) '
+                f'VALUES ({", ".join("?" * len(datos))})', datos)
+            nuevo_id = cursor.lastrowid
+            self._indexar_texto(archivo, [[str(nuevo_id)] + list(datos)])
+        return nuevo_id
+
+    def insertar_registros(self, archivo: str, lista_datos: Iterable[List[str]]) -> List[int]:
+        """Inserta varios registros en una transacción reservando un bloque contiguo de IDs"""
+        lista_datos = [list(datos) for datos in lista_datos]
+        if not lista_datos:
+            return []
+
+        cantidad = max(len(datos) for datos in lista_datos)
+        with self.conexion:
+            self._asegurar_tabla(archivo, cantidad)
+            self._comprobar_unicos(archivo, [(None, datos) for datos in lista_datos])
+            ultimo_id = self.conexion.execute(f'SELECT COALESCE(MAX(id), 0) FROM "{archivo}"').fetchone()[0]
+            secuencia = self.conexion.execute(
+                "SELECT seq FROM sqlite_sequence WHERE name = ?", (archivo,)).fetchone()
+            primer_id = max(ultimo_id, secuencia[0] if secuencia else 0) + 1
+
+            registros = [[str(primer_id + i)] + datos + [None] * (cantidad - len(datos))
+                         for i, datos in enumerate(lista_datos)]
+            self.conexion.executemany(
+                f'INSERT INTO "{archivo}" (id, {self._columnas_sql(cantidad)}) '
+                f'VALUES ({", ".join("?" * (cantidad + 1))})', registros)
+            self._indexar_texto(archivo, registros)
+        return list(range(primer_id, primer_id + len(lista_datos)))
+
+    def obtener_registros(self, archivo: str) -> List[List[str]]:
+        """Obtiene todos los registros de una tabla"""
+        return list(self.iter_registros(archivo))
+
+    def iter_registros(self, archivo: str) -> Iterator[List[str]]:
+        """Recorre los registros de la tabla con un cursor, sin cargarlos todos"""
+        if archivo not in self._columnas:
+            return
+        for fila in self.conexion.execute(f'SELECT * FROM "{archivo}" ORDER BY id'):
+            yield self._a_registro(fila)
+
+    def iter_registros_desde(self, archivo: str, despues_de: int = 0, columna: Optional[int] = None,
+                             valor: Optional[str] = None) -> Iterator[List[str]]:
+        """Recorre en orden de ID los registros con ID mayor que despues_de, leyendo a medida que se piden"""
+        if archivo not in self._columnas:
+            return
+        consulta = f'SELECT * FROM "{archivo}" WHERE id > ?'
+        parametros: tuple = (despues_de,)
+        if columna is not None:
+            if columna < 1 or columna > self._columnas[archivo]:
+                return
+            consulta += f" AND c{columna} = ?"
+            parametros += (valor,)
+        for fila in self.conexion.execute(consulta + " ORDER BY id", parametros):
+            yield self._a_registro(fila)
+
+    def obtener_registro_por_id(self, archivo: str, id_registro: int) -> Optional[List[str]]:
+        """Obtiene un registro por su clave primaria"""
+        if archivo not in self._columnas:
+            return None
+        fila = self.conexion.execute(f'SELECT * FROM "{archivo}" WHERE id = ?', (id_registro,)).fetchone()
+        return self._a_registro(fila) if fila else None
+
+    def obtener_registros_por_ids(self, archivo: str, ids: Iterable[int]) -> List[List[str]]:
+        """Obtiene varios registros por ID en consultas por lotes"""
+        if archivo not in self._columnas:
+            return []
+        ids = sorted(ids)
+        registros = []
+        for inicio in range(0, len(ids), 500):
+            lote = ids[inicio:inicio + 500]
+            consulta = f'SELECT * FROM "{archivo}" WHERE id IN ({", ".join("?" * len(lote))}) ORDER BY id'
+            registros.extend(self._a_registro(fila) for fila in self.conexion.execute(consulta, lote))
+        return registros
+
+    def actualizar_registro(self, archivo: str, id_registro: int, nuevos_datos: List[str]) -> bool:
+        """Actualiza un registro existente"""
+        if archivo not in self._columnas:
+            return False
+        with self.conexion:
+            self._asegurar_tabla(archivo, len(nuevos_datos))
+            self._comprobar_unicos(archivo, [(id_registro, nuevos_datos)])
+            asignaciones = ", ".join(f"c{i} = ?" for i in range(1, len(nuevos_datos) + 1))
+            cursor = self.conexion.execute(
+                f'UPDATE "{archivo}" SET {asignaciones} WHERE id = ?', list(nuevos_datos) + [id_registro])
+            if cursor.rowcount:
+                self._indexar_texto(archivo, [[str(id_registro)] + list(nuevos_datos)])
+        return cursor.rowcount > 0
+
+    def eliminar_registro(self, archivo: str, id_registro: int) -> bool:
+        """Elimina físicamente un registro"""
+        if archivo not in self._columnas:
+            return False
+        with self.conexion:
+            cursor = self.conexion.execute(f'DELETE FROM "{archivo}" WHERE id = ?', (id_registro,))
+            tabla = self._tabla_texto(archivo)
+            if tabla is not None:
+                self.conexion.execute(f'DELETE FROM "{tabla}" WHERE rowid = ?', (id_registro,))
+        return cursor.rowcount > 0
+
+    def buscar_registros(self, archivo: str, columna: int, valor: str) -> List[List[str]]:
+        """Busca registros cuya columna contiene el valor (sin distinguir mayúsculas)"""
+        if columna < 1 or columna > self._columnas.get(archivo, 0):
+            return []
+        consulta = f'SELECT * FROM "{archivo}" WHERE instr(minusculas(c{columna}), ?) > 0 ORDER BY id'
+        return [self._a_registro(fila) for fila in self.conexion.execute(consulta, (valor.lower(),))]
+
+    def buscar_registros_exactos(self, archivo: str, columna: int, valor: str) -> List[List[str]]:
+        """Busca registros por valor exacto (usa el índice de la columna si fue declarado)"""
+        if columna < 1 or columna > self._columnas.get(archivo, 0):
+            return []
+        consulta = f'SELECT * FROM "{archivo}" WHERE c{columna} = ? ORDER BY id'
+        return [self._a_registro(fila) for fila in self.conexion.execute(consulta, (valor,))]
+
+    def buscar_rango(self, archivo: str, columna: int, desde: Optional[str] = None,
+                     hasta: Optional[str] = None, igual_a: Optional[Dict[int, str]] = None,
+                     descendente: bool = False, limite: Optional[int] = None) -> List[List[str]]:
+        """Búsqueda por rango resuelta en SQL (usa el índice de la columna si fue declarado)"""
+        condiciones = dict(igual_a or {})
+        total = self._columnas.get(archivo, 0)
+        if not 1 <= columna <= total or any(not 1 <= c <= total for c in condiciones):
+            return []
+        filtros = [f"c{columna} IS NOT NULL"]
+        parametros: list = []
+        if desde is not None:
+            filtros.append(f"c{columna} >= ?")
+            parametros.append(desde)
+        if hasta is not None:
+            filtros.append(f"c{columna} <= ?")
+            parametros.append(hasta)
+        for c, valor in condiciones.items():
+            filtros.append(f"c{c} = ?")
+            parametros.append(valor)
+        sentido = "DESC" if descendente else "ASC"
+        consulta = (f'SELECT * FROM "{archivo}" WHERE {" AND ".join(filtros)} '
+                    f'ORDER BY c{columna} {sentido}, id {sentido}')
+        if limite is not None:
+            consulta += " LIMIT ?"
+            parametros.append(limite)
+        return [self._a_registro(fila) for fila in self.conexion.execute(consulta, parametros)]
+
+    def _contar(self, consulta: str, parametros: tuple) -> int:
+        """Ejecuta un SELECT COUNT(*) y devuelve el número"""
+        return self.conexion.execute(consulta, parametros).fetchone()[0]
+
+    def estimar_exactos(self, archivo: str, columna: int, valor: str) -> Optional[int]:
+        """COUNT sobre el índice de la columna (None si no fue declarado)"""
+        if columna not in self._indices.get(archivo, set()) or columna > self._columnas.get(archivo, 0):
+            return None
+        return self._contar(f'SELECT COUNT(*) FROM "{archivo}" WHERE c{columna} = ?', (valor,))
+
+    def estimar_rango(self, archivo: str, columna: int, desde: Optional[str] = None,
+                      hasta: Optional[str] = None) -> Optional[int]:
+        """COUNT del rango sobre el índice de la columna (None si no fue declarado)"""
+        if columna not in self._indices.get(archivo, set()) or columna > self._columnas.get(archivo, 0):
+            return None
+        return self._contar(f'SELECT COUNT(*) FROM "{archivo}" WHERE c{columna} IS NOT NULL '
+                            f'AND c{columna} >= COALESCE(?, c{columna}) AND c{columna} <= COALESCE(?, c{columna})',
+                            (desde, hasta))
+
+    def estimar_texto(self, archivo: str, consulta: str) -> Optional[int]:
+        """COUNT de las coincidencias en la tabla FTS5 (None si no hay)"""
+        tabla = self._tabla_texto(archivo)
+        if tabla is None or archivo not in self._columnas:
+            return None
+        palabras = tokenizar(consulta)
+        if not palabras:
+            return 0
+        expresion = " ".join(f'"{palabra}"*' for palabra in sorted(palabras))
+        return self._contar(f'SELECT COUNT(*) FROM "{tabla}" WHERE "{tabla}" MATCH ?', (expresion,))
+
+    def buscar_texto(self, archivo: str, consulta: str) -> List[List[str]]:
+        """Busca registros con todas las palabras de la consulta usando FTS5 (admite prefijos)"""
+        tabla = self._tabla_texto(archivo)
+        if tabla is None or archivo not in self._columnas:
+            return super().buscar_texto(archivo, consulta) if archivo in self._columnas else []
+        palabras = tokenizar(consulta)
+        if not palabras:
+            return []
+
+        expresion = " ".join(f'"{palabra}"*' for palabra in sorted(palabras))
+        sql = (f'SELECT t.* FROM "{archivo}" t JOIN "{tabla}" f ON f.rowid = t.id '
+               f'WHERE "{tabla}" MATCH ? ORDER BY t.id')
+        return [self._a_registro(fila) for fila in self.conexion.execute(sql, (expresion,))]
+
+    def contar_activos(self, archivo: str, grupo: Optional[str] = None) -> Dict[Tuple[str, ...], int]:
+        """Cuenta los registros activos agrupados según CONTADORES con una sola consulta"""
+        columna_activo, columnas = self.CONTADORES[archivo]
+        cantidad = self._columnas.get(archivo, 0)
+        if columna_activo > cantidad:
+            return {}
+        grupos = []
+        for columna in columnas:
+            columna, caracteres = columna if isinstance(columna, tuple) else (columna, None)
+            if not 1 <= columna <= cantidad:
+                grupos.append("''")
+            elif caracteres is None:
+                grupos.append(f"coalesce(c{columna}, '')")
+            else:
+                grupos.append(f"substr(coalesce(c{columna}, ''), 1, {int(caracteres)})")
+        seleccion = ", ".join(grupos + ["COUNT(*)"])
+        consulta = f'SELECT {seleccion} FROM "{archivo}" WHERE minusculas(c{columna_activo}) = \'true\''
+        parametros: tuple = ()
+        if grupo is not None and grupos:
+            # Condición sobre la columna tal cual para que pueda usar su índice
+            consulta += f" AND c{columnas[0]} = ?"
+            parametros = (grupo,)
+        if grupos:
+            consulta += f" GROUP BY {', '.join(grupos)}"
+        return {tuple(fila[:-1]): fila[-1] for fila in self.conexion.execute(consulta, parametros) if fila[-1]}
+
+    def migraciones(self) -> List[Tuple[str, str]]:
+        """Importaciones ya hechas en esta base: (fecha, archivos)"""
+        existe = self.conexion.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = ?", (self.TABLA_MIGRACIONES,)).fetchone()
+        if not existe:
+            return []
+        return self.conexion.execute(f'SELECT fecha, archivos FROM "{self.TABLA_MIGRACIONES}" ORDER BY fecha').fetchall()
+
+    def importar_desde(self, origen: AlmacenamientoBase, archivos: Iterable[str],
+                       forzar: bool = False) -> Dict[str, int]:
+        """Copia (una sola vez) los registros de otro motor conservando sus IDs
+
+        Los registros importados reemplazan a los de igual ID, así que sin forzar no se
+        importa nada si la base ya tiene registros en esas tablas o una importación anterior
+        (ValueError): una segunda importación pisaría datos nuevos con los del origen."""
+        archivos = list(archivos)
+        if not forzar:
+            if self.migraciones():
+                raise ValueError(f"La base {self.ruta_db} ya recibió una importación")
+            con_datos = [archivo for archivo in archivos if archivo in self._columnas and self.conexion.execute(
+                f'SELECT 1 FROM "{self._validar_nombre(archivo)}" LIMIT 1').fetchone()]
+            if con_datos:
+                raise ValueError(f"La base {self.ruta_db} ya tiene registros en {', '.join(con_datos)}")
+
+        totales = {}
+        for archivo in archivos:
+            totales[archivo] = 0
+            registros = (origen.resolver_registro(archivo, registro) for registro in origen.iter_registros(archivo))
+            # Una transacción por archivo, con una sentencia por lote de filas
+            with self.conexion:
+                while True:
+                    lote = list(itertools.islice(registros, self.TAMANO_LOTE_IMPORTACION))
+                    if not lote:
+                        break
+                    totales[archivo] += len(lote)
+                    self._asegurar_tabla(archivo, max(len(registro) for registro in lote) - 1)
+                    cantidad = self._columnas[archivo]
+                    self.conexion.executemany(
+                        f'INSERT OR REPLACE INTO "{archivo}" (id, {self._columnas_sql(cantidad)}) '
+                        f'VALUES ({", ".join("?" * (cantidad + 1))})',
+                        (registro + [None] * (cantidad + 1 - len(registro)) for registro in lote))
+                    self._indexar_texto(archivo, lote)
+        with self.conexion:
+            self.conexion.execute(f'CREATE TABLE IF NOT EXISTS "{self.TABLA_MIGRACIONES}" (fecha TEXT, archivos TEXT)')
+            self.conexion.execute(f'INSERT INTO "{self.TABLA_MIGRACIONES}" (fecha, archivos) VALUES (?, ?)',
+                                  (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), ",".join(archivos)))
+        return totales
+
+    def cerrar(self):
+        """Cierra la conexión con la base de datos"""
+        self.conexion.close()
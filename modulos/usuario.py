@@ -12,6 +12,10 @@ from typing import List, Optional
 class Usuario:
     """Clase que representa un usuario del sistema"""
     
+    # Sin __dict__ por instancia: los listados crean miles de usuarios
+    __slots__ = ('id_usuario', 'nombre', 'apellido', 'email', 'tipo_usuario', 'password',
+                 'id_centro', 'activo', 'fecha_registro')
+    
     def __init__(self, id_usuario: int = 0, nombre: str = "", 
                  apellido: str = "", email: str = "", 
                  tipo_usuario: str = "", password: str = "",
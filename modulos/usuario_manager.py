@@ -6,6 +6,7 @@ Centraliza todas las operaciones CRUD de usuarios
 """
 
 from modulos.usuario import Usuario
+from modulos.menu_manager import paginar
 
 
 def registrar_usuario(usuario_dao, centro_dao):
@@ -14,6 +15,9 @@ def registrar_usuario(usuario_dao, centro_dao):
     nombre = input("Nombre: ")
     apellido = input("Apellido: ")
     email = input("Email: ")
+    if usuario_dao.existe_email(email):
+        print("Ya existe un usuario registrado con ese email.")
+        return
     password = input("Contraseña: ")
     
     print("Tipo de usuario:")
@@ -60,19 +64,21 @@ def registrar_usuario(usuario_dao, centro_dao):
 def listar_usuarios(usuario_dao, usuario_logueado=None):
     """Lista usuarios (todos o del centro del administrador)"""
     if usuario_logueado and usuario_logueado.es_administrador():
-        usuarios = usuario_dao.obtener_usuarios_por_centro(usuario_logueado.id_centro)
-        titulo = f"USUARIOS DEL CENTRO {usuario_logueado.id_centro}"
+        id_centro = usuario_logueado.id_centro
+        titulo = f"USUARIOS DEL CENTRO {id_centro}"
     else:
-        usuarios = usuario_dao.obtener_todos_usuarios()
+        id_centro = None
         titulo = "LISTA DE USUARIOS"
     
-    if not usuarios:
+    hay_usuarios = paginar(
+        lambda despues_de, limite: usuario_dao.obtener_pagina_usuarios(despues_de, limite, id_centro),
+        lambda usuario: print(f"ID: {usuario.id_usuario} | {usuario.nombre} {usuario.apellido} | {usuario.email} | {usuario.tipo_usuario}"),
+        lambda usuario: usuario.id_usuario,
+        titulo)
+    
+    if not hay_usuarios:
         print("No hay usuarios registrados.")
         return
-    
-    print(f"\n--- {titulo} ---")
-    for usuario in usuarios:
-        print(f"ID: {usuario.id_usuario} | {usuario.nombre} {usuario.apellido} | {usuario.email} | {usuario.tipo_usuario}")
     print()
     print("-" * 64)
 
@@ -126,7 +132,13 @@ def editar_usuario(usuario_dao, usuario_logueado=None):
         if nuevo_email:
             usuario.email = nuevo_email
         
-        if usuario_dao.actualizar_usuario(usuario):
+        try:
+            actualizado = usuario_dao.actualizar_usuario(usuario)
+        except ValueError as e:
+            # Email repetido: no es un error del ID ingresado
+            print(f"Error al actualizar usuario: {e}")
+            return
+        if actualizado:
             print("Usuario actualizado exitosamente.")
         else:
             print("Error al actualizar usuario.")
@@ -6,17 +6,151 @@ Gestor simple de archivos DAT
 """
 
 import os
+import bisect
+import functools
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+from contextlib import contextmanager, ExitStack
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Tuple
 
+from modulos.almacenamiento import AlmacenamientoBase
+from modulos.indices import (ContadorRegistros, Firma, IndiceOffsets, IndiceRango, IndiceSecundario,
+                             IndiceTexto, SecuenciaIds)
+from modulos.lector_mmap import LectorMapeado
+from modulos.cache import CacheRegistros, estimar_tamano
+from modulos.bloqueos import BloqueoArchivo
+from modulos.escritor import EscritorAgrupado
+from modulos.particiones import TablaParticionada
+from modulos.blobs import SegmentoBlobs, desescapar, es_referencia, escapar
+from modulos.wal import DiarioEscrituras
 
-class FileManager:
+
+def _lectura(metodo):
+    """Ejecuta el método con el bloqueo compartido del archivo (primer argumento)"""
+    @functools.wraps(metodo)
+    def envoltura(self, archivo, *args, **kwargs):
+        tabla = self._particiones.get(archivo)
+        if tabla is not None:
+            # Las tablas particionadas reparten la consulta entre sus archivos
+            return getattr(tabla, metodo.__name__)(*args, **kwargs)
+        with self._bloqueo_lectura(archivo):
+            return metodo(self, archivo, *args, **kwargs)
+    return envoltura
+
+
+def _escritura(metodo):
+    """Ejecuta el método con el bloqueo exclusivo del archivo (primer argumento)"""
+    @functools.wraps(metodo)
+    def envoltura(self, archivo, *args, **kwargs):
+        escritor = self._escritor
+        if escritor is not None and not escritor.es_hilo_escritor():
+            # En escritura agrupada todo pasa por el hilo escritor
+            return escritor.enviar(metodo.__name__, archivo, *args, **kwargs).result()
+        tabla = self._particiones.get(archivo)
+        if tabla is not None:
+            resultado = getattr(tabla, metodo.__name__)(*args, **kwargs)
+        else:
+            with self._obtener_bloqueo(archivo).exclusivo():
+                resultado = metodo(self, archivo, *args, **kwargs)
+        if escritor is None and self.durabilidad == "lote":
+            # Sin escritor agrupado cada llamada es un lote: se confirma al terminar
+            self._sincronizar_diarios()
+        return resultado
+    return envoltura
+
+
+class FileManager(AlmacenamientoBase):
     """Gestor simple de archivos DAT"""
     
-    def __init__(self, data_dir: str = "data"):
+    # Marca que ocupa el lugar de los datos en una línea de borrado (lápida)
+    MARCA_BORRADO = "__borrado__"
+    # Registros que iter_registros_desde lee de una vez
+    TAMANO_BLOQUE_CURSOR = 64
+    # Tablas repartidas en un archivo por valor de una columna: tabla -> (columna, prefijo).
+    # Los expedientes quedan en expedientes/centro_<id>.dat
+    PARTICIONES: Dict[str, Tuple[int, str]] = {
+        'expedientes': (3, 'centro')
+    }
+    # Columnas de texto largo que se guardan aparte, en el segmento de blobs del archivo
+    BLOBS: Dict[str, Tuple[int, ...]] = {
+        'expedientes': (11, 12, 14)  # historia clínica, consentimientos, reporte de exámenes
+    }
+    # Desde este largo (en caracteres) el texto de una columna de BLOBS sale de la fila
+    TAMANO_MINIMO_BLOB = 256
+    # Cuándo se hace fsync del diario: en cada operación, al terminar cada lote (una llamada
+    # o un lote del escritor agrupado) o cada intervalo_sincronizacion segundos
+    DURABILIDADES = ("operacion", "lote", "intervalo")
+    # Al pasar este tamaño el diario se vacía (tras llevar a disco el archivo de datos)
+    TAMANO_MAXIMO_DIARIO = 4 * 1024 * 1024
+    # Directorio (dentro de data_dir) donde la compactación deja los registros inactivos
+    DIRECTORIO_HISTORICO = "historico"
+    
+    def __init__(self, data_dir: str = "data", modo_log: bool = False, usar_mmap: bool = False,
+                 limite_cache_mb: float = 32, espera_bloqueo: float = 10.0,
+                 escritura_agrupada: bool = False, particionar: bool = True,
+                 comprimir_blobs: bool = True, usar_diario: bool = True,
+                 durabilidad: str = "intervalo", intervalo_sincronizacion: float = 1.0,
+                 compactacion_en_reposo: float = 0.0):
+        super().__init__()
         self.data_dir = data_dir
         self.separador = "|"
+        # En modo log las actualizaciones añaden una nueva versión al final del archivo
+        # en lugar de reescribirlo; al leer gana la última versión de cada ID
+        self.modo_log = modo_log
+        # Con usar_mmap las lecturas y búsquedas trabajan sobre el archivo mapeado en memoria
+        self.usar_mmap = usar_mmap
+        self._lectores: Dict[str, LectorMapeado] = {}
+        # Caché de tablas y registros ya leídos (0 la desactiva)
+        self._cache = CacheRegistros(int(limite_cache_mb * 1024 * 1024)) if limite_cache_mb > 0 else None
+        # Bloqueos entre procesos: lectores en paralelo, escritores de a uno (espera acotada)
+        self.espera_bloqueo = espera_bloqueo
+        self._bloqueos: Dict[str, BloqueoArchivo] = {}
+        self._indices: Dict[str, IndiceOffsets] = {}
+        self._secuencias: Dict[str, SecuenciaIds] = {}
+        self._indices_secundarios: Dict[str, Dict[int, IndiceSecundario]] = {}
+        self._indices_rango: Dict[str, Dict[int, IndiceRango]] = {}
+        self._indices_texto: Dict[str, IndiceTexto] = {}
+        self._contadores: Dict[str, ContadorRegistros] = {}
+        self.comprimir_blobs = comprimir_blobs
+        self._segmentos: Dict[str, SegmentoBlobs] = {}
+        # Protege la creación perezosa de estructuras compartidas entre hilos
+        self._mutex = threading.RLock()
         self._crear_directorio()
+        # Cada cambio se anota en el diario (.wal) del archivo antes de aplicarlo; al abrir
+        # se vuelven a aplicar los que un corte dejó a medias
+        if durabilidad not in self.DURABILIDADES:
+            raise ValueError(f"Durabilidad desconocida: {durabilidad}")
+        self.usar_diario = usar_diario
+        self.durabilidad = durabilidad
+        self.intervalo_sincronizacion = intervalo_sincronizacion
+        self._diarios: Dict[str, DiarioEscrituras] = {}
+        self._particiones: Dict[str, TablaParticionada] = {}
+        self.recuperados = self.recuperar_diarios() if usar_diario else {}
+        if particionar:
+            particiones = {tabla: TablaParticionada(self, tabla, columna, prefijo)
+                           for tabla, (columna, prefijo) in self.PARTICIONES.items()}
+            # Un archivo de antes de particionar se reparte al abrir (antes de desviar las llamadas)
+            for tabla in particiones.values():
+                tabla.migrar()
+            self._particiones = particiones
+        # Con escritura agrupada las escrituras de cualquier hilo se encolan y un único
+        # hilo escritor las aplica en lotes, con un fsync por lote
+        self._escritor = EscritorAgrupado(self) if escritura_agrupada else None
+        self._detener = threading.Event()
+        if usar_diario and durabilidad == "intervalo":
+            threading.Thread(target=self._sincronizar_periodicamente,
+                             name="miclinica-diario", daemon=True).start()
+        # En modo log y con compactacion_en_reposo > 0 un hilo compacta los archivos tras esos
+        # segundos sin escrituras de este proceso (la primera vez, aunque no haya escrito nada)
+        self.compactacion_en_reposo = compactacion_en_reposo
+        self._ultima_escritura = time.monotonic()
+        self._escrito_desde_compactacion = True
+        if modo_log and compactacion_en_reposo > 0:
+            threading.Thread(target=self._compactar_en_reposo,
+                             name="miclinica-compactacion", daemon=True).start()
     
     def _crear_directorio(self):
         """Crea el directorio de datos si no existe"""
@@ -27,109 +161,1207 @@ class FileManager:
         """Obtiene la ruta completa del archivo"""
         return os.path.join(self.data_dir, f"{nombre_archivo}.dat")
     
-    def _obtener_siguiente_id(self, archivo: str) -> int:
-        """Obtiene el siguiente ID disponible"""
+    def _obtener_ruta_indice(self, nombre_archivo: str) -> str:
+        """Obtiene la ruta del índice de offsets del archivo"""
+        return os.path.join(self.data_dir, f"{nombre_archivo}.idx")
+    
+    def _obtener_ruta_secuencia(self, nombre_archivo: str) -> str:
+        """Obtiene la ruta del archivo con la secuencia de IDs"""
+        return os.path.join(self.data_dir, f"{nombre_archivo}.seq")
+    
+    def _obtener_ruta_indice_texto(self, nombre_archivo: str) -> str:
+        """Obtiene la ruta del índice de texto completo del archivo"""
+        return os.path.join(self.data_dir, f"{nombre_archivo}.txt.idx")
+    
+    def _obtener_ruta_contador(self, nombre_archivo: str) -> str:
+        """Obtiene la ruta de los contadores para estadísticas del archivo"""
+        return os.path.join(self.data_dir, f"{nombre_archivo}.stats")
+    
+    def _obtener_ruta_diario(self, nombre_archivo: str) -> str:
+        """Obtiene la ruta del diario de escrituras (write-ahead log) del archivo"""
+        return os.path.join(self.data_dir, f"{nombre_archivo}.wal")
+    
+    def _obtener_ruta_blobs(self, nombre_archivo: str) -> str:
+        """Obtiene la ruta del segmento con los textos largos del archivo"""
+        return os.path.join(self.data_dir, f"{nombre_archivo}.blob")
+    
+    @staticmethod
+    def _tabla_de(archivo: str) -> str:
+        """Tabla a la que pertenece el archivo (una partición tabla/prefijo_valor, a su tabla)"""
+        return archivo.split("/", 1)[0]
+    
+    def _obtener_bloqueo(self, archivo: str) -> BloqueoArchivo:
+        """Devuelve el bloqueo entre procesos del archivo"""
+        bloqueo = self._bloqueos.get(archivo)
+        if bloqueo is None:
+            with self._mutex:
+                bloqueo = self._bloqueos.get(archivo)
+                if bloqueo is None:
+                    ruta = os.path.join(self.data_dir, f"{archivo}.lock")
+                    bloqueo = BloqueoArchivo(ruta, self.espera_bloqueo)
+                    self._bloqueos[archivo] = bloqueo
+        return bloqueo
+    
+    @contextmanager
+    def bloquear_escritura(self, archivos: Iterable[str]):
+        """Toma el bloqueo exclusivo de varios archivos (en orden, para evitar esperas cruzadas)"""
+        with ExitStack() as pila:
+            for archivo in sorted(set(archivos)):
+                pila.enter_context(self._obtener_bloqueo(archivo).exclusivo())
+            yield
+    
+    def archivos_de_escritura(self, operacion: str, archivo: str, *args) -> List[str]:
+        """Archivos que bloquea una escritura: el propio o, en una tabla particionada, las
+        particiones que toca (la tabla sólo tiene el bloqueo de la secuencia de IDs)"""
+        tabla = self._particiones.get(archivo)
+        if tabla is None:
+            return [archivo]
         try:
-            with open(self._obtener_ruta_archivo(archivo), 'r', encoding='utf-8') as f:
-                lineas = f.readlines()
-                if not lineas:
-                    return 1
-                # El ID está en la primera columna
-                ultimo_id = max(int(linea.split(self.separador)[0]) for linea in lineas if linea.strip())
-                return ultimo_id + 1
+            return tabla.particiones_de_escritura(operacion, *args)
+        except (IndexError, ValueError):
+            return []  # datos no válidos: la escritura fallará al ejecutarse
+    
+    def sincronizar(self, archivo: str):
+        """Fuerza a disco lo escrito en el archivo (fsync)
+
+        Con diario basta con sincronizar el diario: el archivo de datos se lleva a disco
+        en el siguiente punto de control."""
+        if archivo in self._particiones:
+            self._particiones[archivo].sincronizar()
+            return
+        if self.usar_diario:
+            self._obtener_diario(archivo).sincronizar()
+            return
+        if self._columnas_blob(archivo):
+            # Primero los textos: una fila en disco nunca apunta a un blob que falte
+            self._obtener_segmento(archivo).sincronizar()
+        self._fsync(self._obtener_ruta_archivo(archivo))
+    
+    @staticmethod
+    def _fsync(ruta: str):
+        """Fuerza a disco un archivo (o un directorio) si existe"""
+        if os.path.isdir(ruta) and os.name == 'nt':
+            return  # Windows no permite abrir directorios
+        try:
+            descriptor = os.open(ruta, os.O_RDONLY)
+        except FileNotFoundError:
+            return
+        try:
+            os.fsync(descriptor)
+        finally:
+            os.close(descriptor)
+    
+    def _obtener_diario(self, archivo: str) -> DiarioEscrituras:
+        """Devuelve el diario de escrituras del archivo"""
+        diario = self._diarios.get(archivo)
+        if diario is None:
+            with self._mutex:
+                diario = self._diarios.get(archivo)
+                if diario is None:
+                    diario = DiarioEscrituras(self._obtener_ruta_diario(archivo))
+                    self._diarios[archivo] = diario
+        return diario
+    
+    def _anotar(self, archivo: str, cambios: List[Tuple[int, Optional[List[str]]]]):
+        """Anota los cambios en el diario antes de aplicarlos al archivo"""
+        if not self.usar_diario:
+            return
+        diario = self._obtener_diario(archivo)
+        diario.anotar(cambios)
+        if self.durabilidad == "operacion":
+            diario.sincronizar()
+    
+    def _sincronizar_diarios(self):
+        """Hace fsync de los diarios con entradas pendientes"""
+        for diario in list(self._diarios.values()):
+            diario.sincronizar()
+    
+    def _sincronizar_periodicamente(self):
+        """Hilo de la durabilidad por intervalo"""
+        while not self._detener.wait(self.intervalo_sincronizacion):
+            self._sincronizar_diarios()
+    
+    def _punto_de_control(self, archivo: str):
+        """Lleva a disco el archivo de datos (y sus blobs), vacía su diario y guarda sus
+        contadores (con el bloqueo exclusivo)"""
+        if self._columnas_blob(archivo):
+            self._obtener_segmento(archivo).sincronizar()
+        self._fsync(self._obtener_ruta_archivo(archivo))
+        self._obtener_diario(archivo).vaciar()
+        self._guardar_contador(archivo)
+    
+    def _guardar_contador(self, archivo: str):
+        """Guarda en disco los contadores del archivo si cambiaron (con el bloqueo exclusivo)"""
+        contador = self._contadores.get(archivo)
+        if contador is not None:
+            contador.persistir()
+    
+    def _controlar_diario(self, archivo: str):
+        """Hace un punto de control si el diario del archivo creció demasiado"""
+        if self.usar_diario and self._obtener_diario(archivo).tamano() > self.TAMANO_MAXIMO_DIARIO:
+            self._punto_de_control(archivo)
+    
+    def recuperar_diarios(self) -> Dict[str, int]:
+        """Vuelve a aplicar los cambios de los diarios que no llegaron a los archivos de datos
+
+        Devuelve, por archivo, cuántos registros se recuperaron."""
+        recuperados = {}
+        for archivo in self._archivos_con_extension(".wal"):
+            with self._obtener_bloqueo(archivo).exclusivo():
+                self._borrar_temporales(archivo)
+                aplicados = self._recuperar(archivo)
+            if aplicados:
+                recuperados[archivo] = aplicados
+        return recuperados
+    
+    def _borrar_temporales(self, archivo: str):
+        """Borra los .tmp que dejó una reescritura cortada del archivo (con su bloqueo exclusivo)
+
+        El archivo de datos sólo se reescribe con el bloqueo exclusivo, así que sus temporales
+        son todos de reescrituras cortadas. Los índices, contadores y la secuencia también se
+        guardan con el bloqueo compartido: sus temporales se borran si el proceso ya no existe."""
+        ruta_datos = self._obtener_ruta_archivo(archivo)
+        propias = [ruta_datos, self._obtener_ruta_indice(archivo), self._obtener_ruta_indice_texto(archivo),
+                   self._obtener_ruta_contador(archivo), self._obtener_ruta_secuencia(archivo)]
+        directorio = os.path.dirname(ruta_datos)
+        try:
+            nombres = [nombre for nombre in os.listdir(directorio) if nombre.endswith(".tmp")]
+        except FileNotFoundError:
+            return
+        for nombre in nombres:
+            for ruta in propias:
+                inicio = os.path.basename(ruta) + "."
+                pid = nombre[len(inicio):-len(".tmp")]
+                if not (nombre.startswith(inicio) and pid.isdigit()):
+                    continue
+                if ruta == ruta_datos or not self._proceso_activo(int(pid)):
+                    try:
+                        os.remove(os.path.join(directorio, nombre))
+                    except FileNotFoundError:
+                        pass
+                break
+    
+    @staticmethod
+    def _proceso_activo(pid: int) -> bool:
+        """Indica si existe un proceso con ese PID (en Windows se supone que sí)"""
+        if pid == os.getpid() or os.name == 'nt':
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True  # existe, aunque sea de otro usuario
+        return True
+    
+    def _archivos_con_extension(self, extension: str, con_historico: bool = True) -> List[str]:
+        """Nombres (para el FileManager) de los archivos de data_dir con esa extensión"""
+        archivos = []
+        for raiz, directorios, nombres in os.walk(self.data_dir):
+            if not con_historico and raiz == self.data_dir and self.DIRECTORIO_HISTORICO in directorios:
+                directorios.remove(self.DIRECTORIO_HISTORICO)
+            for nombre in sorted(nombres):
+                if nombre.endswith(extension):
+                    ruta = os.path.join(raiz, nombre[:-len(extension)])
+                    archivos.append(os.path.relpath(ruta, self.data_dir).replace(os.sep, "/"))
+        return archivos
+    
+    def _recuperar(self, archivo: str) -> int:
+        """Aplica la última versión anotada de cada registro que no coincide con el archivo"""
+        ultimos: Dict[int, Optional[List[str]]] = {}
+        for cambios in self._obtener_diario(archivo).entradas():
+            ultimos.update(cambios)
+        
+        pendientes = []
+        anteriores = {}
+        if ultimos:
+            self._descartar_linea_cortada(archivo)
+            for id_registro, datos in ultimos.items():
+                actual = self.obtener_registro_por_id(archivo, id_registro)
+                try:
+                    vigente = self.resolver_registro(archivo, actual)[1:] if actual is not None else None
+                except (OSError, ValueError, zlib.error):
+                    vigente = False  # el texto guardado aparte se perdió: se vuelve a escribir
+                if vigente != datos:
+                    pendientes.append((id_registro, datos if datos is not None else [self.MARCA_BORRADO]))
+                    if actual is not None:
+                        anteriores[id_registro] = actual
+            # Anexar una versión nueva es válido en cualquier modo: al leer gana la última
+            if pendientes:
+                self._anexar_lineas(archivo, pendientes, anteriores, anotar=False)
+        self._punto_de_control(archivo)
+        return len(pendientes)
+    
+    def _descartar_linea_cortada(self, archivo: str):
+        """Quita del final del archivo una línea que quedó escrita a medias"""
+        try:
+            f = open(self._obtener_ruta_archivo(archivo), 'rb+')
+        except FileNotFoundError:
+            return
+        with f:
+            fin = f.seek(0, os.SEEK_END)
+            posicion = fin
+            while posicion > 0:
+                inicio = max(0, posicion - 65536)
+                f.seek(inicio)
+                bloque = f.read(posicion - inicio)
+                salto = bloque.rfind(b"\n")
+                if salto != -1:
+                    posicion = inicio + salto + 1
+                    break
+                posicion = inicio
+            if posicion != fin:
+                f.truncate(posicion)
+    
+    def enviar_escritura(self, operacion: str, archivo: str, *args) -> Future:
+        """Encola una escritura y devuelve un Future con su resultado (ID, bool o lista de IDs)
+
+        Sin escritura agrupada la operación se ejecuta en el momento."""
+        if self._escritor is not None:
+            return self._escritor.enviar(operacion, archivo, *args)
+        if operacion not in EscritorAgrupado.OPERACIONES:
+            raise ValueError(f"Operación de escritura desconocida: {operacion}")
+        futuro: Future = Future()
+        try:
+            futuro.set_result(getattr(self, operacion)(archivo, *args))
+        except Exception as e:
+            futuro.set_exception(e)
+        return futuro
+    
+    def obtener_metricas_escritura(self) -> Dict[str, int]:
+        """Devuelve las métricas del escritor agrupado (vacías si no está activo)"""
+        return dict(self._escritor.metricas) if self._escritor is not None else {}
+    
+    @contextmanager
+    def _bloqueo_lectura(self, archivo: str):
+        """Bloqueo compartido; si el índice debe ponerse al día se lee con el exclusivo"""
+        bloqueo = self._obtener_bloqueo(archivo)
+        if bloqueo.esta_tomado():
+            with bloqueo.compartido():
+                yield
+            return
+        
+        with bloqueo.compartido():
+            al_dia = self._indice_en_memoria(archivo).firma == self._obtener_firma(archivo)
+            if al_dia:
+                yield
+        if not al_dia:
+            # Reconstruir o completar el índice escribe en disco: sólo un proceso a la vez
+            with bloqueo.exclusivo():
+                self._obtener_indice(archivo)
+                yield
+    
+    def obtener_metricas_bloqueo(self) -> Dict[str, Dict[str, float]]:
+        """Devuelve las métricas de contención de bloqueos de cada archivo"""
+        return {archivo: dict(bloqueo.metricas) for archivo, bloqueo in self._bloqueos.items()}
+    
+    def _obtener_firma(self, archivo: str) -> Firma:
+        """Devuelve (tamaño, fecha de modificación, inodo) del archivo, o (0, 0, 0) si no existe
+
+        Cada reescritura reemplaza el archivo con os.replace: el inodo nuevo delata el cambio
+        aunque el tamaño coincida y la fecha caiga en el mismo tic del sistema de archivos."""
+        try:
+            estado = os.stat(self._obtener_ruta_archivo(archivo))
+            return (estado.st_size, estado.st_mtime_ns, estado.st_ino)
         except FileNotFoundError:
-            return 1
+            return (0, 0, 0)
+    
+    def _obtener_lector(self, archivo: str) -> Optional[LectorMapeado]:
+        """Devuelve el lector mapeado del archivo, o None si no se usa mmap o está vacío"""
+        if not self.usar_mmap:
+            return None
+        with self._mutex:
+            lector = self._lectores.get(archivo)
+            if lector is None:
+                lector = LectorMapeado(self._obtener_ruta_archivo(archivo))
+                self._lectores[archivo] = lector
+            return lector if lector.abrir(self._obtener_firma(archivo)) else None
+    
+    def compactar(self, archivo: Optional[str] = None,
+                  archivar_inactivos: bool = False) -> Dict[str, Dict[str, int]]:
+        """Reescribe los archivos dejando sólo la versión vigente de cada registro
+
+        Se descartan las versiones reemplazadas y las marcas de borrado del modo log;
+        los IDs no cambian. Con archivar_inactivos los registros dados de baja pasan a
+        historico/<archivo>. Sin archivo se compactan todos. Devuelve, por archivo
+        compactado, las líneas y bytes de antes y de después."""
+        if archivo in self._particiones:
+            archivos = self._particiones[archivo].particiones()
+        elif archivo is not None:
+            archivos = [archivo]
+        else:
+            archivos = self._archivos_con_extension(".dat", con_historico=False)
+        
+        resultado = {}
+        for nombre in archivos:
+            with self._obtener_bloqueo(nombre).exclusivo():
+                resumen = self._compactar_archivo(nombre, archivar_inactivos)
+            if resumen is not None:
+                resultado[nombre] = resumen
+        return resultado
+    
+    def _compactar_archivo(self, archivo: str, archivar_inactivos: bool) -> Optional[Dict[str, int]]:
+        """Compacta un archivo (con su bloqueo exclusivo); None si no había nada que descartar"""
+        if not archivar_inactivos and self._contar_lineas(archivo) == len(self._obtener_indice(archivo).offsets):
+            # Una línea por ID vigente: no hay versiones reemplazadas ni marcas de borrado
+            return None
+        bytes_antes = self._obtener_firma(archivo)[0]
+        lineas = 0
+        versiones: Dict[str, List[str]] = {}
+        for _, linea in self._recorrer_lineas(archivo):
+            lineas += 1
+            registro = linea.decode('utf-8').strip().split(self.separador)
+            versiones[registro[0]] = registro
+        vigentes = [registro for registro in versiones.values() if not self._es_lapida(registro)]
+        
+        inactivos = []
+        especificacion = self._especificacion_contador(archivo)
+        if archivar_inactivos and especificacion is not None:
+            columna_activo = especificacion[0]
+            inactivos = [registro for registro in vigentes
+                         if len(registro) > columna_activo and registro[columna_activo].lower() != 'true']
+        if lineas == len(vigentes) and not inactivos:
+            return None
+        
+        if inactivos:
+            # Se archivan antes de quitarlos: un corte a mitad deja, como mucho, un duplicado
+            # en el histórico (al leerlo gana la última versión)
+            historico = f"{self.DIRECTORIO_HISTORICO}/{archivo}"
+            os.makedirs(os.path.dirname(self._obtener_ruta_archivo(historico)), exist_ok=True)
+            filas = [(int(registro[0]), self.resolver_registro(archivo, registro)[1:]) for registro in inactivos]
+            with self._obtener_bloqueo(historico).exclusivo():
+                self._anexar_lineas(historico, filas)
+            archivados = {registro[0] for registro in inactivos}
+            vigentes = [registro for registro in vigentes if registro[0] not in archivados]
+        
+        self._reescribir_archivo(archivo, vigentes, [(int(registro[0]), None) for registro in inactivos],
+                                 {int(registro[0]): registro for registro in inactivos})
+        return {
+            'lineas_antes': lineas,
+            'lineas_despues': len(vigentes),
+            'archivados': len(inactivos),
+            'bytes_antes': bytes_antes,
+            'bytes_despues': self._obtener_firma(archivo)[0]
+        }
+    
+    def _contar_lineas(self, archivo: str) -> int:
+        """Cuenta las líneas del archivo por sus saltos, sin decodificarlas"""
+        try:
+            f = open(self._obtener_ruta_archivo(archivo), 'rb')
+        except FileNotFoundError:
+            return 0
+        with f:
+            return sum(bloque.count(b"\n") for bloque in iter(lambda: f.read(1024 * 1024), b""))
+    
+    def _compactar_en_reposo(self):
+        """Hilo de la compactación automática: compacta cuando no hubo escrituras durante un rato"""
+        while not self._detener.wait(min(self.compactacion_en_reposo, 60.0)):
+            en_reposo = time.monotonic() - self._ultima_escritura >= self.compactacion_en_reposo
+            if en_reposo and self._escrito_desde_compactacion:
+                self._escrito_desde_compactacion = False
+                try:
+                    self.compactar()
+                except (OSError, TimeoutError):
+                    # Otro proceso tenía un archivo ocupado: se intentará en el próximo reposo
+                    self._escrito_desde_compactacion = True
+    
+    def cerrar(self):
+        """Aplica las escrituras pendientes, vacía los diarios, guarda los contadores y libera los
+        archivos mapeados y de bloqueo"""
+        if self._escritor is not None:
+            self._escritor.cerrar()
+        self._detener.set()
+        for archivo in list(self._diarios):
+            with self._obtener_bloqueo(archivo).exclusivo():
+                self._punto_de_control(archivo)
+        for archivo, contador in list(self._contadores.items()):
+            if contador.pendiente:
+                with self._obtener_bloqueo(archivo).exclusivo():
+                    self._guardar_contador(archivo)
+        for lector in self._lectores.values():
+            lector.cerrar()
+        for bloqueo in self._bloqueos.values():
+            bloqueo.cerrar()
+    
+    def _recorrer_lineas(self, archivo: str, desde: int = 0) -> Iterator[Tuple[int, bytes]]:
+        """Recorre las líneas no vacías del archivo devolviendo (offset, línea en bytes)
+
+        El archivo se abre en el momento de la llamada, de modo que el recorrido sigue
+        leyendo la misma versión aunque luego se reemplace el archivo."""
+        if self.usar_mmap:
+            lector = self._obtener_lector(archivo)
+            if lector is None:
+                return iter(())
+            return self._lineas_mapeadas(lector.mapa, lector.lineas(desde))
+        
+        try:
+            f = open(self._obtener_ruta_archivo(archivo), 'rb')
+        except FileNotFoundError:
+            return iter(())
+        return self._lineas_de_archivo(f, desde)
+    
+    @staticmethod
+    def _lineas_mapeadas(mapa, posiciones: Iterator[Tuple[int, int]]) -> Iterator[Tuple[int, bytes]]:
+        """Recorre las líneas de un archivo mapeado en memoria"""
+        for inicio, fin in posiciones:
+            yield inicio, mapa[inicio:fin + 1]
+    
+    @staticmethod
+    def _lineas_de_archivo(f, desde: int) -> Iterator[Tuple[int, bytes]]:
+        """Recorre las líneas de un archivo ya abierto en modo binario"""
+        with f:
+            f.seek(desde)
+            offset = desde
+            for linea in f:
+                if linea.strip():
+                    yield offset, linea
+                offset += len(linea)
+    
+    def _leer_linea(self, archivo: str, offset: int) -> Optional[List[str]]:
+        """Lee y separa la línea que empieza en la posición indicada"""
+        lector = self._obtener_lector(archivo)
+        if lector is not None:
+            try:
+                linea = lector.linea(offset).decode('utf-8').strip()
+            except UnicodeDecodeError:
+                return None
+            return linea.split(self.separador) if linea else None
+        
+        try:
+            with open(self._obtener_ruta_archivo(archivo), 'rb') as f:
+                f.seek(offset)
+                linea = f.readline().decode('utf-8').strip()
+        except (FileNotFoundError, UnicodeDecodeError):
+            return None
+        return linea.split(self.separador) if linea else None
+    
+    def _id_de_linea(self, linea: bytes) -> Optional[int]:
+        """Extrae el ID (primera columna) de una línea en bytes"""
+        try:
+            return int(linea.split(self.separador.encode('utf-8'), 1)[0])
+        except ValueError:
+            return None
+    
+    def _indice_en_memoria(self, archivo: str) -> IndiceOffsets:
+        """Devuelve el índice de offsets cargado en memoria, sin validarlo"""
+        indice = self._indices.get(archivo)
+        if indice is None:
+            with self._mutex:
+                indice = self._indices.get(archivo)
+                if indice is None:
+                    indice = IndiceOffsets(self._obtener_ruta_indice(archivo))
+                    indice.cargar()
+                    self._indices[archivo] = indice
+        return indice
+    
+    def _obtener_indice(self, archivo: str) -> IndiceOffsets:
+        """Devuelve el índice de offsets del archivo, validado contra su tamaño y fecha"""
+        indice = self._indice_en_memoria(archivo)
+        firma = self._obtener_firma(archivo)
+        if indice.firma != firma:
+            if 0 < indice.firma[0] < firma[0] and self._cola_es_continua(archivo, indice):
+                # El archivo sólo creció (p. ej. otro proceso insertó): se indexa la cola
+                entradas = [(self._id_de_linea(linea), offset)
+                            for offset, linea in self._recorrer_lineas(archivo, indice.firma[0])]
+                indice.agregar([e for e in entradas if e[0] is not None], firma)
+            else:
+                self._reconstruir_indice(archivo, indice, firma)
+        return indice
+    
+    def _cola_es_continua(self, archivo: str, indice: IndiceOffsets) -> bool:
+        """Verifica que la parte ya indexada del archivo no cambió"""
+        if not indice.offsets:
+            return False
+        ultimo_id, ultimo_offset = next(reversed(indice.offsets.items()))
+        registro = self._leer_linea(archivo, ultimo_offset)
+        return registro is not None and registro[0] == str(ultimo_id)
+    
+    def _reconstruir_indice(self, archivo: str, indice: IndiceOffsets, firma: Firma):
+        """Reconstruye el índice recorriendo el archivo completo"""
+        offsets = {}
+        for offset, linea in self._recorrer_lineas(archivo):
+            id_registro = self._id_de_linea(linea)
+            if id_registro is not None:
+                offsets[id_registro] = offset
+        indice.reiniciar(offsets, firma)
+        if os.path.exists(self._obtener_ruta_archivo(archivo)):
+            indice.guardar()
     
+    def _reescribir_archivo(self, archivo: str, registros: List[List[str]],
+                            cambios: List[Tuple[int, Optional[List[str]]]],
+                            anteriores: Dict[int, List[str]]):
+        """Reescribe el archivo completo con los registros dados y actualiza los índices"""
+        firma_anterior = self._obtener_indice(archivo).firma
+        # Se escribe aparte y se reemplaza de forma atómica: los lectores (y mapeos) que ya
+        # abrieron el archivo siguen viendo la versión anterior completa. Windows no permite
+        # reemplazar un archivo mapeado, así que allí se libera el mapeo antes
+        if os.name == 'nt' and archivo in self._lectores:
+            self._lectores[archivo].cerrar()
+        ruta = self._obtener_ruta_archivo(archivo)
+        temporal = f"{ruta}.{os.getpid()}.tmp"
+        with open(temporal, 'w', encoding='utf-8') as f:
+            for registro in registros:
+                f.write(self.separador.join(registro) + "\n")
+            # El reemplazo sólo es seguro ante un corte de luz si el contenido ya está en disco
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporal, ruta)
+        self._fsync(os.path.dirname(ruta))
+        
+        firma = self._obtener_firma(archivo)
+        self._reconstruir_indice(archivo, self._indice_en_memoria(archivo), firma)
+        self._notificar_cambios(archivo, cambios, firma_anterior, firma, anteriores, reescrito=True)
+        if self.usar_diario:
+            # El archivo nuevo ya está en disco con todo lo anotado
+            self._punto_de_control(archivo)
+        else:
+            self._guardar_contador(archivo)
+        self._registrar_escritura()
+    
+    def _registrar_escritura(self):
+        """Anota el momento de la última escritura, para la compactación en reposo"""
+        self._ultima_escritura = time.monotonic()
+        self._escrito_desde_compactacion = True
+    
+    def _indices_derivados(self, archivo: str) -> list:
+        """Devuelve todos los índices secundarios, de rango y de texto declarados sobre el archivo"""
+        derivados = list(self._indices_secundarios.get(archivo, {}).values())
+        derivados.extend(self._indices_rango.get(archivo, {}).values())
+        if archivo in self._indices_texto:
+            derivados.append(self._indices_texto[archivo])
+        return derivados
+    
+    def _notificar_cambios(self, archivo: str, cambios: List[Tuple[int, Optional[List[str]]]],
+                           firma_anterior: Firma, firma: Firma,
+                           anteriores: Dict[int, List[str]], reescrito: bool = False):
+        """Aplica a los índices derivados las nuevas versiones escritas por este proceso
+
+        Con reescrito (el archivo de datos se escribió completo) el índice de texto
+        también se reescribe, en lugar de añadirle las nuevas versiones al final."""
+        derivados = self._indices_derivados(archivo)
+        if derivados and self._columnas_blob(archivo):
+            # Los índices trabajan sobre el texto, no sobre las referencias a blobs
+            cambios_texto = [(id_registro, self.resolver_registro(archivo, registro) if registro else None)
+                             for id_registro, registro in cambios]
+        else:
+            cambios_texto = cambios
+        indice_texto = self._indices_texto.get(archivo)
+        for indice in derivados:
+            # Un índice que no estaba al día se reconstruirá en la próxima consulta
+            if indice.firma != firma_anterior:
+                continue
+            if reescrito and indice is indice_texto:
+                indice.aplicar(cambios_texto, firma, reescribir=True)
+            else:
+                indice.aplicar(cambios_texto, firma)
+        
+        contador = self._obtener_contador(archivo)
+        if contador is not None and contador.firma == firma_anterior:
+            contador.aplicar(cambios, anteriores, firma)
+        
+        if self._cache is not None and self._cache.renovar_firma(archivo, firma_anterior, firma):
+            self._actualizar_cache(archivo, cambios)
+    
+    def _actualizar_cache(self, archivo: str, cambios: List[Tuple[int, Optional[List[str]]]]):
+        """Refleja en la caché las escrituras propias para no tener que releer el archivo"""
+        clave_tabla = ("tabla", archivo)
+        versiones = self._cache.ver(clave_tabla)
+        diferencia = 0
+        for id_registro, registro in cambios:
+            self._cache.descartar(("fila", archivo, id_registro))
+            if versiones is None:
+                continue
+            anterior = versiones.pop(str(id_registro), None) if registro is None else versiones.get(str(id_registro))
+            if anterior is not None:
+                diferencia -= estimar_tamano(anterior)
+            if registro is not None:
+                versiones[str(id_registro)] = registro
+                diferencia += estimar_tamano(registro)
+        if versiones is not None:
+            self._cache.ajustar(clave_tabla, diferencia)
+    
+    def _al_dia(self, archivo: str, indice):
+        """Reconstruye un índice derivado si no corresponde a la versión actual del archivo"""
+        firma = self._obtener_indice(archivo).firma
+        if indice.firma != firma:
+            # Varios lectores pueden llegar a la vez: sólo uno reconstruye
+            with self._mutex:
+                if indice.firma != firma:
+                    registros = self.obtener_registros(archivo)
+                    # Sólo se leen los blobs si el índice abarca alguna columna guardada allí
+                    columnas = getattr(indice, 'columnas', None) or [indice.columna]
+                    if set(columnas) & set(self._columnas_blob(archivo)):
+                        registros = (self.resolver_registro(archivo, registro) for registro in registros)
+                    indice.reconstruir(registros, firma)
+        return indice
+    
+    def _especificacion_contador(self, archivo: str) -> Optional[Tuple[int, Tuple[Any, ...]]]:
+        """Cada partición (tabla/prefijo_valor) lleva los contadores de su tabla"""
+        return super()._especificacion_contador(self._tabla_de(archivo))
+    
+    def _obtener_contador(self, archivo: str) -> Optional[ContadorRegistros]:
+        """Devuelve los contadores para estadísticas del archivo (None si no lleva)"""
+        especificacion = self._especificacion_contador(archivo)
+        if especificacion is None:
+            return None
+        contador = self._contadores.get(archivo)
+        if contador is None:
+            with self._mutex:
+                contador = self._contadores.get(archivo)
+                if contador is None:
+                    columna_activo, columnas = especificacion
+                    contador = ContadorRegistros(self._obtener_ruta_contador(archivo), columna_activo, columnas)
+                    contador.cargar()
+                    self._contadores[archivo] = contador
+        return contador
+    
+    def _columnas_blob(self, archivo: str) -> Tuple[int, ...]:
+        """Columnas del archivo cuyo texto largo se guarda en el segmento de blobs"""
+        return self.BLOBS.get(self._tabla_de(archivo), ())
+    
+    def _obtener_segmento(self, archivo: str) -> SegmentoBlobs:
+        """Devuelve el segmento de blobs del archivo"""
+        segmento = self._segmentos.get(archivo)
+        if segmento is None:
+            with self._mutex:
+                segmento = self._segmentos.get(archivo)
+                if segmento is None:
+                    segmento = SegmentoBlobs(self._obtener_ruta_blobs(archivo), self.comprimir_blobs)
+                    self._segmentos[archivo] = segmento
+        return segmento
+    
+    def _separar_blobs(self, archivo: str,
+                       filas: List[Tuple[int, List[str]]]) -> List[Tuple[int, List[str]]]:
+        """Pasa al segmento de blobs (en una sola escritura) los textos largos de las filas
+        y devuelve las filas con las referencias en su lugar
+
+        Los textos cortos que empiezan con @ quedan escapados en la fila, para no
+        confundirlos con una referencia."""
+        columnas = self._columnas_blob(archivo)
+        if not columnas:
+            return filas
+        textos = []
+        posiciones = []
+        escapados = []
+        for i, (_, datos) in enumerate(filas):
+            for columna in columnas:
+                # datos no incluye el ID: la columna c está en la posición c - 1
+                if columna > len(datos):
+                    continue
+                if len(datos[columna - 1]) >= self.TAMANO_MINIMO_BLOB:
+                    textos.append(datos[columna - 1])
+                    posiciones.append((i, columna - 1))
+                elif datos[columna - 1].startswith("@"):
+                    escapados.append((i, columna - 1))
+        if not textos and not escapados:
+            return filas
+        
+        filas = [(id_registro, list(datos)) for id_registro, datos in filas]
+        for i, posicion in escapados:
+            filas[i][1][posicion] = escapar(filas[i][1][posicion])
+        if textos:
+            for (i, posicion), referencia in zip(posiciones, self._obtener_segmento(archivo).guardar(textos)):
+                filas[i][1][posicion] = referencia
+        return filas
+    
+    def leer_campo(self, archivo: str, registro: List[str], columna: int) -> str:
+        """Valor de una columna del registro, leyendo del segmento de blobs si quedó aparte"""
+        valor = registro[columna]
+        if not valor.startswith("@") or columna not in self._columnas_blob(archivo):
+            return valor
+        if not es_referencia(valor):
+            return desescapar(valor)
+        if archivo in self._particiones:
+            archivo = self._particiones[archivo].particion_de_registro(registro)
+        return self._obtener_segmento(archivo).leer(valor)
+    
+    def resolver_registro(self, archivo: str, registro: List[str]) -> List[str]:
+        """Registro con todos sus textos largos leídos del segmento de blobs"""
+        columnas = [c for c in self._columnas_blob(archivo) if c < len(registro) and registro[c].startswith("@")]
+        if not columnas:
+            return registro
+        registro = list(registro)
+        for columna in columnas:
+            registro[columna] = self.leer_campo(archivo, registro, columna)
+        return registro
+    
+    @_lectura
+    def contar_activos(self, archivo: str, grupo: Optional[str] = None) -> Dict[Tuple[str, ...], int]:
+        """Devuelve los contadores mantenidos en cada escritura (sin recorrer el archivo)"""
+        contador = self._obtener_contador(archivo)
+        firma = self._obtener_indice(archivo).firma
+        if contador.firma != firma:
+            with self._mutex:
+                # Otro proceso pudo dejarlos al día en disco; si no, se vuelven a contar
+                if contador.firma != firma and not (contador.cargar() and contador.firma == firma):
+                    contador.reconstruir(self.iter_registros(archivo), firma)
+        return contador.conteos if grupo is None else contador.contar(grupo)
+    
+    def verificar_estadisticas(self, reparar: bool = True) -> Dict[str, bool]:
+        """Compara los contadores mantenidos con un recuento completo y los corrige si se pide"""
+        resultado = {}
+        for archivo in self.CONTADORES:
+            tabla = self._particiones.get(archivo)
+            archivos = tabla.particiones() if tabla is not None else [archivo]
+            resultado[archivo] = all([self._verificar_contador(a, reparar) for a in archivos])
+        return resultado
+    
+    def _verificar_contador(self, archivo: str, reparar: bool) -> bool:
+        """Verifica (y si se pide corrige) los contadores de un solo archivo"""
+        with self._obtener_bloqueo(archivo).exclusivo():
+            coincide = self.contar_activos(archivo) == super().contar_activos(archivo)
+            if not coincide and reparar:
+                self._obtener_contador(archivo).reconstruir(
+                    self.iter_registros(archivo), self._obtener_indice(archivo).firma)
+        return coincide
+    
+    def registrar_indice(self, archivo: str, columna: int):
+        """Declara un índice de búsqueda exacta sobre una columna del archivo"""
+        if archivo in self._particiones:
+            self._particiones[archivo].registrar_indice(columna)
+            return
+        self._indices_secundarios.setdefault(archivo, {}).setdefault(columna, IndiceSecundario(columna))
+    
+    def registrar_restriccion_unica(self, archivo: str, columna: int, columna_activo: Optional[int] = None):
+        """Declara una columna única; se comprueba con el bloqueo exclusivo del archivo tomado"""
+        if archivo in self._particiones:
+            # Cada partición tiene su propio bloqueo: no hay uno que abarque toda la tabla
+            raise ValueError(f"La tabla particionada {archivo} no admite columnas únicas")
+        super().registrar_restriccion_unica(archivo, columna, columna_activo)
+    
+    def registrar_indice_rango(self, archivo: str, columna: int):
+        """Declara un índice ordenado para las búsquedas por rango sobre una columna del archivo"""
+        if archivo in self._particiones:
+            self._particiones[archivo].registrar_indice_rango(columna)
+            return
+        self._indices_rango.setdefault(archivo, {}).setdefault(columna, IndiceRango(columna))
+    
+    def registrar_indice_texto(self, archivo: str, columnas: List[int]):
+        """Declara un índice de texto completo (persistente) sobre varias columnas del archivo"""
+        if archivo in self._particiones:
+            self._particiones[archivo].registrar_indice_texto(columnas)
+        elif archivo not in self._indices_texto:
+            indice = IndiceTexto(self._obtener_ruta_indice_texto(archivo), columnas)
+            indice.cargar()
+            self._indices_texto[archivo] = indice
+    
+    def _obtener_indice_secundario(self, archivo: str, columna: int) -> Optional[IndiceSecundario]:
+        """Devuelve el índice secundario de la columna al día con el archivo, si fue declarado"""
+        indice = self._indices_secundarios.get(archivo, {}).get(columna)
+        return self._al_dia(archivo, indice) if indice is not None else None
+    
+    def _obtener_indice_rango(self, archivo: str, columna: int) -> Optional[IndiceRango]:
+        """Devuelve el índice de rango de la columna al día con el archivo, si fue declarado"""
+        indice = self._indices_rango.get(archivo, {}).get(columna)
+        return self._al_dia(archivo, indice) if indice is not None else None
+    
+    def _obtener_secuencia(self, archivo: str) -> SecuenciaIds:
+        """Devuelve la secuencia de IDs del archivo cargada en memoria"""
+        secuencia = self._secuencias.get(archivo)
+        if secuencia is None:
+            secuencia = SecuenciaIds(self._obtener_ruta_secuencia(archivo))
+            secuencia.cargar()
+            self._secuencias[archivo] = secuencia
+        return secuencia
+    
+    def _obtener_siguiente_id(self, archivo: str) -> int:
+        """Obtiene el siguiente ID disponible"""
+        # Si la secuencia falta o quedó atrás (p. ej. se cortó antes de guardarla),
+        # se recupera con el mayor ID del índice de offsets
+        ultimo_id = self._obtener_indice(archivo).max_id
+        secuencia = self._obtener_secuencia(archivo)
+        # Otro proceso pudo avanzarla: se relee (bajo el bloqueo exclusivo) antes de asignar
+        secuencia.cargar()
+        return max(secuencia.siguiente, ultimo_id + 1)
+    
+    def _anexar_lineas(self, archivo: str, filas: List[Tuple[int, List[str]]],
+                       anteriores: Optional[Dict[int, List[str]]] = None, anotar: bool = True):
+        """Añade las filas al final del archivo en una sola escritura y las registra en el índice
+
+        anteriores tiene la versión previa de los registros que se actualizan o borran."""
+        if anotar:
+            self._anotar(archivo, [(id_registro, None if datos == [self.MARCA_BORRADO] else datos)
+                                   for id_registro, datos in filas])
+        # Los textos largos se escriben antes que las filas que los referencian
+        filas = self._separar_blobs(archivo, filas)
+        indice = self._obtener_indice(archivo)
+        firma_anterior = indice.firma
+        offset = firma_anterior[0]
+        entradas = []
+        bloque = []
+        for id_registro, datos in filas:
+            linea = f"{id_registro}{self.separador}{self.separador.join(datos)}\n".encode('utf-8')
+            entradas.append((id_registro, offset))
+            bloque.append(linea)
+            offset += len(linea)
+        
+        with open(self._obtener_ruta_archivo(archivo), 'ab') as f:
+            f.write(b"".join(bloque))
+        
+        firma = self._obtener_firma(archivo)
+        indice.agregar(entradas, firma)
+        cambios = [(id_registro, None if datos == [self.MARCA_BORRADO] else [str(id_registro)] + datos)
+                   for id_registro, datos in filas]
+        self._notificar_cambios(archivo, cambios, firma_anterior, firma, anteriores or {})
+        self._controlar_diario(archivo)
+        self._registrar_escritura()
+    
+    def _anexar_linea(self, archivo: str, id_registro: int, datos: List[str],
+                      anterior: Optional[List[str]] = None):
+        """Añade una línea al final del archivo y la registra en el índice de offsets"""
+        self._anexar_lineas(archivo, [(id_registro, datos)],
+                            {id_registro: anterior} if anterior is not None else None)
+    
+    def _es_lapida(self, registro: List[str]) -> bool:
+        """Indica si la línea es una marca de borrado"""
+        return len(registro) == 2 and registro[1] == self.MARCA_BORRADO
+    
+    @_escritura
     def insertar_registro(self, archivo: str, datos: List[str]) -> int:
         """Inserta un nuevo registro"""
+        self._verificar_unicos(archivo, [(None, datos)])
         nuevo_id = self._obtener_siguiente_id(archivo)
-        registro = f"{nuevo_id}{self.separador}{self.separador.join(datos)}\n"
-        
-        with open(self._obtener_ruta_archivo(archivo), 'a', encoding='utf-8') as f:
-            f.write(registro)
-        
+        self._anexar_linea(archivo, nuevo_id, datos)
+        self._obtener_secuencia(archivo).guardar(nuevo_id + 1)
         return nuevo_id
     
+    @_escritura
+    def insertar_registros(self, archivo: str, lista_datos: Iterable[List[str]]) -> List[int]:
+        """Inserta varios registros reservando un bloque contiguo de IDs y escribiendo una sola vez"""
+        lista_datos = list(lista_datos)
+        if not lista_datos:
+            return []
+        
+        self._verificar_unicos(archivo, [(None, datos) for datos in lista_datos])
+        primer_id = self._obtener_siguiente_id(archivo)
+        ids = list(range(primer_id, primer_id + len(lista_datos)))
+        self._anexar_lineas(archivo, list(zip(ids, lista_datos)))
+        self._obtener_secuencia(archivo).guardar(ids[-1] + 1)
+        return ids
+    
+    def _validar_cache(self, archivo: str) -> bool:
+        """Descarta la caché del archivo si cambió en disco. Devuelve False si no hay caché"""
+        if self._cache is None:
+            return False
+        self._cache.validar(archivo, self._obtener_firma(archivo))
+        return True
+    
+    @_lectura
     def obtener_registros(self, archivo: str) -> List[List[str]]:
-        """Obtiene todos los registros de un archivo"""
+        """Obtiene todos los registros de un archivo (la última versión de cada ID)"""
+        con_cache = self._validar_cache(archivo)
+        if con_cache:
+            versiones = self._cache.obtener(("tabla", archivo))
+            if versiones is not None:
+                return list(versiones.values())
+        
         try:
             with open(self._obtener_ruta_archivo(archivo), 'r', encoding='utf-8') as f:
-                registros = []
+                versiones = {}
                 for linea in f:
                     if linea.strip():
-                        registros.append(linea.strip().split(self.separador))
-                return registros
+                        registro = linea.strip().split(self.separador)
+                        versiones[registro[0]] = registro
         except FileNotFoundError:
             return []
+        versiones = {clave: registro for clave, registro in versiones.items() if not self._es_lapida(registro)}
+        
+        if con_cache:
+            tamano = sum(estimar_tamano(registro) for registro in versiones.values())
+            self._cache.guardar(archivo, ("tabla", archivo), versiones, tamano)
+        return list(versiones.values())
+    
+    def iter_registros(self, archivo: str) -> Iterator[List[str]]:
+        """Recorre los registros vigentes del archivo línea por línea, sin cargarlo completo"""
+        if archivo in self._particiones:
+            yield from self._particiones[archivo].iter_registros()
+            return
+        # El bloqueo sólo se mantiene mientras se abre el archivo, no durante el recorrido
+        with self._bloqueo_lectura(archivo):
+            indice = self._obtener_indice(archivo)
+            fin = indice.firma[0]  # lo que se escriba durante el recorrido no se incluye
+            # Si el archivo se reescribe durante el recorrido el índice pasa a otro
+            # diccionario; éste sigue describiendo la versión que se está leyendo
+            offsets = indice.offsets
+            lineas = self._recorrer_lineas(archivo)
+        
+        cambiados_durante = set()
+        for offset, linea in lineas:
+            if offset >= fin:
+                break
+            # Sólo la última versión de cada ID (la que apunta el índice) está vigente
+            id_registro = self._id_de_linea(linea)
+            if id_registro is None:
+                continue
+            offset_vigente = offsets.get(id_registro)
+            if offset_vigente != offset:
+                # Si el registro se actualizó durante el recorrido se entrega una sola vez
+                if offset_vigente is None or offset_vigente < fin or id_registro in cambiados_durante:
+                    continue
+                cambiados_durante.add(id_registro)
+                registro = self.obtener_registro_por_id(archivo, id_registro)
+                if registro is not None:
+                    yield registro
+                continue
+            registro = linea.decode('utf-8').strip().split(self.separador)
+            if not self._es_lapida(registro):
+                yield registro
     
+    @_lectura
     def obtener_registro_por_id(self, archivo: str, id_registro: int) -> Optional[List[str]]:
-        """Obtiene un registro específico por ID"""
-        registros = self.obtener_registros(archivo)
-        for registro in registros:
-            if int(registro[0]) == id_registro:
+        """Obtiene un registro específico por ID usando el índice de offsets"""
+        con_cache = self._validar_cache(archivo)
+        if con_cache:
+            versiones = self._cache.ver(("tabla", archivo))
+            registro = versiones.get(str(id_registro)) if versiones is not None else \
+                self._cache.obtener(("fila", archivo, id_registro))
+            if registro is not None:
                 return registro
-        return None
+        
+        indice = self._obtener_indice(archivo)
+        offset = indice.offsets.get(id_registro)
+        if offset is None:
+            return None
+        
+        registro = self._leer_linea(archivo, offset)
+        if registro is None or registro[0] != str(id_registro):
+            # Índice desfasado (archivo modificado externamente): se reconstruye una vez
+            self._reconstruir_indice(archivo, indice, self._obtener_firma(archivo))
+            offset = indice.offsets.get(id_registro)
+            registro = self._leer_linea(archivo, offset) if offset is not None else None
+        if registro is None or self._es_lapida(registro):
+            return None
+        if con_cache:
+            self._cache.guardar(archivo, ("fila", archivo, id_registro), registro, estimar_tamano(registro))
+        return registro
     
+    @_escritura
     def actualizar_registro(self, archivo: str, id_registro: int, nuevos_datos: List[str]) -> bool:
         """Actualiza un registro existente"""
+        self._verificar_unicos(archivo, [(id_registro, nuevos_datos)])
+        if self.modo_log:
+            anterior = self.obtener_registro_por_id(archivo, id_registro)
+            if anterior is None:
+                return False
+            self._anexar_linea(archivo, id_registro, nuevos_datos, anterior)
+            return True
+        
         registros = self.obtener_registros(archivo)
         encontrado = False
         
         for i, registro in enumerate(registros):
             if int(registro[0]) == id_registro:
+                self._anotar(archivo, [(id_registro, nuevos_datos)])
+                nuevos_datos = self._separar_blobs(archivo, [(id_registro, nuevos_datos)])[0][1]
                 registros[i] = [str(id_registro)] + nuevos_datos
                 encontrado = True
                 break
         
         if encontrado:
-            with open(self._obtener_ruta_archivo(archivo), 'w', encoding='utf-8') as f:
-                for registro in registros:
-                    f.write(self.separador.join(registro) + "\n")
+            self._reescribir_archivo(archivo, registros, [(id_registro, registros[i])],
+                                     {id_registro: registro})
         
         return encontrado
     
+    @_escritura
+    def eliminar_registro(self, archivo: str, id_registro: int) -> bool:
+        """Elimina físicamente un registro (en modo log añade una marca de borrado)"""
+        anterior = self.obtener_registro_por_id(archivo, id_registro)
+        if anterior is None:
+            return False
+        
+        if self.modo_log:
+            self._anexar_linea(archivo, id_registro, [self.MARCA_BORRADO], anterior)
+            return True
+        
+        self._anotar(archivo, [(id_registro, None)])
+        registros = [r for r in self.obtener_registros(archivo) if r[0] != str(id_registro)]
+        self._reescribir_archivo(archivo, registros, [(id_registro, None)], {id_registro: anterior})
+        return True
+    
+    @_lectura
     def buscar_registros(self, archivo: str, columna: int, valor: str) -> List[List[str]]:
         """Busca registros por valor en una columna específica"""
+        # El texto de una columna de blobs no está en el archivo mapeado
+        lector = self._obtener_lector(archivo) if columna not in self._columnas_blob(archivo) else None
+        if lector is not None:
+            return self._buscar_registros_mapeado(archivo, lector, columna, valor)
+        
         registros = self.obtener_registros(archivo)
         resultados = []
         
         for registro in registros:
-            if len(registro) > columna and valor.lower() in registro[columna].lower():
+            if len(registro) > columna and valor.lower() in self.leer_campo(archivo, registro, columna).lower():
                 resultados.append(registro)
         
         return resultados
+    
+    def _buscar_registros_mapeado(self, archivo: str, lector: LectorMapeado,
+                                  columna: int, valor: str) -> List[List[str]]:
+        """Busca sobre el archivo mapeado: sólo se decodifican las líneas donde aparece el valor"""
+        indice = self._obtener_indice(archivo)
+        separador = self.separador.encode('utf-8')
+        valor_minusculas = valor.lower()
+        resultados = []
+        
+        for inicio in lector.buscar(valor):
+            # Se descartan versiones antiguas sin decodificar la línea
+            id_registro = lector.entero_en(inicio, separador)
+            if id_registro is None or indice.offsets.get(id_registro) != inicio:
+                continue
+            registro = lector.linea(inicio).decode('utf-8').strip().split(self.separador)
+            if (not self._es_lapida(registro) and len(registro) > columna
+                    and valor_minusculas in registro[columna].lower()):
+                resultados.append(registro)
+        
+        return resultados
+    
+    def iter_registros_desde(self, archivo: str, despues_de: int = 0, columna: Optional[int] = None,
+                             valor: Optional[str] = None) -> Iterator[List[str]]:
+        """Recorre en orden de ID los registros con ID mayor que despues_de (paginación por cursor)
 
-
-    def obtener_estadisticas(self) -> Dict[str, int]:
-        """Obtiene estadísticas básicas del sistema"""
-        stats = {
-            'total_centros': 0,
-            'total_usuarios': 0,
-            'total_medicos': 0,
-            'total_pacientes': 0,
-            'total_expedientes': 0
-        }
+        Los IDs salen del índice de offsets (o del índice secundario de la columna) y los
+        registros se leen de a bloques, así que sólo se lee lo que se llega a recorrer."""
+        if archivo in self._particiones:
+            yield from self._particiones[archivo].iter_registros_desde(despues_de, columna, valor)
+            return
+        ultimo = despues_de
+        ids_con_valor = None
+        while True:
+            with self._bloqueo_lectura(archivo):
+                if columna is None:
+                    ids = self._obtener_indice(archivo).ids_ordenados()
+                else:
+                    if ids_con_valor is None:
+                        ids_con_valor = sorted(self._ids_con_valor(archivo, columna, valor))
+                    ids = ids_con_valor
+                # Se vuelve a ubicar el cursor en cada bloque por si hubo escrituras entre medio
+                posicion = bisect.bisect_right(ids, ultimo)
+                bloque = ids[posicion:posicion + self.TAMANO_BLOQUE_CURSOR]
+                if not bloque:
+                    return
+                registros = self.obtener_registros_por_ids(archivo, bloque)
+            
+            for registro in registros:
+                if columna is None or (len(registro) > columna
+                                       and self.leer_campo(archivo, registro, columna) == valor):
+                    yield registro
+            ultimo = bloque[-1]
+    
+    def _ids_con_valor(self, archivo: str, columna: int, valor: str) -> Iterable[int]:
+        """IDs de los registros con el valor exacto en la columna"""
+        indice = self._obtener_indice_secundario(archivo, columna)
+        if indice is not None:
+            return indice.buscar(valor)
+        return [int(registro[0]) for registro in self.buscar_registros_exactos(archivo, columna, valor)]
+    
+    @_lectura
+    def obtener_registros_por_ids(self, archivo: str, ids: Iterable[int]) -> List[List[str]]:
+        """Obtiene varios registros por ID abriendo el archivo una sola vez"""
+        if self._validar_cache(archivo):
+            versiones = self._cache.obtener(("tabla", archivo))
+            if versiones is not None:
+                encontrados = (versiones.get(str(i)) for i in ids)
+                return sorted((r for r in encontrados if r is not None), key=lambda registro: int(registro[0]))
+        
+        indice = self._obtener_indice(archivo)
+        offsets = sorted(indice.offsets[i] for i in ids if i in indice.offsets)
+        registros = []
+        lector = self._obtener_lector(archivo)
+        if lector is not None:
+            for offset in offsets:
+                registro = lector.linea(offset).decode('utf-8').strip().split(self.separador)
+                if not self._es_lapida(registro):
+                    registros.append(registro)
+            registros.sort(key=lambda registro: int(registro[0]))
+            return registros
+        
+        try:
+            with open(self._obtener_ruta_archivo(archivo), 'rb') as f:
+                for offset in offsets:
+                    f.seek(offset)
+                    registro = f.readline().decode('utf-8').strip().split(self.separador)
+                    if not self._es_lapida(registro):
+                        registros.append(registro)
+        except FileNotFoundError:
+            return []
+        registros.sort(key=lambda registro: int(registro[0]))
+        return registros
+    
+    @_lectura
+    def buscar_registros_exactos(self, archivo: str, columna: int, valor: str) -> List[List[str]]:
+        """Busca registros cuyo valor en la columna es exactamente el indicado"""
+        indice = self._obtener_indice_secundario(archivo, columna)
+        if indice is not None:
+            return self.obtener_registros_por_ids(archivo, indice.buscar(valor))
         
-        # Contar centros
-        centros = self.obtener_registros('centros')
-        stats['total_centros'] = len([c for c in centros if len(c) > 4 and c[4].lower() == 'true'])
-        
-        # Contar usuarios por tipo
-        usuarios = self.obtener_registros('usuarios')
-        for usuario in usuarios:
-            if len(usuario) > 7 and usuario[7].lower() == 'true':  # activo
-                stats['total_usuarios'] += 1
-                if len(usuario) > 4:
-                    if usuario[4] == 'medico':
-                        stats['total_medicos'] += 1
-                    elif usuario[4] == 'paciente':
-                        stats['total_pacientes'] += 1
-        
-        # Contar expedientes
-        expedientes = self.obtener_registros('expedientes')
-        stats['total_expedientes'] = len([e for e in expedientes if len(e) > 15 and e[15].lower() == 'true'])
-        
-        return stats
+        return [registro for registro in self.obtener_registros(archivo)
+                if len(registro) > columna and self.leer_campo(archivo, registro, columna) == valor]
+    
+    @_lectura
+    def buscar_rango(self, archivo: str, columna: int, desde: Optional[str] = None,
+                     hasta: Optional[str] = None, igual_a: Optional[Dict[int, str]] = None,
+                     descendente: bool = False, limite: Optional[int] = None) -> List[List[str]]:
+        """Registros con valor en la columna entre desde y hasta (incluidos), ordenados por ese valor
+        
+        Los extremos se ubican con bisect en el índice de rango; las condiciones de igual_a
+        con índice secundario se cruzan por ID y el resto se comprueba al leer, de a bloques
+        para dejar de leer en cuanto se llega al límite."""
+        indice = self._obtener_indice_rango(archivo, columna)
+        if indice is None:
+            return super().buscar_rango(archivo, columna, desde, hasta, igual_a, descendente, limite)
+        
+        ids = indice.buscar(desde, hasta)
+        if descendente:
+            ids.reverse()
+        condiciones = {}
+        for c, valor in (igual_a or {}).items():
+            secundario = self._obtener_indice_secundario(archivo, c)
+            if secundario is None:
+                condiciones[c] = valor
+            else:
+                permitidos = secundario.buscar(valor)
+                ids = [id_registro for id_registro in ids if id_registro in permitidos]
+        
+        resultados = []
+        for inicio in range(0, len(ids), self.TAMANO_BLOQUE_CURSOR):
+            bloque = ids[inicio:inicio + self.TAMANO_BLOQUE_CURSOR]
+            por_id = {int(registro[0]): registro for registro in self.obtener_registros_por_ids(archivo, bloque)}
+            for id_registro in bloque:
+                registro = por_id.get(id_registro)
+                if registro is not None and all(len(registro) > c and self.leer_campo(archivo, registro, c) == v
+                                                for c, v in condiciones.items()):
+                    resultados.append(registro)
+                    if limite is not None and len(resultados) >= limite:
+                        return resultados
+        return resultados
+    
+    @_lectura
+    def estimar_exactos(self, archivo: str, columna: int, valor: str) -> Optional[int]:
+        """Tamaño de la entrada del índice secundario (None si la columna no tiene)"""
+        indice = self._obtener_indice_secundario(archivo, columna)
+        return len(indice.buscar(valor)) if indice is not None else None
+    
+    @_lectura
+    def estimar_rango(self, archivo: str, columna: int, desde: Optional[str] = None,
+                      hasta: Optional[str] = None) -> Optional[int]:
+        """Posiciones del rango en el índice ordenado (None si la columna no tiene)"""
+        indice = self._obtener_indice_rango(archivo, columna)
+        return indice.contar(desde, hasta) if indice is not None else None
+    
+    @_lectura
+    def estimar_texto(self, archivo: str, consulta: str) -> Optional[int]:
+        """IDs que da el índice de texto, sin leer los registros"""
+        indice = self._indices_texto.get(archivo)
+        return len(self._al_dia(archivo, indice).buscar(consulta)) if indice is not None else None
+    
+    @_lectura
+    def buscar_texto(self, archivo: str, consulta: str) -> List[List[str]]:
+        """Busca registros que contengan todas las palabras de la consulta (sin distinguir acentos)"""
+        indice = self._indices_texto.get(archivo)
+        if indice is None:
+            raise ValueError(f"El archivo {archivo} no tiene índice de texto")
+        return self.obtener_registros_por_ids(archivo, self._al_dia(archivo, indice).buscar(consulta))
 
 
 def obtener_fecha_actual() -> str:
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MiClinica - Módulo de Diario de Escrituras
+Registro previo (write-ahead log) de los cambios de un archivo DAT para recuperarlo tras un corte
+"""
+
+import json
+import os
+import threading
+import zlib
+from typing import Iterator, List, Optional, Tuple
+
+# Cambio anotado: (ID, datos sin el ID) o (ID, None) si el registro se borra
+Cambio = Tuple[int, Optional[List[str]]]
+
+
+class DiarioEscrituras:
+    """Diario de sólo anexado con la versión final de cada registro que se escribe
+
+    Cada entrada es una línea "crc32 json" con los cambios de una operación y se anota
+    antes de tocar el archivo de datos. Al abrir, las entradas que no llegaron al archivo
+    se vuelven a aplicar; una entrada cortada (sin fin de línea o con otro crc) marca el
+    final del diario. Cuando el archivo de datos está en disco el diario se vacía.
+    """
+
+    def __init__(self, ruta_diario: str):
+        self.ruta = ruta_diario
+        self._pendiente = False  # hay entradas sin fsync
+        self._mutex = threading.Lock()
+
+    def anotar(self, cambios: List[Cambio]):
+        """Añade una entrada con los cambios de una operación"""
+        contenido = json.dumps(cambios, ensure_ascii=False, separators=(",", ":")).encode('utf-8')
+        with open(self.ruta, 'ab') as f:
+            f.write(b"%08x " % zlib.crc32(contenido) + contenido + b"\n")
+        self._pendiente = True
+
+    def sincronizar(self):
+        """Fuerza a disco las entradas anotadas (fsync), si hay alguna sin sincronizar"""
+        with self._mutex:
+            if not self._pendiente:
+                return
+            self._pendiente = False
+            try:
+                with open(self.ruta, 'rb') as f:
+                    os.fsync(f.fileno())
+            except FileNotFoundError:
+                pass
+
+    def entradas(self) -> Iterator[List[Cambio]]:
+        """Recorre las entradas completas del diario, en orden"""
+        try:
+            f = open(self.ruta, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            for linea in f:
+                if not linea.endswith(b"\n") or len(linea) < 10:
+                    return
+                crc, contenido = linea[:8], linea[9:-1]
+                try:
+                    if int(crc, 16) != zlib.crc32(contenido):
+                        return
+                    cambios = json.loads(contenido.decode('utf-8'))
+                except ValueError:
+                    return
+                yield [(int(id_registro), datos) for id_registro, datos in cambios]
+
+    def tamano(self) -> int:
+        """Tamaño en bytes del diario"""
+        try:
+            return os.path.getsize(self.ruta)
+        except FileNotFoundError:
+            return 0
+
+    def vaciar(self):
+        """Descarta las entradas: los cambios ya están en el archivo de datos"""
+        with self._mutex:
+            if os.path.exists(self.ruta):
+                os.truncate(self.ruta, 0)
+            self._pendiente = False
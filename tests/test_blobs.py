@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MiClinica - Pruebas de los textos largos guardados en el segmento de blobs
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from dao.expediente_dao import ExpedienteDAO
+from modulos.expediente import Expediente
+from modulos.utils import FileManager
+
+
+class TestSegmentoBlobs(unittest.TestCase):
+    """Un texto escrito por el usuario nunca se interpreta como referencia a otro texto"""
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.file_manager = FileManager(self.directorio)
+        self.dao = ExpedienteDAO(self.file_manager)
+        # Historia clínica larga de otro paciente, guardada en el segmento desde el offset 0
+        self.ajena = self.dao.crear_expediente(Expediente(id_paciente=1, id_centro=1,
+                                                          historia_clinica="confidencial " * 40))
+
+    def tearDown(self):
+        self.file_manager.cerrar()
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+    def _comprobar(self, id_expediente: int, textos: dict):
+        completo = self.dao.obtener_expediente_por_id(id_expediente)
+        diferido = next(e for e in self.dao.iter_expedientes() if e.id_expediente == id_expediente)
+        for campo, texto in textos.items():
+            self.assertEqual(getattr(completo, campo), texto)
+            self.assertEqual(getattr(diferido, campo), texto)
+
+    def test_texto_con_forma_de_referencia(self):
+        textos = {'historia_clinica': "@blob:0:40:txt", 'consentimientos': "@@blob:0:40:zlib",
+                  'reporte_examenes': "@ revisar"}
+        id_expediente = self.dao.crear_expediente(Expediente(id_paciente=2, id_centro=1, **textos))
+        self._comprobar(id_expediente, textos)
+
+        # Al actualizar, mover de centro y volver a abrir se conserva el texto tal cual
+        expediente = self.dao.obtener_expediente_por_id(id_expediente)
+        expediente.id_centro = 2
+        self.dao.actualizar_expediente(expediente)
+        self._comprobar(id_expediente, textos)
+        self.file_manager.cerrar()
+        self.file_manager = FileManager(self.directorio)
+        self.dao = ExpedienteDAO(self.file_manager)
+        self._comprobar(id_expediente, textos)
+        self.assertEqual(self.dao.obtener_expediente_por_id(self.ajena).historia_clinica, "confidencial " * 40)
+
+    def test_texto_largo_se_recupera(self):
+        texto = "@blob:" + "x" * 400
+        id_expediente = self.dao.crear_expediente(Expediente(id_paciente=2, id_centro=1, historia_clinica=texto))
+        self._comprobar(id_expediente, {'historia_clinica': texto})
+        self.assertEqual([e.id_expediente for e in self.dao.buscar_expedientes("confidencial")], [self.ajena])
+
+
+if __name__ == '__main__':
+    unittest.main()
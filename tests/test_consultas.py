@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MiClinica - Pruebas de las consultas de los DAO con el planificador
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from dao.expediente_dao import ExpedienteDAO
+from dao.usuario_dao import UsuarioDAO
+from modulos.expediente import Expediente
+from modulos.sqlite_manager import SQLiteManager
+from modulos.usuario import Usuario
+from modulos.utils import FileManager
+
+
+class TestConsultas(unittest.TestCase):
+    """Filtros de activo con cualquier combinación de mayúsculas, en ambos motores"""
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+    def _motores(self):
+        yield FileManager(os.path.join(self.directorio, "dat"))
+        yield SQLiteManager(os.path.join(self.directorio, "miclinica.db"))
+
+    def _expediente(self, activo: str, fecha: str):
+        datos = Expediente(id_paciente=1, id_medico=2, id_centro=1, diagnostico="gripe",
+                           fecha_creacion=fecha, fecha_modificacion=fecha).to_list()
+        datos[ExpedienteDAO.COLUMNAS['activo'] - 1] = activo
+        return datos
+
+    def test_activo_sin_distinguir_mayusculas(self):
+        for motor in self._motores():
+            with self.subTest(motor=type(motor).__name__):
+                dao = ExpedienteDAO(motor)
+                # Filas escritas por versiones anteriores o a mano
+                for i, activo in enumerate(("True", "true", "TRUE", "False", "false")):
+                    motor.insertar_registro(dao.archivo, self._expediente(activo, f"2024-01-0{i + 1} 10:00:00"))
+
+                self.assertEqual([e.id_expediente for e in dao.consultar()], [1, 2, 3])
+                self.assertEqual([e.id_expediente for e in dao.consultar(activo=False)], [4, 5])
+                self.assertEqual([e.id_expediente for e in dao.consultar(id_medico=2, texto="gripe")], [1, 2, 3])
+                self.assertEqual([e.id_expediente for e in dao.obtener_expedientes_recientes(limite=2)], [3, 2])
+                self.assertEqual([e.id_expediente for e in dao.obtener_expedientes_por_rango(
+                    "2024-01-02", "2024-01-05", id_medico=2)], [2, 3])
+                self.assertIn("activo = 'true'", dao.explicar_consulta(id_medico=2))
+
+                usuarios = UsuarioDAO(motor)
+                motor.insertar_registro(usuarios.archivo, ["Ana", "Ruiz", "a@x", "medico", "", "1", "true", ""])
+                self.assertEqual([u.nombre for u in usuarios.obtener_medicos_por_centro(1)], ["Ana"])
+                motor.cerrar()
+
+    def test_columnas_segun_el_archivo(self):
+        expediente = Expediente(7, 1, 2, 3, *(f"texto {i}" for i in range(11)), True, "2024-01-01", "2024-01-02")
+        usuario = Usuario(7, "Ana", "Ruiz", "a@x", "medico", "clave", 3, True, "2024-01-01")
+        for modelo, columnas in ((expediente, ExpedienteDAO.COLUMNAS), (usuario, UsuarioDAO.COLUMNAS)):
+            fila = ["7"] + modelo.to_list()
+            self.assertEqual(len(columnas), len(fila))
+            for campo, columna in columnas.items():
+                self.assertEqual(str(getattr(modelo, campo)), fila[columna], campo)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MiClinica - Pruebas de la recuperación con el diario de escrituras (.wal)
+"""
+
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from dao.expediente_dao import ExpedienteDAO
+from dao.usuario_dao import UsuarioDAO
+from modulos.expediente import Expediente
+from modulos.usuario import Usuario
+from modulos.utils import FileManager
+
+
+def _escribir_y_cortar(directorio: str, caso: str, modo_log: bool):
+    """Proceso que escribe y se corta a mitad de una escritura (sin cerrar nada)"""
+    file_manager = FileManager(directorio, modo_log=modo_log)
+    UsuarioDAO(file_manager).crear_usuarios_lote(
+        Usuario(nombre=f"u{i}", email=f"u{i}@x", id_centro=1) for i in range(10))
+    ExpedienteDAO(file_manager).crear_expedientes_lote(
+        Expediente(id_centro=1, historia_clinica="h" * 400) for _ in range(5))
+    if caso == "antes_de_aplicar":
+        # Ya anotado en el diario, todavía sin tocar el archivo de datos
+        file_manager._separar_blobs = lambda archivo, filas: os._exit(0)
+        file_manager.insertar_registro('usuarios', Usuario(nombre="perdido", email="p@x", id_centro=1).to_list())
+    elif caso == "reemplazo":
+        # La reescritura deja el temporal completo pero no llega a reemplazar el archivo
+        os.replace = lambda origen, destino: os._exit(0)
+        file_manager.actualizar_registro('usuarios', 3, Usuario(nombre="nuevo", email="u2@x", id_centro=1).to_list())
+    elif caso == "linea_cortada":
+        file_manager.actualizar_registro('expedientes', 2, Expediente(
+            id_centro=1, diagnostico="editado", historia_clinica="z" * 500).to_list())
+        ruta = os.path.join(directorio, "expedientes", "centro_1.dat")
+        if modo_log:
+            os.truncate(ruta, os.path.getsize(ruta) - 7)
+    os._exit(0)
+
+
+class TestRecuperacion(unittest.TestCase):
+    """Un proceso cortado a mitad de una escritura no pierde ni duplica registros"""
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+    def _cortar(self, caso: str, modo_log: bool) -> FileManager:
+        proceso = multiprocessing.Process(target=_escribir_y_cortar, args=(self.directorio, caso, modo_log))
+        proceso.start()
+        proceso.join()
+        return FileManager(self.directorio, modo_log=modo_log)
+
+    def _comprobar_recuperado(self, file_manager: FileManager):
+        self.assertEqual(file_manager.verificar_estadisticas(reparar=False),
+                         {'centros': True, 'usuarios': True, 'expedientes': True})
+        for raiz, _, nombres in os.walk(self.directorio):
+            for nombre in nombres:
+                self.assertFalse(nombre.endswith(".tmp"), nombre)
+                if nombre.endswith(".wal"):
+                    self.assertEqual(os.path.getsize(os.path.join(raiz, nombre)), 0, nombre)
+
+    def test_escritura_anotada_sin_aplicar(self):
+        for modo_log in (False, True):
+            with self.subTest(modo_log=modo_log):
+                file_manager = self._cortar("antes_de_aplicar", modo_log)
+                self.assertEqual(file_manager.recuperados, {'usuarios': 1})
+                self.assertEqual(UsuarioDAO(file_manager).obtener_usuario_por_id(11).nombre, "perdido")
+                self._comprobar_recuperado(file_manager)
+                file_manager.cerrar()
+                self.tearDown()
+                self.setUp()
+
+    def test_reescritura_sin_reemplazo(self):
+        file_manager = self._cortar("reemplazo", False)
+        usuarios = UsuarioDAO(file_manager)
+        self.assertEqual(usuarios.obtener_usuario_por_id(3).nombre, "nuevo")
+        self.assertEqual(len(usuarios.obtener_todos_usuarios()), 10)
+        self._comprobar_recuperado(file_manager)
+        file_manager.cerrar()
+
+    def test_linea_cortada(self):
+        for modo_log in (False, True):
+            with self.subTest(modo_log=modo_log):
+                file_manager = self._cortar("linea_cortada", modo_log)
+                expedientes = ExpedienteDAO(file_manager)
+                expediente = expedientes.obtener_expediente_por_id(2)
+                self.assertEqual((expediente.diagnostico, expediente.historia_clinica), ("editado", "z" * 500))
+                self.assertEqual(len(expedientes.obtener_todos_expedientes()), 5)
+                self._comprobar_recuperado(file_manager)
+                file_manager.cerrar()
+                self.tearDown()
+                self.setUp()
+
+    def test_entrada_cortada_del_diario(self):
+        file_manager = FileManager(self.directorio)
+        file_manager.insertar_registro('centros', ["a", "d", "t", "True"])
+        file_manager.insertar_registro('centros', ["b", "d", "t", "True"])
+        with open(os.path.join(self.directorio, "centros.wal"), 'ab') as f:
+            f.write(b'deadbeef [[3,["c"')
+
+        recuperado = FileManager(self.directorio)
+        self.assertIsNone(recuperado.obtener_registro_por_id('centros', 3))
+        self.assertEqual(recuperado.obtener_registro_por_id('centros', 2)[1], "b")
+        recuperado.cerrar()
+        file_manager.cerrar()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MiClinica - Pruebas de la escritura agrupada
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from modulos.escritor import EscrituraNoSincronizada
+from modulos.utils import FileManager
+
+
+class TestEscritorAgrupado(unittest.TestCase):
+    """Resultados de los futuros cuando el lote se aplica pero no se puede sincronizar"""
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.file_manager = FileManager(self.directorio, escritura_agrupada=True)
+
+    def tearDown(self):
+        self.file_manager.cerrar()
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+    def test_lote_aplicado(self):
+        futuros = [self.file_manager.enviar_escritura('insertar_registro', 'centros', [f"c{i}", "d", "t", "True"])
+                   for i in range(5)]
+        self.assertEqual(sorted(futuro.result() for futuro in futuros), [1, 2, 3, 4, 5])
+
+    def test_fallo_de_sincronizacion_no_se_informa_como_fallo(self):
+        id_centro = self.file_manager.insertar_registro('centros', ["c", "d", "t", "True"])
+
+        def sincronizar(archivo):
+            raise OSError("disco lleno")
+        self.file_manager.sincronizar = sincronizar
+
+        insercion = self.file_manager.enviar_escritura('insertar_registro', 'centros', ["n", "d", "t", "True"])
+        actualizacion = self.file_manager.enviar_escritura('actualizar_registro', 'centros', id_centro,
+                                                           ["c2", "d", "t", "True"])
+
+        with self.assertRaises(EscrituraNoSincronizada) as error:
+            insercion.result()
+        self.assertEqual(error.exception.resultado, id_centro + 1)
+        self.assertIsInstance(error.exception.causa, OSError)
+        with self.assertRaises(EscrituraNoSincronizada):
+            actualizacion.result()
+
+        # Las escrituras sí quedaron aplicadas: repetirlas duplicaría la fila
+        self.assertEqual(self.file_manager.obtener_registro_por_id('centros', id_centro + 1)[1], "n")
+        self.assertEqual(self.file_manager.obtener_registro_por_id('centros', id_centro)[1], "c2")
+        del self.file_manager.sincronizar
+
+
+if __name__ == '__main__':
+    unittest.main()
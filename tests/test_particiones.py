@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MiClinica - Pruebas de la tabla de expedientes particionada por centro
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from dao.expediente_dao import ExpedienteDAO
+from modulos.expediente import Expediente
+from modulos.utils import FileManager
+
+
+class TestTablaParticionada(unittest.TestCase):
+    """Asignación de IDs y recorrido de expedientes repartidos en varias particiones"""
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.file_manager = FileManager(self.directorio)
+        self.dao = ExpedienteDAO(self.file_manager)
+
+    def tearDown(self):
+        self.file_manager.cerrar()
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+    def _crear(self, id_centro: int, diagnostico: str) -> int:
+        return self.dao.crear_expediente(Expediente(id_paciente=1, id_medico=1, id_centro=id_centro,
+                                                    diagnostico=diagnostico))
+
+    def test_secuencia_atrasada_no_reutiliza_ids(self):
+        for i in range(1, 6):
+            self.assertEqual(self._crear(i % 2, f"original {i}"), i)
+        # Una secuencia que quedó atrás (p. ej. se perdió al cortarse la luz) no manda
+        with open(os.path.join(self.directorio, "expedientes.seq"), 'w', encoding='utf-8') as f:
+            f.write("2\n")
+        self.file_manager._secuencias.clear()
+
+        self.assertEqual(self._crear(0, "nuevo"), 6)
+        self.assertEqual(self.dao.obtener_expediente_por_id(2).diagnostico, "original 2")
+        self.assertEqual(self.dao.obtener_expediente_por_id(6).diagnostico, "nuevo")
+
+    def test_secuencia_atrasada_al_abrir(self):
+        for i in range(1, 6):
+            self._crear(i % 2, f"original {i}")
+        self.file_manager.cerrar()
+        with open(os.path.join(self.directorio, "expedientes.seq"), 'w', encoding='utf-8') as f:
+            f.write("2\n")
+
+        self.file_manager = FileManager(self.directorio)
+        self.dao = ExpedienteDAO(self.file_manager)
+        self.assertEqual(self._crear(1, "nuevo"), 6)
+        self.assertEqual(self.dao.obtener_expediente_por_id(2).diagnostico, "original 2")
+
+    def test_iter_registros_intercala_por_id(self):
+        for i in range(12):
+            self._crear(i % 3, f"expediente {i}")
+        # Mover un expediente de centro y actualizar otro deja versiones al final de las particiones
+        movido = self.dao.obtener_expediente_por_id(2)
+        movido.id_centro = 2
+        self.dao.actualizar_expediente(movido)
+        actualizado = self.dao.obtener_expediente_por_id(4)
+        actualizado.tratamiento = "reposo"
+        self.dao.actualizar_expediente(actualizado)
+
+        ids = [int(registro[0]) for registro in self.file_manager.iter_registros("expedientes")]
+        self.assertEqual(ids, list(range(1, 13)))
+        self.assertGreater(len(self.file_manager._particiones["expedientes"].particiones()), 1)
+
+    def test_iter_registros_intercala_por_id_en_modo_log(self):
+        self.file_manager.cerrar()
+        self.file_manager = FileManager(self.directorio, modo_log=True)
+        self.dao = ExpedienteDAO(self.file_manager)
+        self.test_iter_registros_intercala_por_id()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MiClinica - Pruebas del motor SQLite y de la importación desde archivos DAT
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from dao.expediente_dao import ExpedienteDAO
+from modulos.expediente import Expediente
+from modulos.sqlite_manager import SQLiteManager
+from modulos.utils import FileManager
+
+
+class TestImportacion(unittest.TestCase):
+    """Importación de los archivos DAT a SQLite"""
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.origen = FileManager(os.path.join(self.directorio, "dat"))
+        ExpedienteDAO(self.origen).crear_expedientes_lote(
+            Expediente(id_paciente=i, id_centro=i % 3, diagnostico=f"gripe {i}", historia_clinica="h" * 300)
+            for i in range(10))
+        self.origen.insertar_registro('centros', ["Centro", "Calle 1", "555"])
+        self.ruta_db = os.path.join(self.directorio, "miclinica.db")
+        self.destino = SQLiteManager(self.ruta_db)
+
+    def tearDown(self):
+        self.origen.cerrar()
+        self.destino.cerrar()
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+    def test_importa_por_lotes(self):
+        self.destino.TAMANO_LOTE_IMPORTACION = 3
+        dao = ExpedienteDAO(self.destino)
+        totales = self.destino.importar_desde(self.origen, ['expedientes', 'centros'])
+
+        self.assertEqual(totales, {'expedientes': 10, 'centros': 1})
+        self.assertEqual([e.id_expediente for e in dao.obtener_todos_expedientes()], list(range(1, 11)))
+        self.assertEqual(dao.obtener_expediente_por_id(4).historia_clinica, "h" * 300)
+        self.assertEqual([e.id_expediente for e in dao.buscar_expedientes("gripe 7")], [8])
+        self.assertEqual(self.destino.obtener_registro_por_id('centros', 1), ["1", "Centro", "Calle 1", "555"])
+        with self.assertRaises(ValueError):
+            self.destino.importar_desde(self.origen, ['centros'])
+
+    def test_tablas_del_indice_de_texto_no_son_archivos(self):
+        ExpedienteDAO(self.destino)
+        self.destino.importar_desde(self.origen, ['expedientes'])
+        self.destino.cerrar()
+
+        self.destino = SQLiteManager(self.ruta_db)
+        self.assertEqual(set(self.destino._columnas), {'expedientes'})
+
+
+if __name__ == '__main__':
+    unittest.main()